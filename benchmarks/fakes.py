@@ -0,0 +1,663 @@
+"""Local stand-ins for YouTube and Discord, so the music path can run offline
+
+- `AudioServer` serves generated WAV and Ogg Opus tracks over loopback HTTP
+- `FakeExtractor` replaces the extraction service with canned info dicts
+  pointing at those tracks, after a configurable delay
+- `FakeVoiceState` plays audio through naff's own Player, into a voice
+  gateway that records when every frame went out
+
+Without ffmpeg on the PATH, `LoopbackAudio` and `LoopbackOpusAudio` stand in
+for the ffmpeg backed audio classes and read the PCM or the Ogg pages
+straight off the server. Without libopus, the Player gets a `StubEncoder`.
+"""
+import asyncio
+import contextlib
+import logging
+import math
+import random
+import shutil
+import statistics
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.request
+import wave
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Optional
+
+from naff.api.http.http_client import BucketLock
+from naff.api.http.route import Route
+import naff.api.voice.player as naff_player
+from naff.api.voice.audio import AudioVolume, BaseAudio
+from naff.api.voice.opus import Encoder
+from naff.api.voice.player import Player
+
+import extensions.utils.extraction as extraction
+from extensions.utils.opus import OGG_PAGE_HEADER, OpusPassthroughAudio
+
+# 20ms of 48kHz stereo s16le, what naff's encoder asks for
+FRAME_SIZE = 3840
+FRAME_DELAY = 0.02
+SAMPLE_RATE = 48000
+SAMPLES_PER_FRAME = 960
+# Stream urls "expire" long after any benchmark ends
+EXPIRES_IN = 6 * 60 * 60
+# What the Player sends while the audio has nothing ready
+SILENCE = b"\xF8\xFF\xFE"
+# 20ms of 64kbps stereo CELT, only the size is realistic
+OPUS_PACKET = b"\xFC" + bytes(159)
+OPUS_PACKETS_PER_PAGE = 50
+
+
+class AudioServer:
+    """Serves `tracks` WAV and Ogg Opus files of `seconds` each from a temporary directory"""
+
+    def __init__(self, tracks: int = 4, seconds: float = 2):
+        self.tracks: int = tracks
+        self.seconds: float = seconds
+        self._directory = tempfile.TemporaryDirectory()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def __enter__(self) -> "AudioServer":
+        directory = Path(self._directory.name)
+        for track in range(self.tracks):
+            self._write_track(directory / f"{track}.wav", 220 * (track + 1))
+            self._write_opus_track(directory / f"{track}.wav", directory / f"{track}.ogg")
+
+        handler = partial(_QuietHandler, directory=self._directory.name)
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *_):
+        self._server.shutdown()
+        self._server.server_close()
+        self._directory.cleanup()
+
+    def _write_track(self, path: Path, frequency: int):
+        samples = int(self.seconds * SAMPLE_RATE)
+        tone = b"".join(
+            struct.pack("<hh", value, value)
+            for value in (
+                int(8000 * math.sin(2 * math.pi * frequency * i / SAMPLE_RATE))
+                for i in range(SAMPLE_RATE // frequency * 10)
+            )
+        )
+        with wave.open(str(path), "wb") as file:
+            file.setnchannels(2)
+            file.setsampwidth(2)
+            file.setframerate(SAMPLE_RATE)
+            # the tone repeats cleanly, so it's built once and tiled
+            frames = tone * (samples * 4 // len(tone) + 1)
+            file.writeframes(frames[: samples * 4])
+
+    def _write_opus_track(self, wav: Path, path: Path):
+        if shutil.which("ffmpeg"):
+            subprocess.run(  # noqa: S603 S607
+                ["ffmpeg", "-loglevel", "error", "-i", str(wav), "-c:a", "libopus", str(path)],
+                check=True,
+            )
+            return
+
+        # without ffmpeg nothing decodes it, the packets only have to be framed right
+        serial = 1
+        pages = [
+            _ogg_page(serial, 0, 0, [b"OpusHead" + bytes(11)], 0x02),
+            _ogg_page(serial, 1, 0, [b"OpusTags" + bytes(8)]),
+        ]
+        packets = int(self.seconds / FRAME_DELAY)
+        for sequence, first in enumerate(range(0, packets, OPUS_PACKETS_PER_PAGE), 2):
+            count = min(OPUS_PACKETS_PER_PAGE, packets - first)
+            granule = (first + count) * SAMPLES_PER_FRAME
+            header_type = 0x04 if first + count == packets else 0
+            pages.append(_ogg_page(serial, sequence, granule, [OPUS_PACKET] * count, header_type))
+        path.write_bytes(b"".join(pages))
+
+    def url(self, track: int, codec: str = "pcm") -> str:
+        host, port = self._server.server_address[:2]
+        expire = int(time.time()) + EXPIRES_IN
+        extension = "ogg" if codec == "opus" else "wav"
+        return f"http://{host}:{port}/{track % self.tracks}.{extension}?expire={expire}"
+
+
+def _ogg_page(
+    serial: int, sequence: int, granule: int, packets: list[bytes], header_type: int = 0
+) -> bytes:
+    lacing = bytearray()
+    for packet in packets:
+        lacing += b"\xFF" * (len(packet) // 255) + bytes((len(packet) % 255,))
+    # the crc is left at 0, OpusPassthroughAudio doesn't check it
+    header = OGG_PAGE_HEADER.pack(b"OggS", 0, header_type, granule, serial, sequence, 0, len(lacing))
+    return header + lacing + b"".join(packets)
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *_):
+        pass
+
+
+class FakeExtractor:
+    """Drop-in for the extraction service
+
+    Urls look like `bench:<n>`, `ytsearch:<anything>` or `playlist:<n>`,
+    every extraction waits `latency` seconds (give or take `jitter`), and
+    `failure_rate` of them raise like yt-dlp would. Tracks are served as
+    `codec`, "opus" like most of YouTube, or "pcm" to force transcoding.
+    """
+
+    def __init__(
+        self,
+        server: AudioServer,
+        latency: float = 0.2,
+        jitter: float = 0.05,
+        failure_rate: float = 0,
+        codec: str = "opus",
+    ):
+        self.server: AudioServer = server
+        self.latency: float = latency
+        self.jitter: float = jitter
+        self.failure_rate: float = failure_rate
+        self.codec: str = codec
+
+        self.pending: int = 0
+        self.running: int = 0
+        self.calls: int = 0
+
+    def install(self):
+        """Make every `get_extraction_service` call return this"""
+        extraction._service = self
+
+    def uninstall(self):
+        if extraction._service is self:
+            extraction._service = None
+
+    def shutdown(self):
+        pass
+
+    async def extract(self, link: str, options: dict, download: bool = False, **_) -> dict:
+        self.calls += 1
+        self.running += 1
+        try:
+            await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+        finally:
+            self.running -= 1
+
+        if random.random() < self.failure_rate:
+            raise extraction.WorkerError(f"ERROR: [bench] {link}: Video unavailable")
+
+        if link.startswith("playlist:"):
+            return {
+                "_type": "playlist",
+                "title": link,
+                "entries": [
+                    {"_type": "url", "url": f"bench:{i}", "title": f"Track {i}"}
+                    for i in range(int(link.partition(":")[2]))
+                ],
+            }
+        if link.startswith("ytsearch:"):
+            track = hash(link) % 10_000
+            return {"entries": [{"_type": "url", "url": f"bench:{track}", "title": link}]}
+        return self.info(int(link.partition(":")[2]))
+
+    def info(self, track: int) -> dict:
+        return {
+            "id": f"bench{track:06d}",
+            "extractor": "bench",
+            "url": self.server.url(track, self.codec),
+            "webpage_url": f"bench:{track}",
+            "original_url": f"bench:{track}",
+            "title": f"Track {track}",
+            "uploader": "bench",
+            "duration": math.ceil(self.server.seconds),
+            "acodec": "opus" if self.codec == "opus" else "pcm_s16le",
+        }
+
+
+class LoopbackAudio(BaseAudio):
+    """Reads the raw PCM of a served WAV file, for when ffmpeg isn't around"""
+
+    needs_encode = True
+    locked_stream = False
+
+    def __init__(self, src: str):
+        self.source: str = src
+        self.entry: Optional[dict] = None
+        self.volume: float = 0.5
+        self.ffmpeg_before_args: str = ""
+        self.ffmpeg_args: str = ""
+
+        self.buffer = bytearray()
+        self.downloaded: bool = False
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed: bool = False
+
+    @property
+    def audio_complete(self) -> bool:
+        return self.downloaded and not self.buffer
+
+    def pre_buffer(self, duration: int = 0) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._download, daemon=True)
+            self._thread.start()
+
+    def _download(self):
+        try:
+            with urllib.request.urlopen(self.source) as response:
+                response.read(44)  # the WAV header
+                while not self._closed and (chunk := response.read(FRAME_SIZE * 50)):
+                    with self._lock:
+                        self.buffer += chunk
+        finally:
+            self.downloaded = True
+
+    def read(self, frame_size: int) -> bytes:
+        self.pre_buffer()
+        with self._lock:
+            if len(self.buffer) < frame_size and not self.downloaded:
+                return b""
+            frame = bytes(self.buffer[:frame_size])
+            del self.buffer[:frame_size]
+        return frame
+
+    def cleanup(self) -> None:
+        self._closed = True
+
+
+# naff's Player only gives AudioVolume the voice state's volume
+AudioVolume.register(LoopbackAudio)
+
+
+class _UrlProcess:
+    """Looks enough like the remuxing ffmpeg process for OpusPassthroughAudio"""
+
+    def __init__(self, url: str):
+        self.stdout = urllib.request.urlopen(url)  # noqa: S310
+        self.returncode: Optional[int] = None
+
+    def poll(self) -> Optional[int]:
+        return self.returncode
+
+    def kill(self):
+        self.returncode = -9
+        self.stdout.close()
+
+    def wait(self) -> int:
+        return self.returncode
+
+
+class LoopbackOpusAudio(OpusPassthroughAudio):
+    """Reads the Ogg pages of a served track itself, for when ffmpeg isn't around
+
+    Everything past the remuxer, splitting pages into packets and handing
+    them to the Player, is OpusPassthroughAudio's own code.
+    """
+
+    def _create_process(self, *, block: bool = True) -> None:
+        self.process = _UrlProcess(self.source)
+        self._reader = threading.Thread(target=self._read_pages, daemon=True)
+        self._reader.start()
+
+        if block:
+            self.initialised.wait()
+
+
+def patch_audio():
+    """Use the loopback audio classes where ffmpeg would be, returns the backend in use"""
+    if shutil.which("ffmpeg"):
+        return "ffmpeg"
+
+    import extensions.music.classes as classes
+    import extensions.new_music.tools as tools
+
+    classes.AudioVolume = LoopbackAudio
+    classes.OpusPassthroughAudio = LoopbackOpusAudio
+    tools.YTAudio = LoopbackAudio
+    tools.OpusPassthroughAudio = LoopbackOpusAudio
+    return "loopback"
+
+
+class StubEncoder:
+    """Stands in for naff's Encoder when libopus can't be loaded
+
+    `set_bitrate` clamps like the real one, so audio with a bad bitrate
+    still breaks the Player. Encoding just hands back a packet of the
+    right size, the CPU time libopus would take isn't measured.
+    """
+
+    frame_size = FRAME_SIZE
+    delay = FRAME_DELAY
+    samples_per_frame = SAMPLES_PER_FRAME
+
+    def __init__(self):
+        self.bitrate: int = 64
+
+    def set_bitrate(self, kbps: int) -> None:
+        self.bitrate = min(512, max(16, kbps))
+
+    def encode(self, pcm: bytes) -> bytes:
+        return OPUS_PACKET
+
+
+def _load_encoder() -> str:
+    try:
+        Encoder()
+    except Exception:
+        return "stub"
+    return "libopus"
+
+
+# what encodes the Player's PCM, libopus or StubEncoder
+ENCODER = _load_encoder()
+
+
+def make_player(audio: BaseAudio, state: "FakeVoiceState", loop: asyncio.AbstractEventLoop) -> Player:
+    """naff's Player, past its libopus and ffmpeg checks if this machine lacks them"""
+    with contextlib.ExitStack() as stack:
+        if ENCODER == "stub":
+            stack.enter_context(_patched(naff_player, "Encoder", StubEncoder))
+        if not shutil.which("ffmpeg"):
+            # the loopback audio doesn't need it
+            stack.enter_context(_patched(naff_player, "shutil", SimpleNamespace(which=str)))
+        return Player(audio, state, loop)
+
+
+@contextlib.contextmanager
+def _patched(module, name: str, value):
+    original = getattr(module, name)
+    setattr(module, name, value)
+    try:
+        yield
+    finally:
+        setattr(module, name, original)
+
+
+class _Stopping:
+    """Waits for the player to stop, if awaited
+
+    The legacy queue calls `voice.stop()` without awaiting it, the new one
+    awaits it like naff's, this works for both.
+    """
+
+    def __init__(self, voice: "FakeVoiceState"):
+        self.voice: FakeVoiceState = voice
+
+    def __await__(self):
+        return self.voice.wait_for_stopped().__await__()
+
+
+class FakeMessage:
+    def __init__(self, content: str):
+        self.content: str = content
+
+    async def edit(self, content: Optional[str] = None, **_):
+        if content is not None:
+            self.content = content
+        return self
+
+
+class FakeChannel:
+    """Both the text and the voice channel of a guild"""
+
+    def __init__(self, id: int, guild: "FakeGuild", client: "FakeBot"):
+        self.id: int = id
+        self.guild: FakeGuild = guild
+        self._client: FakeBot = client
+        self.name: str = f"bench-{id}"
+        self.bitrate: int = 64000
+        self.messages: list[FakeMessage] = []
+        self.voice_state: Optional[FakeVoiceState] = None
+
+    async def send(self, content: Optional[str] = None, *_, **__):
+        message = FakeMessage(content)
+        self.messages.append(message)
+        return message
+
+    async def connect(self) -> "FakeVoiceState":
+        self.voice_state.connected = True
+        return self.voice_state
+
+
+class FakeGuild:
+    def __init__(self, id: int):
+        self.id: int = id
+        self.name: str = f"Bench guild {id}"
+
+
+class FrameStats:
+    """What a voice state saw while playing, timings are perf_counter seconds"""
+
+    def __init__(self):
+        self.frames: int = 0
+        # silence sent because the audio had nothing ready
+        self.underruns: int = 0
+        # frames sent more than a frame late
+        self.late: int = 0
+        self.lateness: list[float] = []
+        self.first_frame: Optional[float] = None
+        self.tracks: list[tuple[float, float]] = []
+
+    @property
+    def gaps(self) -> list[float]:
+        """Silence between one track's last frame and the next one's first"""
+        return [
+            start - end
+            for (_, end), (start, _) in zip(self.tracks, self.tracks[1:])
+        ]
+
+    def summary(self) -> dict:
+        lateness = self.lateness or [0.0]
+        return {
+            "frames": self.frames,
+            "underruns": self.underruns,
+            "late_frames": self.late,
+            "jitter_ms": round(statistics.pstdev(lateness) * 1000, 3),
+            "max_late_ms": round(max(lateness) * 1000, 3),
+        }
+
+
+class FakeVoiceGateway:
+    """The parts of naff's VoiceGateway the Player uses, packets go to a FrameStats"""
+
+    logger = logging.getLogger("Myr.bench")
+
+    def __init__(self, state: "FakeVoiceState"):
+        self.state: FakeVoiceState = state
+        self.cond: Optional[threading.Condition] = None
+        self.ready = threading.Event()
+        self.ready.set()
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._start: Optional[float] = None
+        self._packets: int = 0
+        self._first: Optional[float] = None
+        self._last: Optional[float] = None
+
+    def begin(self, loop: asyncio.AbstractEventLoop):
+        """A new track starts playing"""
+        self._loop = loop
+        self._start = self._first = self._last = None
+        self._packets = 0
+
+    def end(self):
+        if self._first is not None:
+            self.state.stats.tracks.append((self._first, self._last))
+
+    async def speaking(self, is_speaking: bool = True):
+        pass
+
+    def send_packet(self, data: bytes, encoder, needs_encode: bool = True) -> None:
+        now = time.perf_counter()
+        stats = self.state.stats
+        if needs_encode:
+            data = encoder.encode(data)
+
+        if not needs_encode and data == SILENCE:
+            stats.underruns += 1
+        else:
+            stats.frames += 1
+            self._last = now
+            if self._first is None:
+                self._first = now
+                if stats.first_frame is None:
+                    stats.first_frame = now
+                    self._loop.call_soon_threadsafe(self.state.first_audio.set)
+
+        if self._start is None:
+            self._start = now
+        else:
+            lateness = now - (self._start + encoder.delay * self._packets)
+            stats.lateness.append(lateness)
+            if lateness > encoder.delay:
+                stats.late += 1
+        self._packets += 1
+
+
+class FakeVoiceState:
+    """Enough of ActiveVoiceState for both queues, playing goes through naff's Player"""
+
+    def __init__(self, guild: FakeGuild, channel: FakeChannel):
+        self.guild: FakeGuild = guild
+        self.channel: FakeChannel = channel
+        self.connected: bool = True
+        self.stats = FrameStats()
+        self.ws = FakeVoiceGateway(self)
+        self.player: Optional[Player] = None
+        self._volume: float = 0.5
+
+        self.first_audio = asyncio.Event()
+
+    @property
+    def volume(self) -> float:
+        return self._volume
+
+    @volume.setter
+    def volume(self, value: float):
+        self._volume = value
+        if self.player and hasattr(self.player.current_audio, "volume"):
+            self.player.current_audio.volume = value
+
+    @property
+    def playing(self) -> bool:
+        return self.player is not None and not self.player.stopped
+
+    @property
+    def current_audio(self) -> Optional[BaseAudio]:
+        return self.player.current_audio if self.player else None
+
+    async def play(self, audio: BaseAudio):
+        if self.player:
+            await self.stop()
+
+        loop = asyncio.get_running_loop()
+        self.ws.begin(loop)
+        with make_player(audio, self, loop) as self.player:
+            self.player.play()
+            try:
+                await self.wait_for_stopped()
+            finally:
+                self.ws.end()
+
+    async def wait_for_stopped(self):
+        player = self.player
+        if player is None:
+            return
+        # naff would wait forever on a player that died before its loop, fail loudly instead
+        while not player.stopped:
+            if not player.is_alive():
+                # give its last call_soon_threadsafe a chance to run
+                await asyncio.sleep(0.05)
+                if not player.stopped:
+                    raise RuntimeError(f"The Player died without stopping, playing {player.current_audio!r}")
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(player._stopped.wait(), 0.5)
+
+    def stop(self) -> _Stopping:
+        if self.player:
+            self.player.stop()
+        return _Stopping(self)
+
+    async def disconnect(self):
+        self.connected = False
+        if self.player:
+            self.player.stop()
+
+
+class FakeHTTP:
+    """Rate limits that never run out"""
+
+    def get_ratelimit(self, route: Route) -> BucketLock:
+        return BucketLock()
+
+
+class FakeBot:
+    """Looks guilds, channels and voice states up like the client does
+
+    Extensions can be created against it too, their commands just aren't
+    registered anywhere. Call them through `command.callback(ctx, ...)`.
+    """
+
+    logger = logging.getLogger("Myr.bench")
+
+    def __init__(self):
+        self.guilds: dict[int, FakeGuild] = {}
+        self.channels: dict[int, FakeChannel] = {}
+        self.voice_states: dict[int, FakeVoiceState] = {}
+        self.http = FakeHTTP()
+
+        self.ext: dict = {}
+        self.async_startup_tasks: list = []
+
+    def add_guild(self, guild_id: int) -> FakeVoiceState:
+        guild = self.guilds[guild_id] = FakeGuild(guild_id)
+        channel = self.channels[guild_id] = FakeChannel(guild_id, guild, self)
+        voice = self.voice_states[guild_id] = FakeVoiceState(guild, channel)
+        channel.voice_state = voice
+        return voice
+
+    def add_interaction(self, command) -> bool:
+        return True
+
+    def add_listener(self, listener):
+        pass
+
+    add_component_callback = add_modal_callback = add_listener
+    add_hybrid_command = add_prefixed_command = add_listener
+
+    def get_guild(self, guild_id: int) -> Optional[FakeGuild]:
+        return self.guilds.get(guild_id)
+
+    def get_channel(self, channel_id: int) -> Optional[FakeChannel]:
+        return self.channels.get(channel_id)
+
+    def get_bot_voice_state(self, guild_id: int) -> Optional[FakeVoiceState]:
+        voice = self.voice_states.get(guild_id)
+        return voice if voice is not None and voice.connected else None
+
+
+class FakeContext:
+    """An InteractionContext from someone sitting in the guild's vc"""
+
+    def __init__(self, bot: FakeBot, guild_id: int):
+        self.bot: FakeBot = bot
+        self.guild_id: int = guild_id
+        self.guild: FakeGuild = bot.guilds[guild_id]
+        self.channel: FakeChannel = bot.channels[guild_id]
+        self.author = SimpleNamespace(voice=SimpleNamespace(channel=self.channel))
+        self.responses: int = 0
+
+    @property
+    def voice_state(self) -> Optional[FakeVoiceState]:
+        return self.bot.get_bot_voice_state(self.guild_id)
+
+    async def defer(self, *_, **__):
+        pass
+
+    async def send(self, content: Optional[str] = None, *_, **__):
+        self.responses += 1
+        return FakeMessage(content)
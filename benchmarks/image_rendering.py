@@ -0,0 +1,75 @@
+"""Petpet and speech bubble renders/sec on the image worker pool
+
+Each level fires that many renders at once, over and over, against a pool of
+IMAGE_WORKERS processes. Output caching is left out, every render is real.
+
+Run from the repo root: python -m benchmarks.image_rendering [renders per level]
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+from extensions.misc.rendering import render_petpet, render_speech_bubble, warm
+from extensions.misc.workers import ImageWorkerPool
+
+CONCURRENCY = (1, 2, 4, 8, 16)
+
+
+def avatar(frames: int) -> bytes:
+    images = []
+    for i in range(frames):
+        image = Image.new("RGBA", (256, 256), (40, 40, 40, 255))
+        ImageDraw.Draw(image).ellipse((i * 4, 64, i * 4 + 96, 160), fill=(200, 80, 20, 255))
+        images.append(image)
+
+    stream = BytesIO()
+    if frames > 1:
+        images[0].save(stream, "GIF", save_all=True, append_images=images[1:], duration=40, loop=0)
+    else:
+        images[0].save(stream, "PNG")
+    return stream.getvalue()
+
+
+async def level(pool: ImageWorkerPool, func, data: bytes, concurrency: int, renders: int) -> float:
+    remaining = renders
+
+    async def client():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            await pool.run(func, data)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return renders / (time.perf_counter() - start)
+
+
+async def main(renders: int):
+    workers = int(os.getenv("IMAGE_WORKERS", 2))
+    pool = ImageWorkerPool(workers, initializer=warm)
+    cases = {
+        "petpet": (render_petpet, avatar(1)),
+        "speech_bubble_static": (render_speech_bubble, avatar(1)),
+        "speech_bubble_animated": (render_speech_bubble, avatar(40)),
+    }
+
+    results = {"workers": workers, "renders_per_level": renders}
+    for name, (func, data) in cases.items():
+        # spin the workers up before timing anything
+        await asyncio.gather(*(pool.run(func, data) for _ in range(workers)))
+        results[name] = {
+            concurrency: round(await level(pool, func, data, concurrency, renders), 1)
+            for concurrency in CONCURRENCY
+        }
+
+    pool.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 50))
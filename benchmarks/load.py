@@ -0,0 +1,292 @@
+"""Load test for the music cogs, to find how many guilds one process can serve
+
+Every level starts N fake guilds that issue /play, /skip, /queue show and
+playlist commands at random, `--rate` commands per guild per minute, against
+the fakes in benchmarks.fakes. Each guild plays through naff's own Player
+into a fake voice connection. For every level the test reports:
+- per-guild frame jitter and missed frames (underruns and frames sent late)
+- event loop lag
+- CPU and RSS
+- the latency of every command
+
+The first level that misses too many frames or lags the loop too far is
+reported as the knee.
+
+`--cog new` drives MusicCog through its real command callbacks. `--cog legacy`
+drives the SoundCog path through Queue and Extractor, since SoundCog's
+dis-snek style decorators don't load under naff 2. The new cog has no
+queue show or playlist commands, so those only run on the legacy path.
+
+Run from the repo root: python -m benchmarks.load [--help]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import random
+import resource
+import statistics
+import sys
+import time
+from collections import Counter, defaultdict
+from itertools import count
+from types import SimpleNamespace
+
+from benchmarks.fakes import (ENCODER, AudioServer, FakeBot, FakeContext, FakeExtractor,
+                             patch_audio)
+from extensions.music.classes import Queue
+from extensions.music.songlist import QueuePages
+from extensions.new_music.NewMusic import MusicCog
+
+# A level past either of these has gone over the knee
+KNEE_MISSED_RATIO = 0.01
+KNEE_LAG_MS = 50
+# How often the loop lag is sampled
+LAG_INTERVAL = 0.05
+PLAYLIST_SIZE = 10
+
+OPS = ("play", "skip", "queue_show", "playlist")
+WEIGHTS = (6, 2, 2, 1)
+
+_track_ids = count()
+
+
+class NewMusicDriver:
+    supported = ("play", "skip")
+
+    def __init__(self, bot: FakeBot):
+        self.bot: FakeBot = bot
+        self.cog = MusicCog(bot)
+
+    async def play(self, ctx: FakeContext):
+        await self.cog.play.callback(ctx, f"bench:{next(_track_ids)}")
+
+    async def skip(self, ctx: FakeContext):
+        await self.cog.skip.callback(ctx)
+
+
+class LegacyDriver:
+    supported = OPS
+
+    def __init__(self, bot: FakeBot):
+        self.bot: FakeBot = bot
+        self.scale = SimpleNamespace(bot=bot, queues=[])
+
+    def get_queue(self, ctx: FakeContext) -> Queue:
+        # SoundCog.get_queue
+        ctx.command = SimpleNamespace(scale=self.scale)
+        for queue in self.scale.queues:
+            if ctx.guild == queue.guild:
+                return queue
+
+        queue = Queue(ctx)
+        self.scale.queues.append(queue)
+        return queue
+
+    async def play(self, ctx: FakeContext):
+        # SoundCog.play
+        if not ctx.voice_state:
+            await ctx.author.voice.channel.connect()
+
+        queue = self.get_queue(ctx)
+        await queue.add(f"bench:{next(_track_ids)}")
+        await ctx.send("Added song")
+        queue.start()
+
+    async def skip(self, ctx: FakeContext):
+        # there's no /skip on SoundCog, this is what one would do
+        queue = self.get_queue(ctx)
+        if queue.running and queue.queue:
+            queue.skip()
+        await ctx.send("Skipped!")
+
+    async def queue_show(self, ctx: FakeContext):
+        # the first page is all the paginator renders up front
+        queue = self.get_queue(ctx)
+        page = QueuePages(queue.queue, queue.now_playing)[0]
+        await ctx.send(page.content)
+
+    async def playlist(self, ctx: FakeContext):
+        if not ctx.voice_state:
+            await ctx.author.voice.channel.connect()
+
+        queue = self.get_queue(ctx)
+        await queue.extractor.play_playlist(f"playlist:{PLAYLIST_SIZE}")
+        queue.start()
+
+
+DRIVERS = {"new": NewMusicDriver, "legacy": LegacyDriver}
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    # peak rather than current, but better than nothing
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def distribution(samples: list[float], scale: float = 1000) -> dict:
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "median": round(statistics.median(samples) * scale, 3),
+        "p95": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * scale, 3),
+        "p99": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * scale, 3),
+        "max": round(samples[-1] * scale, 3),
+    }
+
+
+async def measure_lag(samples: list[float]):
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + LAG_INTERVAL
+        await asyncio.sleep(LAG_INTERVAL)
+        samples.append(loop.time() - expected)
+
+
+async def guild_client(
+    driver, ctx: FakeContext, rate: float, deadline: float, latencies: dict, errors: Counter
+):
+    loop = asyncio.get_running_loop()
+    ops = [op for op in OPS if op in driver.supported]
+    weights = [weight for op, weight in zip(OPS, WEIGHTS) if op in driver.supported]
+
+    op = "play"
+    while loop.time() < deadline:
+        start = time.perf_counter()
+        try:
+            await getattr(driver, op)(ctx)
+        except Exception as e:
+            errors[f"{op}: {type(e).__name__}"] += 1
+        else:
+            latencies[op].append(time.perf_counter() - start)
+
+        await asyncio.sleep(random.expovariate(rate / 60))
+        op = random.choices(ops, weights)[0]
+
+
+async def run_level(args: argparse.Namespace, guilds: int) -> dict:
+    bot = FakeBot()
+    driver = DRIVERS[args.cog](bot)
+    contexts = []
+    for guild_id in range(1, guilds + 1):
+        bot.add_guild(guild_id)
+        contexts.append(FakeContext(bot, guild_id))
+
+    latencies: dict[str, list[float]] = defaultdict(list)
+    errors: Counter = Counter()
+    lag: list[float] = []
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + args.duration
+    lag_task = asyncio.create_task(measure_lag(lag))
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+
+    # spread the first commands over a second instead of all at once
+    async def delayed(ctx: FakeContext):
+        await asyncio.sleep(random.random())
+        await guild_client(driver, ctx, args.rate, deadline, latencies, errors)
+
+    await asyncio.gather(*(delayed(ctx) for ctx in contexts))
+
+    cpu = (time.process_time() - cpu_start) / (time.perf_counter() - wall_start)
+    rss = rss_mb()
+    lag_task.cancel()
+
+    for voice in bot.voice_states.values():
+        await voice.disconnect()
+    # the queues' own tasks outlive a disconnect while they're idle
+    for task in asyncio.all_tasks():
+        if task is not asyncio.current_task():
+            task.cancel()
+    await asyncio.sleep(0.2)
+
+    stats = [voice.stats for voice in bot.voice_states.values()]
+    frames = sum(s.frames for s in stats)
+    missed = sum(s.underruns + s.late for s in stats)
+    missed_ratio = missed / max(1, frames + sum(s.underruns for s in stats))
+    lag_p99 = distribution(lag)["p99"] if lag else 0
+
+    return {
+        "guilds": guilds,
+        "frames": frames,
+        "missed_frames": missed,
+        "missed_ratio": round(missed_ratio, 5),
+        "guild_jitter_ms": distribution(
+            [statistics.pstdev(s.lateness) for s in stats if len(s.lateness) > 1]
+        ),
+        "guild_missed_frames": distribution(
+            [s.underruns + s.late for s in stats], scale=1
+        ),
+        "loop_lag_ms": distribution(lag),
+        "cpu_percent": round(cpu * 100, 1),
+        "rss_mb": rss,
+        "command_latency_ms": {op: distribution(samples) for op, samples in latencies.items()},
+        "errors": dict(errors),
+        "healthy": missed_ratio <= KNEE_MISSED_RATIO and lag_p99 <= KNEE_LAG_MS,
+    }
+
+
+async def main(args: argparse.Namespace) -> dict:
+    levels = [int(level) for level in args.guilds.split(",")]
+
+    with AudioServer(tracks=8, seconds=args.seconds) as server:
+        extractor = FakeExtractor(
+            server, latency=args.latency, jitter=args.latency / 4, codec=args.codec
+        )
+        extractor.install()
+        backend = patch_audio()
+
+        results = []
+        try:
+            for guilds in levels:
+                results.append(await run_level(args, guilds))
+        finally:
+            extractor.uninstall()
+
+    knee = next((level["guilds"] for level in results if not level["healthy"]), None)
+    return {
+        "config": {
+            "cog": args.cog,
+            "audio": backend,
+            "encoder": ENCODER,
+            "codec": args.codec,
+            "duration": args.duration,
+            "rate_per_guild_per_min": args.rate,
+            "extraction_latency_ms": round(args.latency * 1000),
+        },
+        "knee": knee,
+        "levels": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cog", choices=DRIVERS, default="new")
+    parser.add_argument("--guilds", default="10,25,50,100,200", help="comma separated levels")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per level")
+    parser.add_argument("--rate", type=float, default=6, help="commands per guild per minute")
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds per extraction")
+    parser.add_argument("--seconds", type=float, default=20, help="length of every track")
+    parser.add_argument(
+        "--codec", choices=("opus", "pcm"), default="opus", help="opus passes through, pcm transcodes"
+    )
+    parser.add_argument("--output", help="write the JSON here as well as stdout")
+    args = parser.parse_args()
+
+    # MusicCog.play prints every song, keep stdout for the JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        results = asyncio.run(main(args))
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
@@ -0,0 +1,287 @@
+"""The music path end to end, without Discord or YouTube
+
+Extraction is served by benchmarks.fakes.FakeExtractor and audio by a
+loopback HTTP server, and it's played by naff's own Player into a fake
+voice connection. Reports, as JSON:
+
+- time to first audio for /play, cold and with the extraction cache warm,
+  on both the legacy queue and the naff_audio one
+- track transition gaps, from `Queue.transitions` and as heard by the voice state
+- playlist ingestion throughput of `Extractor.play_playlist`
+- the cost of queue operations on a long queue
+- whether the shared and passthrough audio make it through naff's Player,
+  the exit status is 1 if they don't
+
+Run from the repo root: python -m benchmarks.music_path [--help]
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from itertools import count
+from types import SimpleNamespace
+
+from naff.api.voice.audio import BaseAudio
+
+from benchmarks.fakes import (ENCODER, AudioServer, FakeBot, FakeExtractor, FakeVoiceState,
+                             patch_audio)
+import extensions.new_music.tools as tools
+from extensions.music.classes import Queue, Song
+from extensions.music.songlist import SONGS_PER_PAGE, QueuePages
+from extensions.new_music.tools import MusicQueue, audio_from_url
+
+_guild_ids = count(1)
+_track_ids = count(1000)
+
+
+def ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+
+def distribution(samples: list[float]) -> dict:
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "median_ms": ms(statistics.median(samples)),
+        "p95_ms": ms(samples[min(len(samples) - 1, int(len(samples) * 0.95))]),
+        "max_ms": ms(samples[-1]),
+    }
+
+
+def legacy_queue(bot: FakeBot) -> tuple[Queue, FakeVoiceState]:
+    guild_id = next(_guild_ids)
+    voice = bot.add_guild(guild_id)
+    scale = SimpleNamespace(bot=bot, queues=[])
+    ctx = SimpleNamespace(
+        bot=bot,
+        command=SimpleNamespace(scale=scale),
+        channel=voice.channel,
+        guild=voice.guild,
+    )
+    queue = Queue(ctx)
+    scale.queues.append(queue)
+    return queue, voice
+
+
+async def wait_until_idle(queue: Queue):
+    while queue.running:
+        await asyncio.sleep(0.05)
+
+
+async def first_audio_legacy(bot: FakeBot, track: int) -> float:
+    queue, voice = legacy_queue(bot)
+    start = time.perf_counter()
+    # what SoundCog.play does once the bot's in the vc
+    await queue.add(f"bench:{track}")
+    queue.start()
+    await voice.first_audio.wait()
+
+    elapsed = voice.stats.first_frame - start
+    voice.stop()
+    await wait_until_idle(queue)
+    return elapsed
+
+
+async def first_audio_new(bot: FakeBot, track: int) -> float:
+    voice = bot.add_guild(next(_guild_ids))
+    queue = MusicQueue(voice)
+    # started by hand so it can be cancelled, it never notices the disconnect while idle
+    task = asyncio.create_task(queue())
+
+    start = time.perf_counter()
+    # what MusicCog.play does once the bot's in the vc
+    audio = await audio_from_url(f"bench:{track}", passthrough=queue.passthrough)
+    audio.pre_buffer()
+    queue.put(audio)
+    await voice.first_audio.wait()
+
+    elapsed = voice.stats.first_frame - start
+    await voice.disconnect()
+    task.cancel()
+    return elapsed
+
+
+async def time_to_first_audio(bot: FakeBot, runs: int) -> dict:
+    results = {}
+    for name, play in (("legacy", first_audio_legacy), ("new_music", first_audio_new)):
+        cold = []
+        warm = []
+        for _ in range(runs):
+            track = next(_track_ids)
+            cold.append(await play(bot, track))
+            # the legacy extraction cache makes this one cheaper, the new path always extracts
+            warm.append(await play(bot, track))
+        results[name] = {"cold": distribution(cold), "warm": distribution(warm)}
+    return results
+
+
+async def transitions(bot: FakeBot, tracks: int) -> dict:
+    queue, voice = legacy_queue(bot)
+    for _ in range(tracks):
+        await queue.add(f"bench:{next(_track_ids)}")
+    queue.start()
+    await wait_until_idle(queue)
+
+    new_voice = bot.add_guild(next(_guild_ids))
+    new_queue = MusicQueue(new_voice)
+    for _ in range(tracks):
+        new_queue.put(await audio_from_url(f"bench:{next(_track_ids)}", new_queue.passthrough))
+    task = asyncio.create_task(new_queue())
+    while len(new_voice.stats.tracks) < tracks:
+        await asyncio.sleep(0.05)
+    await new_voice.disconnect()
+    task.cancel()
+
+    return {
+        "legacy": {
+            "queue_transitions": distribution(list(queue.transitions)),
+            "audible_gaps": distribution(voice.stats.gaps),
+            "playback": voice.stats.summary(),
+        },
+        "new_music": {
+            "audible_gaps": distribution(new_voice.stats.gaps),
+            "playback": new_voice.stats.summary(),
+        },
+    }
+
+
+async def playlist_ingestion(bot: FakeBot, entries: int) -> dict:
+    queue, _ = legacy_queue(bot)
+    # keeps play_playlist from starting playback, only ingestion is timed
+    queue.running = True
+
+    start = time.perf_counter()
+    await queue.extractor.play_playlist(f"playlist:{entries}")
+    elapsed = time.perf_counter() - start
+
+    return {
+        "entries": entries,
+        "queued": len(queue),
+        "seconds": round(elapsed, 3),
+        "entries_per_sec": round(len(queue) / elapsed, 1),
+    }
+
+
+def per_op(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return round((time.perf_counter() - start) / repeat * 1_000_000, 3)
+
+
+def queue_operations(bot: FakeBot, size: int, repeat: int = 1000) -> dict:
+    queue, _ = legacy_queue(bot)
+    queue.extend(
+        Song.placeholder(f"bench:{i % (size // 2)}", f"Track {i}", 180) for i in range(size)
+    )
+    middle = size // 2
+    song = Song.placeholder("bench:extra", "Extra", 180)
+    pages = QueuePages(queue.queue)
+
+    results = {
+        "size": size,
+        "append_us": per_op(lambda: queue.queue.append(song), repeat),
+        "pop_front_us": per_op(queue.queue.popleft, repeat),
+        "insert_middle_us": per_op(lambda: queue.insert(middle, song), repeat),
+        "remove_middle_us": per_op(lambda: queue.remove(middle), repeat),
+        "move_front_to_back_us": per_op(lambda: queue.move(0, len(queue) - 1), repeat),
+        "index_random_us": per_op(lambda: queue.queue[random.randrange(size)], repeat),
+        "render_page_us": per_op(lambda: pages[len(pages) // 2], repeat),
+        "shuffle_us": per_op(queue.shuffle, 10),
+    }
+    # dedupe only does anything the first time
+    results["dedupe_us"] = per_op(queue.dedupe, 1)
+    results["pages"] = len(pages)
+    results["songs_per_page"] = SONGS_PER_PAGE
+    return results
+
+
+async def play_once(bot: FakeBot, audio: BaseAudio, timeout: float) -> dict:
+    voice = bot.add_guild(next(_guild_ids))
+    try:
+        await asyncio.wait_for(voice.play(audio), timeout)
+    except Exception as e:
+        return {"ok": False, "error": repr(e)}
+    finally:
+        await voice.disconnect()
+    return {"ok": voice.stats.frames > 0, "frames": voice.stats.frames}
+
+
+async def player_check(bot: FakeBot, server: AudioServer, timeout: float) -> dict:
+    """Plays each kind of audio the queues hand naff's Player through it once"""
+    checks = {
+        "subscription": await play_once(
+            bot, await audio_from_url(f"bench:{next(_track_ids)}", passthrough=True), timeout
+        ),
+    }
+    # LoopbackOpusAudio without ffmpeg, only its remuxer is fake
+    audio = tools.OpusPassthroughAudio(server.url(next(_track_ids), "opus"))
+    checks["opus_passthrough"] = await play_once(bot, audio, timeout)
+    return checks
+
+
+async def main(args: argparse.Namespace) -> dict:
+    with AudioServer(tracks=4, seconds=args.seconds) as server:
+        extractor = FakeExtractor(
+            server, latency=args.latency, jitter=args.jitter, codec=args.codec
+        )
+        extractor.install()
+        backend = patch_audio()
+        bot = FakeBot()
+
+        try:
+            results = {
+                "config": {
+                    "audio": backend,
+                    "encoder": ENCODER,
+                    "codec": args.codec,
+                    "latency_ms": ms(args.latency),
+                    "jitter_ms": ms(args.jitter),
+                    "track_seconds": args.seconds,
+                },
+                "player_check": await player_check(bot, server, args.seconds + 5),
+            }
+            if not all(check["ok"] for check in results["player_check"].values()):
+                # everything else would wait on a player that never starts
+                return results
+
+            results.update(
+                time_to_first_audio=await time_to_first_audio(bot, args.runs),
+                transitions=await transitions(bot, args.tracks),
+                playlist_ingestion=await playlist_ingestion(bot, args.playlist),
+                queue_operations=queue_operations(bot, args.queue_size),
+                extractions=extractor.calls,
+            )
+            return results
+        finally:
+            extractor.uninstall()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per extraction")
+    parser.add_argument("--jitter", type=float, default=0.05, help="stdev of the latency")
+    parser.add_argument("--runs", type=int, default=5, help="/play calls per measurement")
+    parser.add_argument("--tracks", type=int, default=5, help="tracks in the transition test")
+    parser.add_argument("--seconds", type=float, default=2, help="length of every track")
+    parser.add_argument("--playlist", type=int, default=200, help="playlist entries to ingest")
+    parser.add_argument("--queue-size", type=int, default=10_000)
+    parser.add_argument(
+        "--codec", choices=("opus", "pcm"), default="opus", help="opus passes through, pcm transcodes"
+    )
+    parser.add_argument("--output", help="write the JSON here as well as stdout")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    if not all(check["ok"] for check in results["player_check"].values()):
+        sys.exit(1)
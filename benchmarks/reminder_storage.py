@@ -0,0 +1,62 @@
+"""Insert throughput and fire-time lookup latency of the reminder store
+
+Run from the repo root: python -m benchmarks.reminder_storage [rows]
+"""
+import asyncio
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from extensions.reminders.scheduler import WINDOW
+from extensions.reminders.storage import ReminderStore
+
+LOOKUPS = 200
+
+
+async def main(rows: int):
+    with tempfile.TemporaryDirectory() as directory:
+        store = ReminderStore(str(Path(directory) / "reminders.db"))
+        await store.connect()
+
+        now = time.time()
+        year = 365 * 24 * 60 * 60
+        start = time.perf_counter()
+        for i in range(rows):
+            store.add(i % 5000, 1, f"reminder {i}", now + random.random() * year)
+            if i % 1000 == 0:
+                # let the batcher run like it would between commands
+                await asyncio.sleep(0)
+        await store.flush()
+        insert_time = time.perf_counter() - start
+
+        latencies = []
+        for _ in range(LOOKUPS):
+            window_start = now + random.random() * year
+            begin = time.perf_counter()
+            await store.load_between(window_start, window_start + WINDOW)
+            latencies.append(time.perf_counter() - begin)
+
+        await store.close()
+
+    latencies.sort()
+    print(
+        json.dumps(
+            {
+                "rows": rows,
+                "inserts_per_sec": round(rows / insert_time),
+                "window_lookup_ms": {
+                    "median": round(statistics.median(latencies) * 1000, 3),
+                    "p99": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 3),
+                },
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000))
@@ -0,0 +1,89 @@
+"""Compare the memory used by a 10k song queue with and without the raw info dicts
+
+Run from the repo root: python -m benchmarks.song_memory
+"""
+import gc
+import json
+import tracemalloc
+
+from extensions.music.classes import Song
+from extensions.music.songlist import SongList
+
+SONGS = 10_000
+
+
+def fake_info(i: int) -> dict:
+    """Roughly the shape and size of a youtube extract_info result"""
+    video_id = f"{i:011d}"
+    return {
+        "id": video_id,
+        "url": f"https://rr1---sn.googlevideo.com/videoplayback?expire=1700000000&id={video_id}&itag=251",
+        "title": f"Some song number {i}",
+        "uploader": "Some Channel",
+        "channel_url": "https://www.youtube.com/channel/UCxxxxxxxxxxxxxxxxxxxxxx",
+        "thumbnail": f"https://i.ytimg.com/vi/{video_id}/maxresdefault.jpg",
+        "original_url": f"https://www.youtube.com/watch?v={video_id}",
+        "duration": 200 + i % 100,
+        "acodec": "opus",
+        "formats": [
+            {
+                "format_id": str(itag),
+                "url": f"https://rr1---sn.googlevideo.com/videoplayback?expire=1700000000&id={video_id}&itag={itag}&" + "x" * 600,
+                "ext": "webm",
+                "acodec": "opus",
+                "vcodec": "none",
+                "abr": 160.0,
+                "filesize": 3_000_000,
+                "http_headers": {"User-Agent": "Mozilla/5.0", "Accept": "*/*"},
+            }
+            for itag in range(20)
+        ],
+        "thumbnails": [
+            {"url": f"https://i.ytimg.com/vi/{video_id}/{n}.jpg", "height": n * 10, "width": n * 16}
+            for n in range(30)
+        ],
+        "http_headers": {"User-Agent": "Mozilla/5.0", "Accept": "*/*"},
+        "description": "lorem ipsum " * 100,
+    }
+
+
+def measure(build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    kept = build()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def build_before():
+    # what the queue held before: every song kept its whole info dict
+    return [(Song(data, data["original_url"]), data) for data in map(fake_info, range(SONGS))]
+
+
+def build_after():
+    return SongList(Song(fake_info(i), "") for i in range(SONGS))
+
+
+def main():
+    before = measure(build_before)
+    after = measure(build_after)
+    print(
+        json.dumps(
+            {
+                "songs": SONGS,
+                "before_bytes": before,
+                "after_bytes": after,
+                "before_per_song": before // SONGS,
+                "after_per_song": after // SONGS,
+                "ratio": round(before / after, 1),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,40 @@
-import petpetgif
-from naff import Extension, slash_command, context_menu, CommandTypes
+from io import BytesIO
+
+from naff import CommandTypes, Extension, File, Member, User, context_menu
+import naff
+
+from .outputs import OutputCache
+from .rendering import render_petpet
+from .workers import get_image_pool
+
+# Petpets are only 128px, no need to download more than that
+AVATAR_SIZE = 128
+# Total size of the finished petpets that are kept, keyed by avatar hash
+OUTPUT_CACHE_BYTES = 32 * 1024**2
 
 
 class Petpet(Extension):
-    async def petpet(self):
-        ...
+    def __init__(self, bot):
+        self.outputs: OutputCache = OutputCache(OUTPUT_CACHE_BYTES)
+
+    async def make_petpet(self, data: bytes) -> BytesIO:
+        return BytesIO(await get_image_pool().run(render_petpet, data))
+
+    @context_menu("Petpet", CommandTypes.USER, scopes=[817958268097789972])
+    async def petpet(self, ctx: naff.InteractionContext):
+        await ctx.defer()
+
+        target: User | Member = ctx.target
+        asset = target.display_avatar
+        key = asset.hash or asset.url
 
+        if (output := self.outputs.get(key)) is None:
+            avatar = await asset.fetch(extension=".png", size=AVATAR_SIZE)
+            output = (await self.make_petpet(avatar)).getvalue()
+            self.outputs.put(key, output)
 
-    # async def petpet(self, )
+        await ctx.send(file=File(BytesIO(output), file_name="petpet.gif"))
 
 
 def setup(bot):
-    ...
-    # return Petpet(bot)
+    return Petpet(bot)
@@ -1,46 +1,41 @@
-import asyncio
 from io import BytesIO
-from pathlib import Path
 
-from PIL import Image
 from naff import CommandTypes, Extension, File, Member, User, context_menu, slash_command
 import naff
 
+from .outputs import OutputCache
+from .rendering import render_speech_bubble
+from .workers import get_image_pool
 
-class SpeechBubble(Extension):
-
-    async def make_speech_bubble(self, data: bytes) -> BytesIO:
-        return await asyncio.to_thread(self._make_speech_bubble, data)
-
-    def _make_speech_bubble(self, data: bytes) -> BytesIO:
-        # should be ran in a separate thread
-        image: Image.Image = Image.open(BytesIO(data))
-        bubble: Image.Image = Image.open(Path(__file__).parent / "speech_bubble.png")
-
-        bubble_scale = bubble.height / bubble.width
-        bubble = bubble.resize((image.width, int(image.width*bubble_scale)))
+# Avatars are fetched at this size, plenty for a reaction image and small enough to upload
+AVATAR_SIZE = 256
+# Total size of the finished bubbles that are kept, keyed by avatar hash
+OUTPUT_CACHE_BYTES = 64 * 1024**2
 
-        final: Image.Image = Image.new("RGBA", (image.width, image.height + bubble.height))
-        final.paste(bubble, (0, 0))
-        final.paste(image, (0, bubble.height))
-
-        stream = BytesIO()
-        final.save(stream, format="GIF")
-        stream.seek(0)
-
-        return stream
 
+class SpeechBubble(Extension):
+    def __init__(self, bot):
+        self.outputs: OutputCache = OutputCache(OUTPUT_CACHE_BYTES)
 
+    async def make_speech_bubble(self, data: bytes) -> BytesIO:
+        return BytesIO(await get_image_pool().run(render_speech_bubble, data))
 
     @context_menu("Speech Bubble", CommandTypes.USER, scopes=[817958268097789972])
     async def user_speech_bubble(self, ctx: naff.InteractionContext):
         await ctx.defer()
 
         target: User | Member = ctx.target
-        avatar = await target.display_avatar.fetch(extension=".png", size=4096)
-        res = await self.make_speech_bubble(avatar)
+        asset = target.display_avatar
+        key = asset.hash or asset.url
+
+        if (output := self.outputs.get(key)) is None:
+            # animated avatars keep their animation
+            extension = ".gif" if asset.animated else ".png"
+            avatar = await asset.fetch(extension=extension, size=AVATAR_SIZE)
+            output = (await self.make_speech_bubble(avatar)).getvalue()
+            self.outputs.put(key, output)
 
-        await ctx.send(file=File(res, file_name="bubble.gif"))
+        await ctx.send(file=File(BytesIO(output), file_name="bubble.gif"))
 
 
 
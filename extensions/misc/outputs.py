@@ -0,0 +1,37 @@
+from collections import OrderedDict
+from typing import Optional
+
+
+class OutputCache:
+    """Finished images by avatar hash, least recently used first
+
+    Capped by their total size rather than a count, an animated avatar's
+    output can be a hundred times the size of a still one's.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes: int = max_bytes
+        self.total_bytes: int = 0
+        self._outputs: OrderedDict[str, bytes] = OrderedDict()
+
+    def __len__(self):
+        return len(self._outputs)
+
+    def get(self, key: str) -> Optional[bytes]:
+        if (output := self._outputs.get(key)) is not None:
+            self._outputs.move_to_end(key)
+        return output
+
+    def put(self, key: str, output: bytes):
+        if len(output) > self.max_bytes:
+            # it'd only push everything else out
+            return
+
+        if (old := self._outputs.pop(key, None)) is not None:
+            self.total_bytes -= len(old)
+        self._outputs[key] = output
+        self.total_bytes += len(output)
+
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self._outputs.popitem(last=False)
+            self.total_bytes -= len(evicted)
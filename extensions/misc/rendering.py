@@ -0,0 +1,168 @@
+"""Image rendering that runs inside the image worker processes
+
+Everything here only depends on Pillow, so the workers never have to import naff.
+"""
+from functools import lru_cache
+from importlib.util import find_spec
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image, ImageSequence
+
+# Frames past this are dropped (their time goes to the frames kept), so
+# memory per render stays bounded no matter how long the avatar is
+MAX_FRAMES = 100
+# The shared palette gets 255 colours, the last index is transparency
+TRANSPARENT_INDEX = 255
+# How many frames the shared palette is built from
+PALETTE_SAMPLES = 4
+
+# Same geometry and timing as pet-pet-gif
+PETPET_FRAMES = 10
+PETPET_RESOLUTION = (128, 128)
+PETPET_DELAY = 20
+
+_template = None
+_hands = None
+
+
+def template() -> Image.Image:
+    # Decoded once per worker process
+    global _template
+    if _template is None:
+        _template = Image.open(Path(__file__).parent / "speech_bubble.png")
+        _template.load()
+    return _template
+
+
+def hands() -> list[Image.Image]:
+    # Decoded and resized once per worker process
+    global _hands
+    if _hands is None:
+        # found without importing petpetgif, which drags pkg_resources in
+        directory = Path(find_spec("petpetgif").submodule_search_locations[0]) / "img"
+        _hands = []
+        for i in range(PETPET_FRAMES):
+            with Image.open(directory / f"pet{i}.gif") as hand:
+                _hands.append(hand.convert("RGBA").resize(PETPET_RESOLUTION))
+    return _hands
+
+
+def warm():
+    """Load everything the renders need, run when a worker process starts"""
+    template()
+    hands()
+
+
+@lru_cache(maxsize=16)
+def bubble_for_width(width: int) -> Image.Image:
+    """The template resized to a width, the result is shared so don't modify it"""
+    bubble = template()
+    bubble_scale = bubble.height / bubble.width
+    return bubble.resize((width, int(width * bubble_scale))).convert("RGBA")
+
+
+def _composite(frame: Image.Image, bubble: Image.Image) -> Image.Image:
+    composite = Image.new("RGBA", (frame.width, frame.height + bubble.height))
+    composite.paste(bubble, (0, 0))
+    composite.paste(frame.convert("RGBA"), (0, bubble.height))
+    return composite
+
+
+def _shared_palette(image: Image.Image, bubble: Image.Image, frame_count: int) -> Image.Image:
+    """One palette for every frame, built from a few frames spread across the animation"""
+    samples = sorted({i * frame_count // PALETTE_SAMPLES for i in range(PALETTE_SAMPLES)})
+    height = image.height + bubble.height
+    sheet = Image.new("RGB", (image.width, height * len(samples)))
+    for row, index in enumerate(samples):
+        image.seek(index)
+        sheet.paste(_composite(image, bubble).convert("RGB"), (0, row * height))
+    image.seek(0)
+    return sheet.quantize(colors=TRANSPARENT_INDEX)
+
+
+def _to_palette(frame: Image.Image, palette: Image.Image) -> Image.Image:
+    quantized = frame.convert("RGB").quantize(palette=palette, dither=Image.Dither.NONE)
+    transparent = frame.getchannel("A").point(lambda a: 255 if a < 128 else 0)
+    quantized.paste(TRANSPARENT_INDEX, mask=transparent)
+    return quantized
+
+
+def render_speech_bubble(data: bytes) -> bytes:
+    """Put a speech bubble over an image, animated ones stay animated"""
+    image = Image.open(BytesIO(data))
+    bubble = bubble_for_width(image.width)
+
+    frame_count = getattr(image, "n_frames", 1)
+    step = -(-frame_count // MAX_FRAMES)
+    palette = _shared_palette(image, bubble, frame_count)
+
+    frames = []
+    durations = []
+    # Frames are decoded, composited and quantized one at a time
+    for index, frame in enumerate(ImageSequence.Iterator(image)):
+        duration = frame.info.get("duration", 100)
+        if index % step:
+            durations[-1] += duration
+            continue
+
+        frames.append(_to_palette(_composite(frame, bubble), palette))
+        durations.append(duration)
+
+    options = {"transparency": TRANSPARENT_INDEX, "optimize": False}
+    if len(frames) > 1:
+        options |= {
+            "save_all": True,
+            "append_images": frames[1:],
+            "duration": durations,
+            "loop": 0,
+            "disposal": 2,
+        }
+
+    stream = BytesIO()
+    frames[0].save(stream, format="GIF", **options)
+    return stream.getvalue()
+
+
+def render_petpet(data: bytes) -> bytes:
+    """Pet an image, animated ones are petted on their first frame"""
+    width, height = PETPET_RESOLUTION
+    with Image.open(BytesIO(data)) as image:
+        base = image.convert("RGBA").resize(PETPET_RESOLUTION)
+
+    frames = []
+    for i, hand in enumerate(hands()):
+        squeeze = i if i < PETPET_FRAMES / 2 else PETPET_FRAMES - i
+        scale_x = 0.8 + squeeze * 0.02
+        scale_y = 0.8 - squeeze * 0.05
+        offset_x = (1 - scale_x) * 0.5 + 0.1
+        offset_y = (1 - scale_y) - 0.08
+
+        canvas = Image.new("RGBA", PETPET_RESOLUTION)
+        canvas.paste(
+            base.resize((round(scale_x * width), round(scale_y * height))),
+            (round(offset_x * width), round(offset_y * height)),
+        )
+        canvas.paste(hand, mask=hand)
+        frames.append(canvas)
+
+    # ten 128px frames are cheap enough to build the palette from all of them
+    sheet = Image.new("RGB", (width, height * len(frames)))
+    for row, frame in enumerate(frames):
+        sheet.paste(frame.convert("RGB"), (0, row * height))
+    palette = sheet.quantize(colors=TRANSPARENT_INDEX)
+    frames = [_to_palette(frame, palette) for frame in frames]
+
+    stream = BytesIO()
+    frames[0].save(
+        stream,
+        format="GIF",
+        save_all=True,
+        append_images=frames[1:],
+        duration=PETPET_DELAY,
+        loop=0,
+        transparency=TRANSPARENT_INDEX,
+        disposal=2,
+        optimize=False,
+    )
+    return stream.getvalue()
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from os import getenv
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger("Myr.misc.workers")
+
+
+class ImageWorkerPool:
+    """A process pool for Pillow work, shared by every image command
+
+    Pillow holds the GIL while it quantizes and encodes, so doing it in a
+    thread still stalls the event loop. At most `max_pending` jobs are handed
+    to the pool at once, anyone after that waits here instead of piling
+    their images up in the executor's queue.
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        max_pending: Optional[int] = None,
+        initializer: Optional[Callable[[], Any]] = None,
+    ):
+        self.workers: int = workers
+        self.max_pending: int = max_pending or workers * 2
+        # the initializer runs once in each worker as it starts
+        self._executor = ProcessPoolExecutor(workers, initializer=initializer)
+        self._slots: Optional[asyncio.Semaphore] = None
+
+        self.waiting: int = 0
+        self.completed: int = 0
+
+    @property
+    def slots(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        return self._slots
+
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        """Run a picklable function in the pool, waiting for room if it's busy"""
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self.slots.release()
+            self.completed += 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool: Optional[ImageWorkerPool] = None
+
+
+def get_image_pool() -> ImageWorkerPool:
+    """Get the shared image pool, sized by IMAGE_WORKERS"""
+    global _pool
+    if _pool is None:
+        from .rendering import warm
+
+        _pool = ImageWorkerPool(int(getenv("IMAGE_WORKERS", 2)), initializer=warm)
+    return _pool
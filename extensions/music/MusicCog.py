@@ -1,9 +1,18 @@
+import asyncio
 import logging
+from os import getenv
+from typing import Optional
 
 from naff import (Client, Extension, GuildVoice, InteractionContext,
-                  OptionTypes, slash_command, slash_option)
+                  OptionTypes, listen, slash_command, slash_option)
+from naff.ext.paginators import Paginator
 
+from ..utils import metrics
+from ..utils.reaper import reaper
+from ..utils.snapshots import get_snapshot_store
+from .cache import extraction_cache
 from .classes import Queue
+from .songlist import QueuePages
 
 logger = logging.getLogger("Myr.music")
 
@@ -12,10 +21,67 @@ class SoundCog(Extension):
     def __init__(self, bot):
         self.bot: Client = bot
         self.queues: list[Queue] = []
+        metrics.gauge(
+            "myr_music_queues",
+            "Queues of the legacy music cog",
+            lambda: {
+                ("playing",): sum(queue.running for queue in self.queues),
+                ("idle",): sum(not queue.running for queue in self.queues),
+            },
+            ("state",),
+        )
+
+        reaper.register("music", self.guild_state, self.release_guild)
 
         logger.info("Music cog loaded!")
 
+    @listen()
+    async def on_startup(self):
+        reaper.start(self.bot)
+
+        # The cache works fine in memory only, the file just lets it survive restarts
+        if path := getenv("EXTRACTION_CACHE_DB"):
+            await extraction_cache.connect(path)
+
+        if store := get_snapshot_store():
+            await store.connect()
+            for snapshot in await store.load("music"):
+                asyncio.create_task(self.restore_queue(snapshot))
+
+    async def restore_queue(self, snapshot: dict):
+        """Rejoin a guild's vc after a restart and pick up where its queue left off"""
+        guild = self.bot.get_guild(snapshot["guild_id"])
+        channel = self.bot.get_channel(snapshot["voice_channel_id"])
+        if guild is None or channel is None:
+            return
+
+        try:
+            await channel.connect()
+        except Exception as e:
+            logger.warning(f"Couldn't restore the queue in {guild.name}: {e}")
+            return
+
+        queue = Queue.from_snapshot(self, guild, snapshot)
+        self.queues.append(queue)
+        queue.start()
+        logger.info(f"Restored a queue of {len(queue)} songs in {guild.name}")
+
+    def find_queue(self, guild_id: int) -> Optional[Queue]:
+        return next((queue for queue in self.queues if queue.guild.id == guild_id), None)
+
+    def guild_state(self, guild_id: int) -> Optional[bool]:
+        """For the reaper: None without a queue, otherwise if it's playing"""
+        if (queue := self.find_queue(guild_id)) is None:
+            return None
+        return queue.running
+
+    def release_guild(self, guild_id: int):
+        if (queue := self.find_queue(guild_id)) is not None:
+            # the reaper leaves the vc itself
+            queue.cleanup(disconnect=False)
+
     def get_queue(self, ctx: InteractionContext) -> Queue:
+        reaper.touch(ctx.guild_id)
         for queue in self.queues:
             if ctx.guild == queue.guild:
                 return queue
@@ -72,6 +138,7 @@ class SoundCog(Extension):
 
         queue = self.get_queue(ctx)
         queue.loop = loop if loop is not None else not queue.loop
+        queue.changed()
         await ctx.send(f"Set song loop to {queue.loop}")
 
     @slash_command("loopqueue", "Loop the queue")
@@ -82,6 +149,7 @@ class SoundCog(Extension):
 
         queue = self.get_queue(ctx)
         queue.loopqueue = loopqueue if loopqueue is not None else not queue.loopqueue
+        queue.changed()
         await ctx.send(f"Set queue loop to {queue.loopqueue}")
 
     @slash_command("disconnect", "Disconnect the bot from the vc")
@@ -101,14 +169,51 @@ class SoundCog(Extension):
     async def queue_show(self, ctx):
         queue = self.get_queue(ctx)
 
-        msg = [queue.now_playing.title]
-        msg.extend(song.title for song in queue.queue)
-        await ctx.send("\n".join(msg))
+        paginator = Paginator(
+            self.bot, pages=QueuePages(queue.queue, queue.now_playing), timeout_interval=120
+        )
+        await paginator.send(ctx)
+
+    @queue_base.subcommand("remove", sub_cmd_description="Remove a song from the queue")
+    @slash_option("position", "The position of the song", OptionTypes.INTEGER, True)
+    async def queue_remove(self, ctx, position: int):
+        queue = self.get_queue(ctx)
+        if not 1 <= position <= len(queue):
+            return await ctx.send("There is no song at that position", ephemeral=True)
+
+        song = queue.remove(position - 1)
+        await ctx.send(f"Removed **{song.title}**")
+
+    @queue_base.subcommand("move", sub_cmd_description="Move a song in the queue")
+    @slash_option("position", "The position of the song", OptionTypes.INTEGER, True)
+    @slash_option("to", "Where to move the song to", OptionTypes.INTEGER, True)
+    async def queue_move(self, ctx, position: int, to: int):
+        queue = self.get_queue(ctx)
+        if not 1 <= position <= len(queue):
+            return await ctx.send("There is no song at that position", ephemeral=True)
+
+        queue.move(position - 1, to - 1)
+        await ctx.send(f"Moved song {position} to position {min(max(to, 1), len(queue))}")
+
+    @queue_base.subcommand("shuffle", sub_cmd_description="Shuffle the queue")
+    async def queue_shuffle(self, ctx):
+        self.get_queue(ctx).shuffle()
+        await ctx.send("Shuffled the queue!")
+
+    @queue_base.subcommand("dedupe", sub_cmd_description="Remove duplicate songs")
+    async def queue_dedupe(self, ctx):
+        removed = self.get_queue(ctx).dedupe()
+        await ctx.send(f"Removed {removed} duplicate songs")
 
     @queue_base.subcommand("clear", sub_cmd_description="Clear the queue")
     async def queue_clear(self, ctx):
         await ctx.send("NotImplemented")
 
 
+    def shed(self) -> None:
+        reaper.unregister("music")
+        super(SoundCog, self).shed()
+
+
 def setup(bot: Client):
     SoundCog(bot)
@@ -0,0 +1,289 @@
+import asyncio
+import fcntl
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from os import getenv
+from pathlib import Path
+from typing import Optional
+
+from ..utils import metrics
+from ..utils.opus import OGG_PAGE_HEADER
+from .cache import cache_key
+
+logger = logging.getLogger("Myr.music.audio_cache")
+
+# Anything longer than this is probably a stream or a 10 hour mix
+MAX_CACHED_DURATION = 2 * 60 * 60
+# What a fill is expected to take up, 128k Opus. Remuxed sources are about the same
+FILL_BYTES_PER_SECOND = 128_000 // 8
+
+TRANSCODE_ARGS = ["-vn", "-c:a", "libopus", "-b:a", "128k", "-f", "ogg"]
+# Opus sources only need remuxing into Ogg
+COPY_ARGS = ["-vn", "-c:a", "copy", "-f", "ogg"]
+# An Ogg page is at most a header, 255 lacing values and 255 * 255 bytes of data
+MAX_OGG_PAGE = OGG_PAGE_HEADER.size + 255 + 255 * 255
+OGG_END_OF_STREAM = 0x04
+
+LOOKUPS = metrics.counter(
+    "myr_audio_cache_lookups_total", "Audio cache lookups by result", ("result",)
+)
+
+
+class AudioCache:
+    """A size capped directory of tracks transcoded to Opus/Ogg
+
+    Files are written to a temporary name and renamed into place, so readers
+    never see a partial file. Eviction only unlinks files, anything that
+    already has a track open keeps reading it until it's done.
+
+    The temporary file is locked for as long as ffmpeg writes to it, and
+    ffmpeg holds the lock too, so a fill that outlives a restart isn't
+    started again. Once it's done, the next lookup of that track publishes
+    the file instead of downloading it again.
+
+    All the disk io happens in threads, this is made and used on the play path.
+    """
+
+    def __init__(self, directory: str | Path, max_bytes: int):
+        self.directory: Path = Path(directory)
+        self.max_bytes: int = max_bytes
+
+        # file name -> size, least recently used first
+        self._index: OrderedDict[str, int] = OrderedDict()
+        self._filling: dict[str, asyncio.Task] = {}
+        # file name -> expected size, fills count against the budget before they're done
+        self._reserved: dict[str, int] = {}
+        self.total_bytes: int = 0
+
+        # lookups miss until the directory's been scanned
+        self._loading: asyncio.Future = asyncio.get_running_loop().run_in_executor(
+            None, self._scan
+        )
+        self._loading.add_done_callback(self._load_index)
+
+    def _scan(self) -> list[tuple[str, int]]:
+        """Tidy up after the last run, then list the tracks least recently used first"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for path in self.directory.glob("*.part"):
+            if (fd := self._claim(path)) is None:
+                # a fill from before the restart is still running
+                continue
+            try:
+                if path.name.endswith(".ogg.part") and _complete(path):
+                    os.replace(path, path.with_suffix(""))
+                else:
+                    # leftovers from writes that never finished
+                    path.unlink(missing_ok=True)
+            finally:
+                os.close(fd)
+
+        files = []
+        for path in self.directory.glob("*.ogg"):
+            stat = path.stat()
+            files.append((stat.st_mtime, path.name, stat.st_size))
+        return [(name, size) for _, name, size in sorted(files)]
+
+    def _load_index(self, future: asyncio.Future):
+        if (error := future.exception()) is not None:
+            logger.error(f"Failed to load the audio cache: {error!r}")
+            return
+
+        for name, size in future.result():
+            self._index[name] = size
+            self.total_bytes += size
+
+        logger.info(
+            f"Audio cache has {len(self._index)} tracks, {self.total_bytes} bytes"
+        )
+        # the budget might have shrunk since the last run
+        self.evict()
+
+    @staticmethod
+    def _file_name(url: str) -> Optional[str]:
+        if (key := cache_key(url)) is None:
+            return None
+        return hashlib.sha1(key.encode()).hexdigest() + ".ogg"
+
+    def get(self, url: str) -> Optional[Path]:
+        """Get the cached file for a track, if there is one"""
+        name = self._file_name(url)
+        if name is None or name not in self._index:
+            LOOKUPS.inc(labels=("miss",))
+            return None
+
+        self._index.move_to_end(name)
+        # mtime doubles as the LRU order across restarts, disk io stays off the play path
+        loop = asyncio.get_running_loop()
+        loop.run_in_executor(None, self._touch, name, loop)
+        LOOKUPS.inc(labels=("hit",))
+        return self.directory / name
+
+    def _touch(self, name: str, loop: asyncio.AbstractEventLoop):
+        try:
+            os.utime(self.directory / name)
+        except FileNotFoundError:
+            # deleted behind our back, the next lookup misses
+            loop.call_soon_threadsafe(self._forget, name)
+
+    def _forget(self, name: str):
+        if (size := self._index.pop(name, None)) is not None:
+            self.total_bytes -= size
+
+    def fill(self, url: str, stream_url: str, duration: int, codec: Optional[str] = None):
+        """Transcode a track into the cache in the background, or just remux it if it's Opus"""
+        name = self._file_name(url)
+        if (
+            name is None
+            # without the index it's anyone's guess if it's cached already
+            or not self._loading.done()
+            or name in self._index
+            or name in self._filling
+            or not 0 < duration <= MAX_CACHED_DURATION
+            # it'd push out everything else, only to be evicted itself
+            or duration * FILL_BYTES_PER_SECOND > self.max_bytes
+        ):
+            return
+
+        args = COPY_ARGS if codec == "opus" else TRANSCODE_ARGS
+        task = asyncio.create_task(self._fill(name, stream_url, args))
+        self._filling[name] = task
+        task.add_done_callback(lambda _: self._done(name))
+        # room is made up front, so filling never takes the cache over its budget
+        self._reserved[name] = duration * FILL_BYTES_PER_SECOND
+        self.evict()
+
+    def _done(self, name: str):
+        self._filling.pop(name, None)
+        self._reserved.pop(name, None)
+
+    @property
+    def reserved_bytes(self) -> int:
+        return sum(self._reserved.values())
+
+    @staticmethod
+    def _claim(path: Path) -> Optional[int]:
+        """Open and lock a temporary file, None if someone else holds it"""
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    async def _fill(self, name: str, stream_url: str, args: list[str]):
+        temp = self.directory / f"{name}.part"
+        if (fd := await asyncio.to_thread(self._claim, temp)) is None:
+            logger.debug(f"{name} is already being cached, most likely since before a restart")
+            return
+
+        try:
+            if await asyncio.to_thread(_complete, temp):
+                # finished after the process that started it was gone
+                await self._publish(name, temp)
+                return
+            await asyncio.to_thread(os.ftruncate, fd, 0)
+
+            # ffmpeg writes to the locked file itself, so it keeps the lock even if we die
+            process = await asyncio.create_subprocess_exec(
+                "ffmpeg",
+                "-reconnect", "1",
+                "-reconnect_streamed", "1",
+                "-reconnect_delay_max", "5",
+                "-i", stream_url,
+                *args,
+                "-loglevel", "error",
+                "pipe:1",
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=fd,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            try:
+                _, stderr = await process.communicate()
+            except asyncio.CancelledError:
+                process.kill()
+                await asyncio.to_thread(temp.unlink, missing_ok=True)
+                raise
+
+            if process.returncode != 0:
+                logger.warning(f"Failed to cache {name}: {stderr.decode().strip()}")
+                await asyncio.to_thread(temp.unlink, missing_ok=True)
+                return
+            await self._publish(name, temp)
+        finally:
+            os.close(fd)
+
+    async def _publish(self, name: str, temp: Path):
+        size = await asyncio.to_thread(_rename, temp, self.directory / name)
+        self._reserved.pop(name, None)
+        self._index[name] = size
+        self.total_bytes += size
+        self.evict()
+
+    def evict(self):
+        """Drop the least recently used tracks until everything fits in max_bytes"""
+        evicted = []
+        reserved = self.reserved_bytes
+        while self.total_bytes + reserved > self.max_bytes and self._index:
+            name, size = self._index.popitem(last=False)
+            self.total_bytes -= size
+            evicted.append(self.directory / name)
+        if evicted:
+            asyncio.get_running_loop().run_in_executor(None, _unlink, evicted)
+
+    def stats(self) -> dict:
+        return {
+            "tracks": len(self._index),
+            "bytes": self.total_bytes,
+            "reserved_bytes": self.reserved_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+def _rename(temp: Path, path: Path) -> int:
+    """Move a finished fill into place, returns its size"""
+    size = temp.stat().st_size
+    os.replace(temp, path)
+    return size
+
+
+def _unlink(paths: list[Path]):
+    for path in paths:
+        path.unlink(missing_ok=True)
+        logger.debug(f"Evicted {path.name} from the audio cache")
+
+
+def _complete(path: Path) -> bool:
+    """If an Ogg file ends with its end of stream page, rather than partway through"""
+    with open(path, "rb") as file:
+        size = file.seek(0, os.SEEK_END)
+        file.seek(max(0, size - MAX_OGG_PAGE))
+        tail = file.read()
+    if (start := tail.rfind(b"OggS")) == -1 or len(tail) - start < OGG_PAGE_HEADER.size:
+        return False
+    return bool(OGG_PAGE_HEADER.unpack_from(tail, start)[2] & OGG_END_OF_STREAM)
+
+
+_audio_cache: Optional[AudioCache] = None
+
+
+def get_audio_cache() -> Optional[AudioCache]:
+    """Get the audio cache, or None if AUDIO_CACHE_DIR isn't set
+
+    The first call has to be from the event loop, the index loads in the background.
+    """
+    global _audio_cache
+    if _audio_cache is None and (directory := getenv("AUDIO_CACHE_DIR")):
+        _audio_cache = AudioCache(
+            directory, int(getenv("AUDIO_CACHE_BYTES", 2 * 1024**3))
+        )
+    return _audio_cache
+
+
+metrics.gauge(
+    "myr_audio_cache_bytes",
+    "Size of the transcoded tracks on disk",
+    lambda: _audio_cache.total_bytes if _audio_cache else {},
+)
@@ -0,0 +1,258 @@
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import aiosqlite
+import orjson
+
+from ..utils import metrics
+from .utils import parse_expiry
+
+logger = logging.getLogger("Myr.music.cache")
+
+# Only the keys that Song actually reads get cached, the rest of the info dict
+# (formats, thumbnails, subtitles, headers...) is dropped
+CACHED_KEYS = (
+    "id",
+    "url",
+    "title",
+    "uploader",
+    "channel_url",
+    "playlist",
+    "original_url",
+    "duration",
+    "thumbnail",
+    "acodec",
+)
+STREAM_KEYS = ("url",)
+
+YOUTUBE_ID_REGEX = re.compile(
+    r"(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/)|youtu\.be/)([\w-]{11})"
+)
+
+# Used when a stream url doesn't carry an expire= parameter
+DEFAULT_STREAM_TTL = 30 * 60
+# Don't hand out stream urls that are about to die
+EXPIRY_MARGIN = 60
+# Titles and uploaders basically never change
+METADATA_TTL = 7 * 24 * 60 * 60
+# Keys per query when looking up a whole playlist, well under sqlite's variable limit
+MAX_QUERY_KEYS = 500
+
+LOOKUPS = metrics.counter(
+    "myr_extraction_cache_lookups_total", "Extraction cache lookups by result", ("result",)
+)
+
+
+def cache_key(url: str) -> Optional[str]:
+    """Normalize a url into a cache key, or None if it shouldn't be cached"""
+    url = url.strip()
+    if url.startswith("ytsearch"):
+        return None
+
+    if match := YOUTUBE_ID_REGEX.search(url):
+        return f"youtube:{match[1]}"
+    return url
+
+
+class CacheEntry:
+    __slots__ = ("metadata", "stream_url", "stream_expires", "metadata_expires")
+
+    def __init__(
+        self,
+        metadata: dict,
+        stream_url: Optional[str],
+        stream_expires: float,
+        metadata_expires: float,
+    ):
+        self.metadata: dict = metadata
+        self.stream_url: Optional[str] = stream_url
+        self.stream_expires: float = stream_expires
+        self.metadata_expires: float = metadata_expires
+
+    @property
+    def stream_valid(self) -> bool:
+        return self.stream_url is not None and time.time() < self.stream_expires
+
+    @property
+    def metadata_valid(self) -> bool:
+        return time.time() < self.metadata_expires
+
+    def to_data(self) -> dict:
+        return self.metadata | {"url": self.stream_url}
+
+
+class ExtractionCache:
+    """An LRU of extraction results shared by every Extractor in the process
+
+    Stream urls expire when their expire= parameter says so, while the
+    metadata is kept around for much longer. Entries can optionally be
+    persisted to an sqlite file so they survive restarts.
+    """
+
+    def __init__(self, maxsize: int = 4096, metadata_ttl: float = METADATA_TTL):
+        self.maxsize: int = maxsize
+        self.metadata_ttl: float = metadata_ttl
+        self.db: Optional[aiosqlite.Connection] = None
+
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def connect(self, path: str):
+        self.db = await aiosqlite.connect(path)
+        await self.db.execute(
+            """CREATE TABLE IF NOT EXISTS extraction_cache (
+             key TEXT PRIMARY KEY,
+             metadata BLOB,
+             stream_url TEXT,
+             stream_expires REAL,
+             metadata_expires REAL
+        )"""
+        )
+        await self.db.execute(
+            "DELETE FROM extraction_cache WHERE metadata_expires < ?", (time.time(),)
+        )
+        await self.db.commit()
+        logger.info(f"Extraction cache persisted to {path}")
+
+    async def close(self):
+        if self.db is not None:
+            await self.db.close()
+            self.db = None
+
+    def _remember(self, key: str, entry: CacheEntry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def _lookup(self, key: str) -> Optional[CacheEntry]:
+        if entry := self._entries.get(key):
+            self._entries.move_to_end(key)
+            return entry
+
+        if self.db is None:
+            return None
+
+        async with self.db.execute(
+            "SELECT metadata, stream_url, stream_expires, metadata_expires "
+            "FROM extraction_cache WHERE key = ?",
+            (key,),
+        ) as cursor:
+            row = await cursor.fetchone()
+
+        if row is None:
+            return None
+
+        entry = CacheEntry(orjson.loads(row[0]), row[1], row[2], row[3])
+        self._remember(key, entry)
+        return entry
+
+    async def get(self, url: str) -> Optional[dict]:
+        """Get cached data with a stream url that is still playable"""
+        if (key := cache_key(url)) is None:
+            return None
+
+        entry = await self._lookup(key)
+        if entry is None or not entry.stream_valid:
+            LOOKUPS.inc(labels=("miss",))
+            return None
+
+        LOOKUPS.inc(labels=("hit",))
+        return entry.to_data()
+
+    async def get_metadata(self, url: str) -> Optional[dict]:
+        """Get cached metadata, even if the stream url has expired"""
+        if (key := cache_key(url)) is None:
+            return None
+
+        entry = await self._lookup(key)
+        if entry is None or not entry.metadata_valid:
+            return None
+
+        LOOKUPS.inc(labels=("metadata_hit",))
+        return entry.metadata
+
+    async def get_metadata_many(self, urls: list[str]) -> list[Optional[dict]]:
+        """`get_metadata` for a whole playlist at once, one query per few hundred misses"""
+        keys = [cache_key(url) for url in urls]
+        missing = list({key for key in keys if key is not None and key not in self._entries})
+
+        # a big enough playlist pushes its own entries back out of the LRU
+        found: dict[str, CacheEntry] = {}
+        if self.db is not None:
+            for start in range(0, len(missing), MAX_QUERY_KEYS):
+                chunk = missing[start : start + MAX_QUERY_KEYS]
+                async with self.db.execute(
+                    "SELECT key, metadata, stream_url, stream_expires, metadata_expires "
+                    f"FROM extraction_cache WHERE key IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                ) as cursor:
+                    async for row in cursor:
+                        found[row[0]] = CacheEntry(orjson.loads(row[1]), *row[2:])
+                        self._remember(row[0], found[row[0]])
+
+        results = []
+        for key in keys:
+            entry = found.get(key) or self._entries.get(key) if key is not None else None
+            if entry is None or not entry.metadata_valid:
+                results.append(None)
+                continue
+            LOOKUPS.inc(labels=("metadata_hit",))
+            results.append(entry.metadata)
+        return results
+
+    async def put(self, url: str, data: dict):
+        if (key := cache_key(url)) is None:
+            return
+
+        now = time.time()
+        stream_url = data.get("url")
+        expires = parse_expiry(stream_url) if stream_url else None
+        if expires is None:
+            expires = now + DEFAULT_STREAM_TTL
+
+        entry = CacheEntry(
+            {k: data[k] for k in CACHED_KEYS if k in data and k not in STREAM_KEYS},
+            stream_url,
+            expires - EXPIRY_MARGIN,
+            now + self.metadata_ttl,
+        )
+        self._remember(key, entry)
+
+        if self.db is not None:
+            await self.db.execute(
+                "INSERT OR REPLACE INTO extraction_cache VALUES (?, ?, ?, ?, ?)",
+                (
+                    key,
+                    orjson.dumps(entry.metadata),
+                    entry.stream_url,
+                    entry.stream_expires,
+                    entry.metadata_expires,
+                ),
+            )
+            await self.db.commit()
+
+    async def invalidate(self, url: str):
+        """Forget a url's stream url, its metadata stays for `get_metadata`"""
+        if (key := cache_key(url)) is None:
+            return
+
+        if entry := self._entries.get(key):
+            entry.stream_url = None
+            entry.stream_expires = 0
+        if self.db is not None:
+            await self.db.execute(
+                "UPDATE extraction_cache SET stream_url = NULL, stream_expires = 0 WHERE key = ?",
+                (key,),
+            )
+            await self.db.commit()
+
+
+extraction_cache = ExtractionCache()
+
+metrics.gauge("myr_extraction_cache_entries", "Entries in the extraction cache", lambda: len(extraction_cache))
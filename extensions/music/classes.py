@@ -1,18 +1,30 @@
+import asyncio
 import contextlib
 import logging
-import random
-import re
 import time
-from asyncio import create_task, gather, get_running_loop
+from asyncio import create_task
 from collections import deque
-from typing import TYPE_CHECKING, Coroutine, Optional, Union
+from itertools import islice
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, Union
 
 from naff import (ActiveVoiceState, Client, Embed, Guild, GuildText,
                   InteractionContext)
-from yt_dlp import YoutubeDL
-
-from .utils import (chunk, short_diff_from_time, short_diff_from_unix,
-                    sync_to_thread)
+from naff.api.voice.audio import AudioVolume, BaseAudio
+from naff.client.errors import HTTPException
+
+from ..utils import metrics
+from ..utils.broker import broker
+from ..utils.extraction import Priority, get_extraction_service
+from ..utils.notifier import ChannelNotifier, discard_notifier, get_notifier
+from ..utils.opus import UNITY_GAIN, OpusPassthroughAudio
+from ..utils.search import search_cache
+from ..utils.snapshots import get_snapshot_store
+from .audio_cache import get_audio_cache
+from .cache import cache_key, extraction_cache
+from .songlist import SongList
+from .utils import (ordered_map, parse_expiry, short_diff_from_time,
+                    short_diff_from_unix)
 
 if TYPE_CHECKING:
     from .MusicCog import SoundCog
@@ -32,38 +44,142 @@ FFMPEG_OPTIONS = {
     "options": "-vn",
 }
 
-EXPIRE_REGEX = re.compile(r"expire=(\d*)")
+# How many upcoming songs get their stream urls checked ahead of time
+LOOKAHEAD = 3
+# How long before the current song ends the next one starts buffering
+PREBUFFER_SECONDS = 10
+# Refresh urls that expire less than this long after they're due to play
+EXPIRY_MARGIN = 60
+
+# How many playlist entries get resolved at once
+PLAYLIST_WINDOW = 8
+# Longer playlists go in as placeholders from their flat entries, and only get
+# resolved once they're within LOOKAHEAD of playing
+LAZY_PLAYLIST_SIZE = 25
+# Seconds between edits of the playlist progress message
+PROGRESS_INTERVAL = 2
 
 logger = logging.getLogger("Myr.music.backend")
 
+SONGS_PLAYED = metrics.counter("myr_songs_played_total", "Songs that started playing", ("queue",))
+SONG_FAILURES = metrics.counter(
+    "myr_song_failures_total", "Songs skipped because they couldn't be loaded", ("queue",)
+)
+TRANSITIONS = metrics.histogram(
+    "myr_track_transition_seconds",
+    "Time between a song ending and the next one starting",
+    ("queue",),
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+PLAYLIST_ENTRIES = metrics.counter(
+    "myr_playlist_entries_total", "Playlist entries processed, by result", ("result",)
+)
+
 
 class Song:
+    """Just the parts of an extracted video that the queue uses
+
+    The raw info dict is dropped as soon as the song is made, with its
+    formats, thumbnails and headers it's tens of KB per entry. Use
+    `Extractor.full_info` if the whole thing is ever needed again.
+    """
+
     __slots__ = (
-        "data",
-        "url",
+        "_url",
+        "expires",
         "base_url",
         "original_url",
+        "video_id",
         "title",
         "author",
         "duration",
         "channel",
+        "thumbnail",
         "playlist",
+        "codec",
+        "offset",
         "start_time",
     )
 
     def __init__(self, data: dict, base_url: str):
-        self.data: dict = data
-        self.url: str = data["url"]
+        self.url = data["url"]
         self.base_url: str = base_url
 
+        self.video_id: Optional[str] = data.get("id")
         self.title: str = data.get("title", self.url)
         self.author: Optional[str] = data.get("uploader")
         self.channel: Optional[str] = data.get("channel_url")
+        self.thumbnail: Optional[str] = data.get("thumbnail")
         self.playlist: Optional[str] = data.get("playlist")
         self.original_url: Optional[str] = data.get("original_url")
         self.duration: int = data.get("duration") or 0
+        self.codec: Optional[str] = data.get("acodec")
+
+        # Seconds into the song to start playing from
+        self.offset: float = 0
+        self.start_time: Optional[float] = None
+
+    @classmethod
+    def placeholder(cls, url: str, title: Optional[str] = None, duration: int = 0) -> "Song":
+        """A song that hasn't been extracted yet, it gets resolved right before it plays"""
+        return cls(
+            {"url": None, "title": title or url, "duration": duration, "original_url": url},
+            base_url=url,
+        )
+
+    @classmethod
+    def from_flat(
+        cls, entry: dict, playlist: Optional[str] = None, metadata: Optional[dict] = None
+    ) -> "Song":
+        """A placeholder made from a flat playlist entry, no extraction needed
+
+        `metadata` is what the extraction cache kept from an earlier full
+        extraction, it's more complete than the flat entry.
+        """
+        if metadata is not None:
+            song = cls(metadata | {"url": None, "original_url": entry["url"]}, base_url=entry["url"])
+        else:
+            song = cls.placeholder(entry["url"], entry.get("title"), entry.get("duration") or 0)
+            song.video_id = entry.get("id")
+            song.author = entry.get("uploader") or entry.get("channel")
+        song.playlist = playlist
+        return song
+
+    @property
+    def resolved(self) -> bool:
+        return self.url is not None
+
+    def update(self, other: "Song"):
+        """Take over the extracted data of another song"""
+        for attr in ("url", "video_id", "title", "author", "channel", "thumbnail",
+                     "playlist", "original_url", "duration", "codec"):
+            setattr(self, attr, getattr(other, attr))
 
-        self.start_time: Optional[int] = None
+    @property
+    def url(self) -> Optional[str]:
+        return self._url
+
+    @url.setter
+    def url(self, url: Optional[str]):
+        self._url = url
+        # parsed once here instead of on every expiry check
+        self.expires: Optional[int] = parse_expiry(url) if url else None
+
+    @property
+    def data(self) -> dict:
+        """A minimal info dict, in the same shape extract_info returns"""
+        return {
+            "url": self.url,
+            "id": self.video_id,
+            "title": self.title,
+            "uploader": self.author,
+            "channel_url": self.channel,
+            "thumbnail": self.thumbnail,
+            "playlist": self.playlist,
+            "original_url": self.original_url,
+            "duration": self.duration,
+            "acodec": self.codec,
+        }
 
     def __len__(self):
         return self.duration
@@ -72,7 +188,14 @@ class Song:
         return self.title
 
     def ready(self):
-        self.start_time = time.time()
+        self.start_time = time.time() - self.offset
+
+    @property
+    def position(self) -> float:
+        """Seconds into the song playback is at"""
+        if self.start_time is None:
+            return self.offset
+        return time.time() - self.start_time
 
     @property
     def elapsed_time(self) -> Optional[str]:
@@ -89,7 +212,7 @@ class Song:
     @property
     def embed(self) -> Embed:
         embed = Embed(title=self.title)
-        embed.set_thumbnail(url=self.data["thumbnail"])
+        embed.set_thumbnail(url=self.thumbnail)
         embed.set_author(name=self.author, url=self.channel)
         embed.add_field(name="Playlist", value=self.playlist)
         embed.add_field(name="Duration", value=self.elapsed_time)
@@ -102,13 +225,19 @@ class Song:
     def to_embed(self) -> Embed:
         return self.embed
 
+    @property
+    def source_url(self) -> str:
+        """The url this song was extracted from"""
+        return self.original_url or self.base_url
+
     @property
     def expired(self) -> bool:
-        # Youtube media links have expire=unix_time in the url
-        res = re.search(EXPIRE_REGEX, self.url)
-        if res is None:
+        return self.expires_before(time.time())
+
+    def expires_before(self, timestamp: float) -> bool:
+        if self.expires is None:
             return False
-        return time.time() > int(res[1])
+        return timestamp > self.expires
 
 
 class Queue:
@@ -128,23 +257,91 @@ class Queue:
         "guild",
         "running",
         "current_player",
+        "lookahead",
+        "prepared",
+        "transitions",
+        "notifier",
+        "_restart_at",
     )
 
     def __init__(self, ctx: InteractionContext):
-        self.bot: Client = ctx.bot
-        self.scale: SoundCog = ctx.command.scale
-        self.bound_channel: GuildText = ctx.channel
-        self.guild: Guild = ctx.guild
-
-        self.queue: deque[Song] = deque()
+        self._setup(ctx.bot, ctx.command.scale, ctx.channel, ctx.guild)
+
+    @classmethod
+    def from_snapshot(cls, scale: "SoundCog", guild: Guild, snapshot: dict) -> "Queue":
+        """Rebuild a queue from a snapshot, songs stay unresolved until they're about to play"""
+        queue = cls.__new__(cls)
+        # voice channels have a text chat too, for when the old one is gone
+        channel = scale.bot.get_channel(snapshot["text_channel_id"]) or scale.bot.get_channel(
+            snapshot["voice_channel_id"]
+        )
+        queue._setup(scale.bot, scale, channel, guild)
+
+        queue.loop = snapshot["loop"]
+        queue.loopqueue = snapshot["loopqueue"]
+        queue._volume = snapshot["volume"]
+        queue.queue.extend(
+            Song.placeholder(entry["url"], entry["title"], entry["duration"])
+            for entry in snapshot["entries"]
+        )
+        if queue.queue:
+            queue.queue[0].offset = snapshot["position"]
+        return queue
+
+    def _setup(self, bot: Client, scale: "SoundCog", channel: GuildText, guild: Guild):
+        self.bot: Client = bot
+        self.scale: SoundCog = scale
+        self.bound_channel: GuildText = channel
+        self.notifier: ChannelNotifier = get_notifier(channel)
+        self.guild: Guild = guild
+
+        self.queue: SongList = SongList()
         self.now_playing: Optional[Song] = None
         self.current_player: Optional[ActiveVoiceState] = None
         self._volume = 100
+        # where to pick the current song back up, if its player couldn't take a volume change
+        self._restart_at: Optional[float] = None
         self.extractor: "Extractor" = Extractor(self)
         self.running: bool = False
         self.loop: bool = False
         self.loopqueue: bool = False
 
+        self.lookahead: int = LOOKAHEAD
+        # The next song and its already buffering player
+        self.prepared: Optional[tuple[Song, BaseAudio]] = None
+        # Seconds between a song ending and the next one starting
+        self.transitions: deque[float] = deque(maxlen=100)
+
+        if store := get_snapshot_store():
+            store.register(self.guild.id, self)
+
+    def changed(self):
+        """Mark the queue for the next snapshot"""
+        if store := get_snapshot_store():
+            store.mark_dirty(self.guild.id)
+
+    def snapshot(self) -> Optional[dict]:
+        songs = [self.now_playing] if self.running and self.now_playing else []
+        songs.extend(self.queue or ())
+        if not songs or self.voice is None:
+            return None
+
+        return {
+            "kind": "music",
+            "guild_id": self.guild.id,
+            "text_channel_id": self.bound_channel.id,
+            "voice_channel_id": self.voice.channel.id,
+            "loop": self.loop,
+            "loopqueue": self.loopqueue,
+            "volume": self._volume,
+            "position": songs[0].position if songs[0] is self.now_playing else 0,
+            "started_at": songs[0].start_time if songs[0] is self.now_playing else None,
+            "entries": [
+                {"url": song.source_url, "title": song.title, "duration": song.duration}
+                for song in songs
+            ],
+        }
+
     @property
     def voice(self) -> Optional[ActiveVoiceState]:
         return self.bot.get_bot_voice_state(self.guild.id)
@@ -155,9 +352,26 @@ class Queue:
 
     @volume.setter
     def volume(self, new_volume):
-        if self.current_player:
-            self.current_player.volume = new_volume
         self._volume = new_volume
+        # the next song may have been made for the old volume
+        self._discard_prepared()
+        if self.voice is None:
+            return
+        # naff's player takes the gain from here, the current player too if it has one
+        self.voice.volume = self.gain
+        if (
+            self.current_player is not None
+            and not hasattr(self.current_player, "volume")
+            and self.gain != UNITY_GAIN
+            and self.voice.playing
+        ):
+            # passthrough and shared players can't, restart the song on one that can
+            self._restart_at = self.now_playing.position
+            self.voice.player.stop()
+
+    @property
+    def gain(self) -> float:
+        return self._volume / 100
 
     async def add(self, song: Union[Song, str], left: bool = False):
         if isinstance(song, str):
@@ -168,38 +382,65 @@ class Queue:
         else:
             self.queue.append(song)
 
+        self.changed()
         return song
 
     def extend(self, songs: list[Song]):
         self.queue.extend(songs)
+        self.changed()
+
+    def insert(self, index: int, song: Song):
+        self.queue.insert(index, song)
+        self.changed()
+
+    def remove(self, index: int) -> Song:
+        self.changed()
+        return self.queue.pop(index)
+
+    def move(self, source: int, destination: int):
+        self.queue.move(source, destination)
+        self.changed()
 
     def skip(self, amount=1):
         if self.loopqueue:
-            queue = self.queue
-            queue.extend = [queue.popleft() for _ in range(amount - 1) if len(queue)]
+            self.queue.rotate(amount - 1)
         else:
             with contextlib.suppress(IndexError):
-                [self.queue.popleft() for _ in range(amount - 1)]
+                for _ in range(amount - 1):
+                    self.queue.popleft()
+        self.changed()
         self.voice.stop()
 
         if not self.queue:
             self.cleanup()
 
     def shuffle(self):
-        random.shuffle(self.queue)
+        self.queue.shuffle()
+        self.changed()
 
-    def _send(self, msg, *args, **kwargs):
-        return create_task(self.bound_channel.send(msg, *args, **kwargs))
+    def dedupe(self) -> int:
+        self.changed()
+        return self.queue.dedupe(lambda song: cache_key(song.source_url))
 
-    def cleanup(self):
-        self.queue = None
-        # self.guild.voice_client.stop()
-        if self.voice:
-            self.voice.stop()
-            self.voice.disconnect()
+    def _send(self, msg: str):
+        # coalesced with whatever else the channel gets around the same time
+        self.notifier.notify(msg)
+
+    def cleanup(self, disconnect: bool = True):
+        """Let go of the songs and players, forget the queue and, unless told not to, leave the vc"""
+        # cleared rather than dropped, the playback task still reads it on its way out
+        self.queue.clear()
+        self.loop = self.loopqueue = False
+        self._discard_prepared()
+        # the player cleans up the current audio and its ffmpeg once it stops
+        if disconnect and self.voice:
+            create_task(self.voice.disconnect())
 
         if self in self.scale.queues:
             self.scale.queues.remove(self)
+        if store := get_snapshot_store():
+            store.unregister(self.guild.id)
+        discard_notifier(self.bound_channel.id)
 
     def start(self):
         if self.running:
@@ -210,28 +451,53 @@ class Queue:
 
     async def _start(self):
         logger.info(f"Starting a queue in {self.guild.name}")
+        finished_at: Optional[float] = None
 
         while self.queue:
             self.now_playing = np = self.queue.popleft()
-            if np.expired:
-                self.now_playing = np = await self.add(np.original_url)
-
-            self.current_player = await YTDLAudio.from_url(
-                np.url
-            )  # Snek streams it live?
-
-            self.current_player.volume = self.volume
-            # pprint(np.data)
-            self._send(f"Now Playing: **{np.title}**")
+            audio_cache = get_audio_cache()
+            cached = audio_cache.get(np.source_url) if audio_cache is not None else None
+            if (not np.resolved or np.expired) and not cached:
+                try:
+                    await self.refresh(np)
+                except Exception as e:
+                    SONG_FAILURES.inc(labels=("music",))
+                    self._send(f"Failed to load **{np.title}**: `{getattr(e, 'msg', e)}`")
+                    continue
+
+            self.current_player = self._take_prepared(np) or self._make_player(np, cached)
+            self.notifier.now_playing(f"Now Playing: **{np.title}**")
 
             if self.voice is None:
                 self._send(
                     "The bot is not in a vc while trying to play a song, there is a possibility of errors"
                 )
                 break
+            self.voice.volume = self.gain
+
+            if finished_at is not None:
+                self.transitions.append(time.perf_counter() - finished_at)
+                TRANSITIONS.observe(self.transitions[-1], ("music",))
+                logger.debug(
+                    f"Track transition in {self.guild.name} took {self.transitions[-1]:.3f}s"
+                )
+
+            prefetch = create_task(self._prefetch(np))
+            np.ready()
+            self.changed()
+            SONGS_PLAYED.inc(labels=("music",))
             await self.voice.play(self.current_player)
+            finished_at = time.perf_counter()
+            prefetch.cancel()
+            if self._restart_at is not None:
+                np.offset, self._restart_at = self._restart_at, None
+                self.queue.appendleft(np)
+                continue
+            np.offset = 0
+            if audio_cache is not None and not cached:
+                # only now, filling while it plays would download the same stream twice
+                audio_cache.fill(np.source_url, np.url, np.duration, np.codec)
 
-            # todo figure out how to have better refresh stuff
             if self.loop:
                 await self.add(np, left=True)
             elif self.loopqueue:
@@ -240,11 +506,119 @@ class Queue:
         self._send("Queue emptied")
         self.running = False
         self.queue.clear()
-        get_running_loop().call_later(5 * 60, self._leave)
+        self._discard_prepared()
+        # leaving the vc is up to the reaper now
+
+    def _make_player(self, song: Song, cached: Optional[Path]) -> BaseAudio:
+        """The player for a song, from its file in the audio cache if it has one"""
+        if cached is not None:
+            # the cache only holds Opus/Ogg
+            source, before_options, codec = str(cached), "", "opus"
+        else:
+            source, before_options, codec = (
+                song.url,
+                FFMPEG_OPTIONS["before_options"],
+                song.codec,
+            )
+
+        if song.offset:
+            before_options = f"-ss {song.offset:.2f} {before_options}"
+
+        def make_audio() -> BaseAudio:
+            # Opus can go straight to discord unless the samples need changing
+            if codec == "opus" and self.gain == UNITY_GAIN:
+                return OpusPassthroughAudio(source, before_options)
+
+            player = AudioVolume(source)
+            # naff only sets this on players it plays directly, not shared ones
+            player.volume = self.gain
+            player.ffmpeg_before_args = before_options
+            player.ffmpeg_args = FFMPEG_OPTIONS["options"]
+            return player
+
+        if self.gain != UNITY_GAIN or song.offset:
+            # a custom volume or start point can't be shared with other guilds
+            return make_audio()
+        return broker.subscribe((cache_key(song.source_url), codec == "opus"), make_audio)
+
+    def _take_prepared(self, song: Song) -> Optional[BaseAudio]:
+        if self.prepared is None:
+            return None
 
-    def _leave(self):
-        if not self.running and self.voice:
-            create_task(self.voice.disconnect())
+        prepared_song, player = self.prepared
+        self.prepared = None
+        if prepared_song is song:
+            return player
+
+        player.cleanup()
+        return None
+
+    def _discard_prepared(self):
+        if self.prepared is not None:
+            self.prepared[1].cleanup()
+            self.prepared = None
+
+    def _next_song(self, np: Song) -> Optional[Song]:
+        if self.loop:
+            return np
+        if self.queue:
+            return self.queue[0]
+        if self.loopqueue:
+            return np
+        return None
+
+    async def refresh(self, song: Song, priority: Priority = Priority.INTERACTIVE):
+        """Re-extract a song's stream url in place"""
+        url = song.source_url
+        # only the stream url, the title and such are still good
+        await extraction_cache.invalidate(url)
+        fresh = await self.extractor.extract_single_vid(url, priority)
+        song.update(fresh)
+
+    async def _prefetch(self, np: Song):
+        # Refresh the urls that would expire before they get played
+        # a restored or restarted song starts partway in
+        remaining = max(0.0, np.duration - np.offset)
+        due = time.time() + remaining
+        for song in list(islice(self.queue, self.lookahead)):
+            if not song.resolved or song.expires_before(due + EXPIRY_MARGIN):
+                try:
+                    await self.refresh(song, Priority.PREFETCH)
+                except Exception as e:
+                    logger.warning(f"Failed to refresh {song.title}: {e}")
+            due += song.duration
+
+        if not np.duration:
+            # Livestreams and unknown lengths, nothing to line up with
+            return
+        await asyncio.sleep(max(0.0, remaining - PREBUFFER_SECONDS))
+
+        if (upcoming := self._next_song(np)) is None:
+            return
+        audio_cache = get_audio_cache()
+        cached = audio_cache.get(upcoming.source_url) if audio_cache is not None else None
+        if cached is None and (
+            not upcoming.resolved
+            or upcoming.expires_before(time.time() + PREBUFFER_SECONDS + EXPIRY_MARGIN)
+        ):
+            await self.refresh(upcoming, Priority.PREFETCH)
+
+        self._discard_prepared()
+        player = self._make_player(upcoming, cached)
+        # stored first so it still gets cleaned up if this is cancelled mid start
+        self.prepared = (upcoming, player)
+        # starting ffmpeg forks the whole process, don't do that on the loop
+        await asyncio.to_thread(player.pre_buffer)
+
+    @property
+    def transition_stats(self) -> dict:
+        if not self.transitions:
+            return {"count": 0, "average": 0.0, "max": 0.0}
+        return {
+            "count": len(self.transitions),
+            "average": sum(self.transitions) / len(self.transitions),
+            "max": max(self.transitions),
+        }
 
     # def prime_song(self):
     #     vc = self.voice
@@ -294,18 +668,35 @@ class Queue:
 class Extractor:
     def __init__(self, queue: Queue, **options):
         self.queue: Queue = queue
-        self._ytdl = YoutubeDL(BASIC_OPTS | options)
+        # The YoutubeDL instances live in the shared extraction service,
+        # an Extractor only remembers which options it wants
+        self.options: dict = BASIC_OPTS | options
+
+    async def _extract(
+        self, link: str, download: bool = False, priority: Priority = Priority.INTERACTIVE
+    ) -> dict:
+        service = get_extraction_service(warm_options=BASIC_OPTS)
+        return await service.extract(
+            link, self.options, download=download, guild_id=self.queue.guild.id, priority=priority
+        )
 
-    def _extract(self, link: str, download: bool = False) -> dict:
-        return self._ytdl.extract_info(link, download=download)
+    async def extract_single_vid(
+        self, url: str, priority: Priority = Priority.INTERACTIVE
+    ) -> Song:
+        if (data := await extraction_cache.get(url)) is not None:
+            return Song(data, base_url=url)
 
-    @sync_to_thread
-    def extract_single_vid(self, url: str) -> Song:
-        data = self._extract(url)
+        data = await self._extract(url, priority=priority)
         if "url" not in data:
             raise ExtractionError("Invalid url")
+
+        await extraction_cache.put(url, data)
         return Song(data, base_url=url)
 
+    async def full_info(self, song: Song) -> dict:
+        """Extract the complete info dict of a song again"""
+        return await self._extract(song.source_url)
+
     async def play_single_song(self, url):
         song: Song = await self.extract_single_vid(url)
         await self.queue.add(song)
@@ -318,46 +709,88 @@ class Extractor:
         #     await self.queue._send("File added to queue")
 
     async def play_playlist(self, url: str):
-        # todo figure out how to make neater, possibly semaphore?
         # if 'youtube' not in url:
         #     raise ExtractionError('Only YouTube links support playlists')
-        info = self._extract(url)
+        info = await self._extract(url)
+        entries = [entry for entry in info["entries"] if entry and entry.get("url")]
 
-        # urls = info["entries"]
+        if len(entries) > LAZY_PLAYLIST_SIZE:
+            return await self.queue_playlist(info.get("title"), entries)
 
-        coros: list[Coroutine[None, None, Song]] = [
-            self.extract_single_vid(item["url"]) for item in iter(info["entries"])
-        ]
+        msg = await self.queue.bound_channel.send(
+            f"Processing playlist: 0/{len(entries)}"
+        )
 
-        msg = await self.queue.bound_channel.send("Processing playlist")
+        added = 0
+        errors: list[str] = []
+        last_edit = time.monotonic()
+        progress: Optional[asyncio.Task] = None
+
+        async for item in ordered_map(
+            lambda entry: self.extract_single_vid(entry["url"], Priority.BULK),
+            entries,
+            window=PLAYLIST_WINDOW,
+        ):
+            if isinstance(item, Song):
+                await self.queue.add(item)
+                added += 1
+                # no-op while running, restarts the queue if it drained in the meantime
+                self.queue.start()
+            else:
+                errors.append(f"{item.__class__.__name__}: {getattr(item, 'msg', item)}")
+
+            # one edit in flight at a time, so they can't land out of order
+            if time.monotonic() - last_edit > PROGRESS_INTERVAL and (
+                progress is None or progress.done()
+            ):
+                last_edit = time.monotonic()
+                progress = create_task(
+                    msg.edit(
+                        content=f"Processing playlist: {added + len(errors)}/{len(entries)}"
+                        + (f" ({len(errors)} failed)" if errors else "")
+                    )
+                )
 
-        first = await coros.pop()
-        await self.queue.add(first)
+        PLAYLIST_ENTRIES.inc(added, ("added",))
+        PLAYLIST_ENTRIES.inc(len(errors), ("failed",))
+        if progress is not None:
+            # otherwise a slow progress edit could overwrite the result
+            with contextlib.suppress(HTTPException):
+                await progress
+
+        content = f"Playlist added! {added}/{len(entries)} songs queued"
+        if errors:
+            content += f", {len(errors)} failed:\n" + "\n".join(
+                f"`{error}`" for error in errors[:5]
+            )
+            if len(errors) > 5:
+                content += f"\n...and {len(errors) - 5} more"
+        await msg.edit(content=content[:2000])
+
+    async def queue_playlist(self, title: Optional[str], entries: list[dict]):
+        """Queue a playlist without resolving anything, for ones too big to extract up front"""
+        # the queue's prefetch resolves each song shortly before it plays,
+        # so their stream urls are still fresh by then
+        metadata = await extraction_cache.get_metadata_many([entry["url"] for entry in entries])
+        self.queue.extend(
+            [Song.from_flat(entry, title, meta) for entry, meta in zip(entries, metadata)]
+        )
         self.queue.start()
+        PLAYLIST_ENTRIES.inc(len(entries), ("lazy",))
 
-        for group in chunk(coros, size=25):
-            songs = await gather(*group, return_exceptions=True)
-            for item in songs:
-                if isinstance(item, Song):
-                    await self.queue.add(item)
-                else:
-
-                    await msg.channel.send(
-                        f"Exception Caught: `{item.__class__.__name__}: {item.msg}`"
-                    )
-
-        await msg.reply("Playlist added!")
+        await self.queue.bound_channel.send(
+            f"Playlist added! {len(entries)} songs queued, they'll load as they come up"
+        )
 
     async def search_song(self, query: str):
-        assert query.startswith("ytsearch:")
-        info = self._extract(query)
-
-        song = await self.extract_single_vid(info["entries"][0]["url"])
-        song.original_url = info["entries"][0]["url"]
-
-        if len(info["entries"]) > 1:
+        # shares its results with /play's autocomplete, so a repeat search is free
+        results = await search_cache.search(query.removeprefix("ytsearch:"))
+        if not results:
             # noinspection PyProtectedMember
-            await self.queue._send("Something weird happened, DM `Catalyst4#4222`")
+            return self.queue._send(f"Nothing found for `{query}`")
+
+        song = await self.extract_single_vid(results[0].url)
+        song.original_url = results[0].url
 
         await self.queue.add(song)
         self.queue.start()
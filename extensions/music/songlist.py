@@ -0,0 +1,227 @@
+import random
+from bisect import bisect_right
+from collections.abc import Sequence
+from typing import TYPE_CHECKING, Callable, Hashable, Iterable, Iterator, Optional
+
+from naff.ext.paginators import Page
+
+if TYPE_CHECKING:
+    from .classes import Song
+
+# Chunks get split once they grow past twice this
+CHUNK_SIZE = 128
+SONGS_PER_PAGE = 15
+
+
+class SongList:
+    """A list of songs split into chunks, so positional operations stay cheap
+
+    Indexing, insert, remove and move only touch one chunk plus a bisect over
+    the chunk offsets, instead of shifting or walking the whole queue like a
+    deque or list would. Popping the front never looks past the first chunk.
+    """
+
+    def __init__(self, songs: Iterable["Song"] = (), chunk_size: int = CHUNK_SIZE):
+        self.chunk_size: int = chunk_size
+        self._chunks: list[list["Song"]] = []
+        # _starts[i] is the index of the first song in _chunks[i]
+        self._starts: Optional[list[int]] = None
+        self._len: int = 0
+        self.extend(songs)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __bool__(self) -> bool:
+        return self._len > 0
+
+    def __iter__(self) -> Iterator["Song"]:
+        for chunk in self._chunks:
+            yield from chunk
+
+    def _index_starts(self) -> list[int]:
+        if self._starts is None:
+            starts = []
+            total = 0
+            for chunk in self._chunks:
+                starts.append(total)
+                total += len(chunk)
+            self._starts = starts
+        return self._starts
+
+    def _locate(self, index: int) -> tuple[int, int]:
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("SongList index out of range")
+
+        starts = self._index_starts()
+        chunk = bisect_right(starts, index) - 1
+        return chunk, index - starts[chunk]
+
+    def _changed(self, chunk: Optional[int] = None):
+        self._starts = None
+        if chunk is None:
+            return
+
+        if not self._chunks[chunk]:
+            del self._chunks[chunk]
+        elif len(self._chunks[chunk]) > self.chunk_size * 2:
+            half = self.chunk_size
+            self._chunks[chunk : chunk + 1] = [
+                self._chunks[chunk][:half],
+                self._chunks[chunk][half:],
+            ]
+
+    def __getitem__(self, index: int | slice):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._len))]
+        chunk, offset = self._locate(index)
+        return self._chunks[chunk][offset]
+
+    def __setitem__(self, index: int, song: "Song"):
+        chunk, offset = self._locate(index)
+        self._chunks[chunk][offset] = song
+
+    def copy(self) -> "SongList":
+        """A shallow copy, the songs are shared but later changes to either list aren't"""
+        songs = SongList(chunk_size=self.chunk_size)
+        songs._chunks = [chunk.copy() for chunk in self._chunks]
+        songs._len = self._len
+        return songs
+
+    def page(self, start: int, stop: int) -> list["Song"]:
+        """Get the songs in [start, stop) without walking the whole list"""
+        start, stop, _ = slice(start, stop).indices(self._len)
+        if start >= stop:
+            return []
+
+        chunk, offset = self._locate(start)
+        songs = []
+        while len(songs) < stop - start and chunk < len(self._chunks):
+            songs.extend(self._chunks[chunk][offset : offset + stop - start - len(songs)])
+            chunk += 1
+            offset = 0
+        return songs
+
+    def append(self, song: "Song"):
+        if not self._chunks or len(self._chunks[-1]) >= self.chunk_size:
+            self._chunks.append([])
+        self._chunks[-1].append(song)
+        self._len += 1
+        self._starts = None
+
+    def appendleft(self, song: "Song"):
+        if not self._chunks or len(self._chunks[0]) >= self.chunk_size:
+            self._chunks.insert(0, [])
+        self._chunks[0].insert(0, song)
+        self._len += 1
+        self._starts = None
+
+    def extend(self, songs: Iterable["Song"]):
+        for song in songs:
+            self.append(song)
+
+    def insert(self, index: int, song: "Song"):
+        if index >= self._len:
+            return self.append(song)
+        if index <= 0:
+            return self.appendleft(song)
+
+        chunk, offset = self._locate(index)
+        self._chunks[chunk].insert(offset, song)
+        self._len += 1
+        self._changed(chunk)
+
+    def pop(self, index: int = -1) -> "Song":
+        chunk, offset = self._locate(index)
+        song = self._chunks[chunk].pop(offset)
+        self._len -= 1
+        self._changed(chunk)
+        return song
+
+    def popleft(self) -> "Song":
+        if not self._len:
+            raise IndexError("pop from an empty SongList")
+        song = self._chunks[0].pop(0)
+        self._len -= 1
+        self._changed(0)
+        return song
+
+    def move(self, source: int, destination: int):
+        self.insert(destination, self.pop(source))
+
+    def rotate(self, amount: int = 1):
+        """Move `amount` songs from the front to the back"""
+        for _ in range(min(amount, self._len)):
+            self.append(self.popleft())
+
+    def clear(self):
+        self._chunks.clear()
+        self._len = 0
+        self._starts = None
+
+    def shuffle(self):
+        """Fisher-Yates in place, the chunks keep their sizes so nothing is copied"""
+        for i in range(self._len - 1, 0, -1):
+            j = random.randint(0, i)
+            a_chunk, a_offset = self._locate(i)
+            b_chunk, b_offset = self._locate(j)
+            a, b = self._chunks[a_chunk], self._chunks[b_chunk]
+            a[a_offset], b[b_offset] = b[b_offset], a[a_offset]
+
+    def dedupe(self, key: Callable[["Song"], Hashable]) -> int:
+        """Drop every song whose key was already seen, returns how many were removed"""
+        seen = set()
+        removed = 0
+        for chunk in self._chunks:
+            kept = []
+            for song in chunk:
+                if (k := key(song)) in seen:
+                    removed += 1
+                else:
+                    seen.add(k)
+                    kept.append(song)
+            chunk[:] = kept
+
+        self._chunks = [chunk for chunk in self._chunks if chunk]
+        self._len -= removed
+        self._starts = None
+        return removed
+
+
+class QueuePages(Sequence):
+    """Lazily rendered pages of a queue for naff's Paginator
+
+    Only the page being looked at gets formatted, so showing a queue of
+    thousands of songs costs the same as showing one of fifteen. The queue
+    is copied up front, copying the song references is cheap and keeps the
+    page count and now playing consistent while the paginator is open.
+    """
+
+    def __init__(self, songs: SongList, now_playing: Optional["Song"] = None):
+        self.songs: SongList = songs.copy()
+        self.now_playing: Optional["Song"] = now_playing
+
+    def __len__(self) -> int:
+        return max(1, -(-len(self.songs) // SONGS_PER_PAGE))
+
+    def __getitem__(self, index: int) -> Page:
+        if not -len(self) <= index < len(self):
+            raise IndexError("page index out of range")
+        index %= len(self)
+
+        start = index * SONGS_PER_PAGE
+        lines = []
+        if self.now_playing is not None:
+            lines.append(f"Now Playing: **{self.now_playing.title}**\n")
+        if not self.songs:
+            lines.append("The queue is empty")
+
+        lines.extend(
+            f"`{position}.` {song.title} ({song.duration_str})"
+            for position, song in enumerate(
+                self.songs.page(start, start + SONGS_PER_PAGE), start=start + 1
+            )
+        )
+        return Page("\n".join(lines), title=f"Queue ({len(self.songs)} songs)")
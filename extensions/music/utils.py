@@ -1,11 +1,16 @@
 import asyncio
+import re
 import time
+from collections import deque
 from functools import partial, wraps
 from itertools import chain, islice
-from typing import Any, Callable, Coroutine, Generator, Iterable, TypeVar
+from typing import (Any, AsyncGenerator, Awaitable, Callable, Coroutine,
+                    Generator, Iterable, Optional, TypeVar, Union)
 
 _T = TypeVar("_T")
 
+EXPIRE_REGEX = re.compile(r"expire=(\d*)")
+
 
 def sync_to_thread(
     func: Callable[[...], _T]
@@ -29,6 +34,35 @@ def chunk(
         yield chain([first], islice(iterator, size))
 
 
+async def ordered_map(
+    func: Callable[[_T], Awaitable[Any]], iterable: Iterable[_T], window: int = 8
+) -> AsyncGenerator[Union[Any, Exception], None]:
+    """Run func over iterable with at most `window` calls in flight
+
+    Results come out in the same order as the input, each one as soon as it
+    and everything before it is done. Exceptions are yielded instead of raised.
+    """
+    iterator = iter(iterable)
+    pending: deque[asyncio.Task] = deque()
+
+    def fill():
+        for item in islice(iterator, window - len(pending)):
+            pending.append(asyncio.create_task(func(item)))
+
+    fill()
+    try:
+        while pending:
+            task = pending.popleft()
+            fill()
+            try:
+                yield await task
+            except Exception as e:
+                yield e
+    finally:
+        for task in pending:
+            task.cancel()
+
+
 def short_diff_from_unix(then: int) -> str:
     now = time.time() - then
     minutes, seconds = divmod(int(now), 60)
@@ -42,3 +76,11 @@ def short_diff_from_time(diff) -> str:
     hours, minutes = divmod(minutes, 60)
 
     return f"{hours}:{minutes:02}:{seconds:02}" if hours else f"{minutes}:{seconds:02}"
+
+
+def parse_expiry(url: str) -> Optional[int]:
+    # Youtube media links have expire=unix_time in the url
+    res = EXPIRE_REGEX.search(url)
+    if res is None or not res[1]:
+        return None
+    return int(res[1])
@@ -1,19 +1,81 @@
 import asyncio
+import contextlib
+import logging
+from typing import Optional
 
-from naff import (ChannelTypes, Client, Extension, GuildVoice,
-                  InteractionContext, OptionTypes, slash_command, slash_option)
-from naff_audio import YTAudio
+from naff import (AutocompleteContext, ChannelTypes, Client, Extension,
+                  GuildVoice, InteractionContext, OptionTypes, listen,
+                  slash_command, slash_option)
+from naff.client.errors import HTTPException
 
-from .tools import MusicQueue
+from ..utils import metrics
+from ..utils.reaper import reaper
+from ..utils.search import (MAX_CHOICES, MIN_QUERY_LENGTH, is_url,
+                            search_cache)
+from ..utils.snapshots import get_snapshot_store
+from .tools import SONG_FAILURES, MusicQueue, PendingAudio
+
+
+logger = logging.getLogger("Myr.new_music")
 
 
 class MusicCog(Extension):
     def __init__(self, bot: Client):
         self.bot: Client = bot
         self.queues: dict[int, MusicQueue] = {}
+        # /play's background halves, kept here so they don't get garbage collected
+        self.loading: set[asyncio.Task] = set()
+        metrics.gauge(
+            "myr_new_music_queues",
+            "Queues of the new music cog",
+            lambda: {
+                ("playing",): sum(queue.running for queue in self.queues.values()),
+                ("idle",): sum(not queue.running for queue in self.queues.values()),
+            },
+            ("state",),
+        )
+        reaper.register("new_music", self.guild_state, self.release_guild)
+
+    @listen()
+    async def on_startup(self):
+        reaper.start(self.bot)
+
+        if store := get_snapshot_store():
+            await store.connect()
+            for snapshot in await store.load("new_music"):
+                asyncio.create_task(self.restore_queue(snapshot))
+
+    async def restore_queue(self, snapshot: dict):
+        """Rejoin a guild's vc after a restart and pick up where its queue left off"""
+        channel = self.bot.get_channel(snapshot["voice_channel_id"])
+        if channel is None:
+            return
+
+        try:
+            voice_state = await channel.connect()
+        except Exception as e:
+            logger.warning(f"Couldn't restore the queue in {channel.guild.name}: {e}")
+            return
+
+        queue = MusicQueue.from_snapshot(voice_state, snapshot)
+        queue.start()
+        self.queues[snapshot["guild_id"]] = queue
+        logger.info(f"Restored a queue of {len(queue)} songs in {channel.guild.name}")
+
+    def guild_state(self, guild_id: int) -> Optional[bool]:
+        """For the reaper: None without a queue, otherwise if it's playing or has songs queued"""
+        if (queue := self.queues.get(guild_id)) is None:
+            return None
+        return queue.running or len(queue) > 0
+
+    def release_guild(self, guild_id: int):
+        if (queue := self.queues.pop(guild_id, None)) is not None:
+            queue.close()
 
     def get_queue(self, ctx: InteractionContext) -> MusicQueue:
-        if queue := self.queues.get(ctx.guild_id):
+        reaper.touch(ctx.guild_id)
+        # an empty queue is falsy, so check for None or every idle guild gets a second queue
+        if (queue := self.queues.get(ctx.guild_id)) is not None:
             return queue
 
         queue = MusicQueue(ctx.voice_state)
@@ -41,25 +103,72 @@ class MusicCog(Extension):
         await ctx.send(f"Connected to **{ctx.guild.me.voice.channel.name}**")
 
     @slash_command("play", description="Play a song!")
-    @slash_option("song", "The song to play", 3, True)
+    @slash_option("song", "The song to play", 3, True, autocomplete=True)
     async def play(self, ctx: InteractionContext, song: str):
         await ctx.defer()
         print(song)
 
+        # free text that autocomplete already searched for doesn't need searching again
+        title = None
+        if not is_url(song) and (results := search_cache.cached(song)):
+            song, title = results[0].url, results[0].title
+
         if not ctx.voice_state:
             if not ctx.author.voice:
                 return await ctx.send("You must be in a voice channel!")
             await ctx.author.voice.channel.connect()
 
+        # the song goes in the queue as a placeholder and loads in the background,
+        # the reply doesn't wait for it
         queue = self.get_queue(ctx)
-        audio = await YTAudio.from_url(song, stream=True)
-        # await asyncio.to_thread(audio._create_process)
-        audio.pre_buffer()
-        # await asyncio.sleep(3)
-        # await ctx.voice_state.play(audio)
-        queue.put(audio)
-
-        await ctx.send(f"**{audio.entry['title']}** was added to the queue!")
+        pending = PendingAudio(song, title)
+        pending.prepare(queue.passthrough, ctx.guild_id)
+        queue.put(pending)
+
+        pending.message = await ctx.send(
+            f"**{pending.entry['title']}** was added to the queue, loading..."
+        )
+        task = asyncio.create_task(self.finish_loading(queue, pending))
+        self.loading.add(task)
+        task.add_done_callback(self.loading.discard)
+
+    async def finish_loading(self, queue: MusicQueue, pending: PendingAudio):
+        """Wait for a queued song to load, and say how it went in the /play reply"""
+        try:
+            await pending.prepare()
+        except asyncio.CancelledError:
+            # the queue was cleared before it loaded
+            return
+        except Exception as e:
+            # once the queue has popped it, the queue counts the failure
+            if queue.remove(pending):
+                SONG_FAILURES.inc(labels=("new_music",))
+            content = f"Couldn't load **{pending.entry['title']}**: `{getattr(e, 'msg', e)}`"
+        else:
+            content = f"**{pending.entry['title']}** was added to the queue!"
+
+        # the reply might be gone by now, nothing to do about that
+        with contextlib.suppress(HTTPException):
+            await pending.message.edit(content=content)
+
+    @play.autocomplete("song")
+    async def play_autocomplete(self, ctx: AutocompleteContext, song: str = ""):
+        query = song.strip()
+        if len(query) < MIN_QUERY_LENGTH or is_url(query):
+            return await ctx.send([])
+
+        # cached answers go out straight away, only real searches wait for typing to stop
+        if (results := search_cache.cached(query)) is None:
+            if not await search_cache.debounce(ctx.author.id):
+                # a newer keystroke will answer instead
+                return
+            try:
+                results = await search_cache.search(query)
+            except Exception as e:
+                logger.warning(f"Search for {query!r} failed: {e}")
+                results = []
+
+        await ctx.send([result.choice() for result in results[:MAX_CHOICES]])
 
     # @slash_command("now")
     async def now(self, *args):
@@ -99,6 +208,9 @@ class MusicCog(Extension):
         queue.clear()
         await ctx.send("Queue cleared!")
 
+    def shed(self) -> None:
+        reaper.unregister("new_music")
+        super(MusicCog, self).shed()
 
 
 def setup(bot: Client):  # sourcery skip: instance-method-first-arg-name
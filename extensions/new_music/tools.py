@@ -1,13 +1,275 @@
 import asyncio
+import time
 from collections import deque
+from typing import Optional
 
+from naff import ActiveVoiceState, Message
+from naff.api.voice.audio import BaseAudio
 from naff_audio import NaffQueue, YTAudio
 
+from ..utils import metrics
+from ..utils.broker import broker
+from ..utils.extraction import Priority, get_extraction_service
+from ..utils.notifier import discard_notifier, get_notifier
+from ..utils.opus import UNITY_GAIN, OpusPassthroughAudio, is_opus
+from ..utils.snapshots import get_snapshot_store
+
+# Same as naff_audio's defaults, but run through the shared extraction service
+YTDL_OPTS = {
+    "format": "bestaudio/best",
+    "noplaylist": True,
+    "nocheckcertificate": True,
+    "ignoreerrors": False,
+    "logtostderr": False,
+    "quiet": True,
+    "no_warnings": True,
+    "default_search": "auto",
+    "source_address": "0.0.0.0",
+}
+RECONNECT_ARGS = "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5"
+# Shared with the legacy queue, told apart by the queue label
+SONGS_PLAYED = metrics.counter("myr_songs_played_total", "Songs that started playing", ("queue",))
+SONG_FAILURES = metrics.counter(
+    "myr_song_failures_total", "Songs skipped because they couldn't be loaded", ("queue",)
+)
+EXTRACTIONS_COALESCED = metrics.counter(
+    "myr_extractions_coalesced_total", "Extractions that joined one already running for the same url"
+)
+# Extractions running right now by url, the same link pasted in five guilds is extracted once
+_extracting: dict[str, asyncio.Task] = {}
+
+
+async def _extract_entry(url: str, guild_id: Optional[int], priority: Priority) -> dict:
+    data = await get_extraction_service().extract(
+        url, YTDL_OPTS, guild_id=guild_id, priority=priority
+    )
+    if "entries" in data:
+        data = data["entries"][0]
+    return data
+
+
+async def extract_entry(
+    url: str, guild_id: Optional[int] = None, priority: Priority = Priority.INTERACTIVE
+) -> dict:
+    """The info dict for a url, concurrent calls for the same url share one extraction
+
+    The shared extraction is scheduled for whoever asked first.
+    """
+    task = _extracting.get(url)
+    if task is None:
+        task = _extracting[url] = asyncio.create_task(_extract_entry(url, guild_id, priority))
+        task.add_done_callback(lambda _: _extracting.pop(url, None))
+    else:
+        EXTRACTIONS_COALESCED.inc()
+    # everyone gets their own copy, queues add their own bits to the entry
+    return dict(await asyncio.shield(task))
+
+
+async def audio_from_url(
+    url: str,
+    passthrough: bool = False,
+    guild_id: Optional[int] = None,
+    priority: Priority = Priority.INTERACTIVE,
+) -> BaseAudio:
+    """Create streamed audio, like `YTAudio.from_url` but without a thread per call
+
+    With passthrough, Opus sources skip ffmpeg's re-encoding entirely and
+    the decoder is shared with every other guild playing the same track.
+    """
+    data = await extract_entry(url, guild_id, priority)
+
+    def make_audio() -> BaseAudio:
+        if passthrough and is_opus(data):
+            return OpusPassthroughAudio(data["url"], RECONNECT_ARGS)
+        audio = YTAudio(data["url"])
+        audio.ffmpeg_before_args = RECONNECT_ARGS
+        if passthrough:
+            # shared audio never gets the voice state's volume, it has to match passthrough
+            audio.volume = UNITY_GAIN
+        return audio
+
+    if passthrough:
+        # passthrough also means nobody changed the volume, so it can be shared
+        audio = broker.subscribe(
+            (data.get("extractor"), data.get("id"), is_opus(data)), make_audio
+        )
+    else:
+        audio = make_audio()
+    audio.entry = data
+    return audio
+
+
+class PendingAudio:
+    """A queue entry that hasn't been extracted yet
+
+    It's resolved right before it plays, or earlier in the background once
+    something calls `prepare`. Either way there's only ever one resolution.
+    """
+
+    def __init__(self, url: str, title: Optional[str] = None, duration: int = 0, offset: float = 0):
+        self.url: str = url
+        self.entry: dict = {"title": title or url, "duration": duration, "webpage_url": url}
+        # Seconds into the song to start from
+        self.offset: float = offset
+        # The /play reply, if there is one it reports how loading went
+        self.message: Optional[Message] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def prepare(
+        self,
+        passthrough: bool = False,
+        guild_id: Optional[int] = None,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> asyncio.Task:
+        """Start resolving in the background, `resolve` picks up the result later"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._load(passthrough, guild_id, priority))
+        return self._task
+
+    def cleanup(self):
+        """Stop loading, or let go of what was loaded"""
+        if self._task is None:
+            return
+        if not self._task.done():
+            self._task.cancel()
+        elif not self._task.cancelled() and self._task.exception() is None:
+            self._task.result().cleanup()
+
+    async def _load(
+        self, passthrough: bool, guild_id: Optional[int], priority: Priority
+    ) -> BaseAudio:
+        # a start point can't be shared with other guilds
+        audio = await audio_from_url(
+            self.url, passthrough and not self.offset, guild_id, priority
+        )
+        if self.offset:
+            audio.ffmpeg_before_args = f"-ss {self.offset:.2f} {audio.ffmpeg_before_args}"
+            audio.entry["offset"] = self.offset
+        # starting ffmpeg forks the whole process, don't do that on the loop
+        await asyncio.to_thread(audio.pre_buffer)
+
+        # listings and snapshots keep reading the placeholder until it's popped
+        self.entry.update(
+            title=audio.entry.get("title") or self.entry["title"],
+            duration=audio.entry.get("duration") or self.entry["duration"],
+            webpage_url=entry_url(audio) or self.url,
+        )
+        return audio
+
+    async def resolve(
+        self, passthrough: bool = False, guild_id: Optional[int] = None
+    ) -> BaseAudio:
+        # if it's only resolved now, it's about to play
+        return await self.prepare(passthrough, guild_id)
+
+
+def entry_url(audio) -> Optional[str]:
+    entry = getattr(audio, "entry", None) or {}
+    return entry.get("webpage_url") or entry.get("original_url")
+
 
 class MusicQueue(NaffQueue):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.now_playing: YTAudio | None = None
+        self.started_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        # naff defaults to half volume, passthrough can only play at full
+        self.voice_state.volume = UNITY_GAIN
+
+        if store := get_snapshot_store():
+            store.register(self.voice_state.guild.id, self)
+
+    @classmethod
+    def from_snapshot(cls, voice_state: ActiveVoiceState, snapshot: dict) -> "MusicQueue":
+        """Rebuild a queue from a snapshot without extracting anything up front"""
+        queue = cls(voice_state)
+        voice_state.volume = snapshot["volume"]
+        for entry in snapshot["entries"]:
+            queue.put(PendingAudio(entry["url"], entry["title"], entry["duration"]))
+        if len(queue):
+            queue.peek().offset = snapshot["position"]
+        return queue
+
+    @property
+    def running(self) -> bool:
+        return self.now_playing is not None
+
+    def changed(self):
+        """Mark the queue for the next snapshot"""
+        if store := get_snapshot_store():
+            store.mark_dirty(self.voice_state.guild.id)
+
+    def snapshot(self) -> Optional[dict]:
+        entries = [self.now_playing] if self.now_playing is not None else []
+        entries.extend(self._entries)
+        entries = [audio for audio in entries if entry_url(audio)]
+        if not entries or not self.voice_state.connected:
+            return None
+
+        position = 0
+        if entries[0] is self.now_playing and self.started_at is not None:
+            position = time.time() - self.started_at
+
+        return {
+            "kind": "new_music",
+            "guild_id": self.voice_state.guild.id,
+            "text_channel_id": self.voice_state.channel.id,
+            "voice_channel_id": self.voice_state.channel.id,
+            "loop": False,
+            "loopqueue": False,
+            "volume": self.voice_state.volume,
+            "position": position,
+            "started_at": self.started_at if entries[0] is self.now_playing else None,
+            "entries": [
+                {
+                    "url": entry_url(audio),
+                    "title": audio.entry.get("title"),
+                    "duration": audio.entry.get("duration") or 0,
+                }
+                for audio in entries
+            ],
+        }
+
+    def put(self, audio) -> None:
+        super().put(audio)
+        self.changed()
+
+    def put_first(self, audio) -> None:
+        super().put_first(audio)
+        self.changed()
+
+    def remove(self, audio) -> bool:
+        """Take an entry out of the queue, False if it isn't in it anymore"""
+        try:
+            self._entries.remove(audio)
+        except ValueError:
+            return False
+        self.changed()
+        return True
+
+    def clear(self) -> None:
+        # pre-buffered songs each have an ffmpeg running
+        for audio in self._entries:
+            audio.cleanup()
+        super().clear()
+        self.changed()
+
+    def start(self) -> None:
+        # NaffQueue doesn't keep the task, close needs it
+        self.task = asyncio.create_task(self())
+
+    def close(self):
+        """Stop the queue for good and let go of everything in it
+
+        The current song is left to the player, it cleans up once the vc disconnects.
+        """
+        if self.task is not None:
+            self.task.cancel()
+        self.clear()
+        if store := get_snapshot_store():
+            store.unregister(self.voice_state.guild.id)
+        discard_notifier(self.voice_state.channel.id)
 
     # Don't you just love mangling?
     async def __playback_queue(self) -> None:
@@ -17,14 +279,58 @@ class MusicQueue(NaffQueue):
                 await self.voice_state.wait_for_stopped()
             audio: YTAudio
             # noinspection PyTypeChecker
-            self.now_playing = audio = await self.pop()
+            audio = await self.pop()
+            if isinstance(audio, PendingAudio):
+                try:
+                    audio = await audio.resolve(self.passthrough, self.voice_state.guild.id)
+                except asyncio.CancelledError:
+                    if asyncio.current_task().cancelling():
+                        raise
+                    # the queue was cleared while it was loading
+                    continue
+                except Exception as e:
+                    SONG_FAILURES.inc(labels=("new_music",))
+                    # a /play reply says what went wrong itself
+                    if audio.message is None:
+                        get_notifier(self.voice_state.channel).notify(
+                            f"Failed to load **{audio.entry['title']}**: `{getattr(e, 'msg', e)}`"
+                        )
+                    continue
+            self.now_playing = audio
 
-            await self.voice_state.channel.send(
+            get_notifier(self.voice_state.channel).now_playing(
                 f"Now playing: **{getattr(audio, 'entry', {}).get('title') or 'UNKNOWN'}**"
             )
 
+            self.started_at = time.time() - audio.entry.get("offset", 0)
+            self.changed()
+            SONGS_PLAYED.inc(labels=("new_music",))
             await self.voice_state.play(audio)
             self.now_playing = None
+            self.started_at = None
+
+    @property
+    def passthrough(self) -> bool:
+        """If new audio can skip re-encoding"""
+        return self.voice_state.volume == UNITY_GAIN
+
+    async def set_volume(self, volume: float) -> None:
+        """Change the volume, use this over `voice_state.volume`
+
+        Passthrough and shared audio can't change their gain, so the current
+        song is restarted from where it is on audio that can.
+        """
+        self.voice_state.volume = volume
+        audio = self.now_playing
+        if audio is None or hasattr(audio, "volume") or volume == UNITY_GAIN:
+            return
+        if not (url := entry_url(audio)):
+            return
+
+        position = time.time() - self.started_at if self.started_at is not None else 0
+        entry = audio.entry
+        self.put_first(PendingAudio(url, entry.get("title"), entry.get("duration") or 0, position))
+        await self.voice_state.stop()
 
     async def __call__(self) -> None:
         # needed for overrides
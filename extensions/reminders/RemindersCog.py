@@ -2,36 +2,43 @@ import asyncio
 import logging
 import time
 
-import aiosqlite
 from naff import (Client, Extension, InteractionContext, OptionTypes, listen,
                   slash_command, slash_option)
 
+from .scheduler import Reminder, ReminderScheduler
+from .storage import ReminderStore
+
 logger = logging.getLogger("Myr.reminders")
 
 
 class RemindersCog(Extension):
     def __init__(self, bot: Client):
         self.bot: Client = bot
-        self.db: aiosqlite.Connection = ...
-        self.tasks: dict[int, asyncio.Task] = {}
+        self.store: ReminderStore = ...
+        self.scheduler: ReminderScheduler = ...
+        self._closing: asyncio.Task = ...
 
         logger.info("Reminders cog loaded!")
 
     @listen()
     async def on_startup(self):
-        self.db = await aiosqlite.connect("reminders.db")
-
-        await self.db.execute(
-            """CREATE TABLE IF NOT EXISTS reminders (
-             id INTEGER PRIMARY KEY,
-             user_id INTEGER,
-             channel_id INTEGER,
-             reminder TEXT,
-             time REAL
-        )"""
-        )
+        self.store = ReminderStore("reminders.db")
+        await self.store.connect()
+
+        self.scheduler = ReminderScheduler(self.store, self.send_remind)
+        await self.scheduler.start()
 
     def shed(self) -> None:
+        if self.scheduler is not ...:
+            self.scheduler.stop()
+        if self.store is not ...:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                pass  # the bot has stopped, main.py closes the store
+            else:
+                # unloaded while running, write out what's pending
+                self._closing = loop.create_task(self.store.close())
         super(RemindersCog, self).shed()
         logger.info("Reminders cog unloaded!")
 
@@ -75,27 +82,42 @@ class RemindersCog(Extension):
         if not seconds:
             return await ctx.send("Please enter a valid time.")
 
-        async with self.db.execute("SELECT MAX(id) FROM reminders") as cursor:
-            row = await cursor.fetchone()
-            # noinspection PyShadowingBuiltins
-            id = 0 if row[0] is None else row[0] + 1
-
-        cursor = await self.db.execute(
-            "INSERT INTO reminders VALUES (?, ?, ?, ?, ?)",
-            (id, ctx.author.id, ctx.channel.id, content, time.time() + seconds),
+        reminder = self.store.add(
+            ctx.author.id, ctx.channel.id, content, time.time() + seconds
         )
-        await cursor.close()
-
-        await ctx.send(f"You will be reminded <t:{int(time.time()) + seconds}:R>")
+        self.scheduler.schedule(reminder)
 
-        self.tasks[int(time.time()) + seconds] = asyncio.create_task(
-            self.send_remind(ctx, int(time.time()) + seconds, content)
+        await ctx.send(
+            f"You will be reminded <t:{int(reminder.time)}:R> (id `{reminder.id}`)"
         )
 
-    async def send_remind(self, ctx: InteractionContext, wait_until: int, content: str):
-        await asyncio.sleep(wait_until - time.time())
-        await ctx.author.send(f"Reminder: {content}")
-        del self.tasks[wait_until]
+    @slash_command(
+        name="remindcancel",
+        description="Cancel one of your reminders",
+        scopes=[817958268097789972],
+    )
+    @slash_option(
+        name="id",
+        description="The id of the reminder",
+        opt_type=OptionTypes.INTEGER,
+        required=True,
+    )
+    async def remindcancel(self, ctx: InteractionContext, id: int):  # noqa
+        if await self.store.owner(id) != ctx.author.id:
+            return await ctx.send("You don't have a reminder with that id", ephemeral=True)
+
+        self.store.delete(id)
+        self.scheduler.cancel(id)
+        await ctx.send("Reminder cancelled!")
+
+    async def send_remind(self, reminder: Reminder):
+        user = await self.bot.fetch_user(reminder.user_id)
+        overdue = time.time() - reminder.time
+        if overdue > 60:
+            # the bot was probably down when it was due
+            await user.send(f"Reminder (late, was due <t:{int(reminder.time)}:R>): {reminder.content}")
+        else:
+            await user.send(f"Reminder: {reminder.content}")
 
 
 # some string copilot made:
@@ -0,0 +1,144 @@
+import asyncio
+import heapq
+import logging
+import time
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional
+
+if TYPE_CHECKING:
+    from .storage import ReminderStore
+
+logger = logging.getLogger("Myr.reminders.scheduler")
+
+# Only reminders due within this many seconds are kept in memory
+WINDOW = 60 * 60
+# How many reminders can be sending at once
+MAX_DELIVERIES = 10
+
+
+class Reminder:
+    __slots__ = ("id", "user_id", "channel_id", "content", "time")
+
+    def __init__(self, id: int, user_id: int, channel_id: int, content: str, time: float):
+        self.id: int = id
+        self.user_id: int = user_id
+        self.channel_id: int = channel_id
+        self.content: str = content
+        self.time: float = time
+
+    def __lt__(self, other: "Reminder"):
+        return (self.time, self.id) < (other.time, other.id)
+
+
+class ReminderScheduler:
+    """Fires every reminder from a single task driven by a min-heap
+
+    Only the reminders due in the next WINDOW seconds are loaded from the
+    database, the next window is read in when the current one runs out.
+    Cancelled reminders are left in the heap and skipped when they come up.
+    """
+
+    def __init__(
+        self,
+        store: "ReminderStore",
+        deliver: Callable[[Reminder], Awaitable[None]],
+        window: float = WINDOW,
+    ):
+        self.store: "ReminderStore" = store
+        self.deliver: Callable[[Reminder], Awaitable[None]] = deliver
+        self.window: float = window
+
+        self.heap: list[Reminder] = []
+        self.pending: dict[int, Reminder] = {}
+        # everything due before this is in the heap
+        self.loaded_until: float = 0
+
+        self._wake = asyncio.Event()
+        self._deliveries = asyncio.Semaphore(MAX_DELIVERIES)
+        self._task: Optional[asyncio.Task] = None
+        # deliveries in progress, the loop only keeps weak references to tasks
+        self._firing: set[asyncio.Task] = set()
+
+    def __len__(self):
+        return len(self.pending)
+
+    async def start(self):
+        await self._load_window()
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        # they're only deleted once delivered, so these go out again after a restart
+        for task in self._firing:
+            task.cancel()
+
+    async def _load_window(self):
+        start = self.loaded_until
+        end = time.time() + self.window
+
+        # start is 0 on the first load, so anything overdue gets picked up too
+        for reminder in await self.store.load_between(start, end):
+            self._push(reminder)
+
+        self.loaded_until = end
+        logger.debug(f"Loaded reminders up to {end}, {len(self)} pending")
+
+    def _push(self, reminder: Reminder):
+        self.pending[reminder.id] = reminder
+        heapq.heappush(self.heap, reminder)
+
+    def schedule(self, reminder: Reminder):
+        """Add a reminder that was just saved"""
+        if reminder.time > self.loaded_until:
+            # it'll be read in with its window
+            return
+        self._push(reminder)
+        self._wake.set()
+
+    def cancel(self, reminder_id: int) -> bool:
+        return self.pending.pop(reminder_id, None) is not None
+
+    def _next_due(self) -> Optional[Reminder]:
+        while self.heap:
+            reminder = self.heap[0]
+            if self.pending.get(reminder.id) is reminder:
+                return reminder
+            heapq.heappop(self.heap)
+        return None
+
+    async def _run(self):
+        while True:
+            reminder = self._next_due()
+            now = time.time()
+
+            if reminder is not None and reminder.time <= now:
+                heapq.heappop(self.heap)
+                del self.pending[reminder.id]
+                task = asyncio.create_task(self._fire(reminder))
+                self._firing.add(task)
+                task.add_done_callback(self._firing.discard)
+                # don't hog the loop when a lot of overdue reminders come due at once
+                await asyncio.sleep(0)
+                continue
+
+            if now >= self.loaded_until:
+                await self._load_window()
+                continue
+
+            wake_at = self.loaded_until
+            if reminder is not None:
+                wake_at = min(reminder.time, wake_at)
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=wake_at - now)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, reminder: Reminder):
+        async with self._deliveries:
+            try:
+                await self.deliver(reminder)
+            except Exception:
+                logger.exception(f"Failed to deliver reminder {reminder.id}")
+        self.store.delete(reminder.id)
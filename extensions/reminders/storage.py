@@ -0,0 +1,163 @@
+import asyncio
+import logging
+from typing import Optional
+
+import aiosqlite
+
+from .scheduler import Reminder
+
+logger = logging.getLogger("Myr.reminders.storage")
+
+# Writes wait at most this long before they hit the disk
+FLUSH_INTERVAL = 0.5
+# Flush early once this many writes are waiting
+MAX_BATCH = 1000
+
+INSERT = "INSERT INTO reminders (id, user_id, channel_id, reminder, time) VALUES (?, ?, ?, ?, ?)"
+DELETE = "DELETE FROM reminders WHERE id = ?"
+SELECT_WINDOW = (
+    "SELECT id, user_id, channel_id, reminder, time FROM reminders "
+    "WHERE time > ? AND time <= ? ORDER BY time"
+)
+
+
+class ReminderStore:
+    """Reminder storage that batches writes into periodic transactions
+
+    The database runs in WAL mode, ids are handed out from memory so adding
+    a reminder never has to query anything, and inserts and deletes are
+    grouped into one executemany each per flush. sqlite caches the prepared
+    statements since the SQL text never changes.
+    """
+
+    def __init__(self, path: str, flush_interval: float = FLUSH_INTERVAL):
+        self.path: str = path
+        self.flush_interval: float = flush_interval
+        self.db: aiosqlite.Connection = ...
+
+        self._next_id: int = 0
+        self._inserts: dict[int, Reminder] = {}
+        self._deletes: set[int] = set()
+        # the batch a flush is writing, still visible to reads until it's committed
+        self._flushing_inserts: dict[int, Reminder] = {}
+        self._flushing_deletes: set[int] = set()
+        self._flush_lock = asyncio.Lock()
+        self._flush_now = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        self.db = await aiosqlite.connect(self.path)
+        await self.db.execute("PRAGMA journal_mode=WAL")
+        # WAL keeps the database consistent with this, only the last few commits can be lost
+        await self.db.execute("PRAGMA synchronous=NORMAL")
+        await self.db.execute(
+            """CREATE TABLE IF NOT EXISTS reminders (
+             id INTEGER PRIMARY KEY AUTOINCREMENT,
+             user_id INTEGER,
+             channel_id INTEGER,
+             reminder TEXT,
+             time REAL
+        )"""
+        )
+        await self.db.execute(
+            "CREATE INDEX IF NOT EXISTS reminders_time ON reminders(time)"
+        )
+        await self.db.commit()
+
+        # the only MAX(id) query, ids come from memory after this
+        async with self.db.execute("SELECT MAX(id) FROM reminders") as cursor:
+            row = await cursor.fetchone()
+        self._next_id = (row[0] or 0) + 1
+
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        await self.db.close()
+
+    def add(self, user_id: int, channel_id: int, content: str, time: float) -> Reminder:
+        reminder = Reminder(self._next_id, user_id, channel_id, content, time)
+        self._next_id += 1
+        self._inserts[reminder.id] = reminder
+        self._queued()
+        return reminder
+
+    def delete(self, reminder_id: int):
+        if self._inserts.pop(reminder_id, None) is None:
+            self._deletes.add(reminder_id)
+            self._queued()
+
+    async def owner(self, reminder_id: int) -> Optional[int]:
+        """Get the user a reminder belongs to, None if it doesn't exist"""
+        if reminder := self._inserts.get(reminder_id) or self._flushing_inserts.get(reminder_id):
+            return reminder.user_id
+        if reminder_id in self._deletes or reminder_id in self._flushing_deletes:
+            return None
+
+        async with self.db.execute(
+            "SELECT user_id FROM reminders WHERE id = ?", (reminder_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+        return None if row is None else row[0]
+
+    async def load_between(self, start: float, end: float) -> list[Reminder]:
+        """Every reminder due in (start, end], including ones that haven't been written yet"""
+        async with self.db.execute(SELECT_WINDOW, (start, end)) as cursor:
+            rows = await cursor.fetchall()
+
+        # a flush can commit while this runs, so its batch may or may not be in the rows
+        deleted = self._deletes | self._flushing_deletes
+        reminders = {row[0]: Reminder(*row) for row in rows if row[0] not in deleted}
+        for reminder in (self._flushing_inserts | self._inserts).values():
+            if start < reminder.time <= end and reminder.id not in deleted:
+                reminders.setdefault(reminder.id, reminder)
+        return list(reminders.values())
+
+    def _queued(self):
+        if len(self._inserts) + len(self._deletes) >= MAX_BATCH:
+            self._flush_now.set()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+
+            try:
+                # shielded so close() cancelling the loop can't drop a batch halfway through
+                await asyncio.shield(self.flush())
+            except Exception:
+                logger.exception("Failed to write reminders")
+
+    async def flush(self):
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self):
+        if not self._inserts and not self._deletes:
+            return
+
+        inserts, self._inserts = self._inserts, {}
+        deletes, self._deletes = self._deletes, set()
+        self._flushing_inserts, self._flushing_deletes = inserts, deletes
+
+        try:
+            await self.db.executemany(
+                INSERT,
+                [(r.id, r.user_id, r.channel_id, r.content, r.time) for r in inserts.values()],
+            )
+            await self.db.executemany(DELETE, [(i,) for i in deletes])
+            await self.db.commit()
+        except Exception:
+            await self.db.rollback()
+            # put them back for the next attempt, without clobbering newer changes
+            self._inserts = inserts | self._inserts
+            self._deletes |= deletes
+            raise
+        finally:
+            self._flushing_inserts, self._flushing_deletes = {}, set()
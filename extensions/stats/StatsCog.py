@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import time
+from os import getenv
+from typing import Optional
+
+from aiohttp import web
+from naff import (Client, Extension, InteractionContext, check, events,
+                  is_owner, listen, slash_command)
+
+from ..utils import metrics
+from ..utils.watchdog import LAG_THRESHOLD, LoopWatchdog, instrument_commands
+
+logger = logging.getLogger("Myr.stats")
+
+# Discord's epoch, interaction ids carry the time they were created
+DISCORD_EPOCH = 1420070400000
+
+COMMANDS = metrics.counter("myr_commands_total", "Slash commands run", ("command",))
+COMMAND_SECONDS = metrics.histogram(
+    "myr_command_seconds",
+    "Time from the interaction being created to the command finishing",
+    ("command",),
+)
+metrics.gauge("myr_ffmpeg_processes", "Running ffmpeg processes", lambda: metrics.child_processes("ffmpeg"))
+
+
+def interaction_age(ctx: InteractionContext) -> float:
+    created = ((int(ctx.id) >> 22) + DISCORD_EPOCH) / 1000
+    return max(0.0, time.time() - created)
+
+
+def _format_bound(bound: float) -> str:
+    return "inf" if bound == float("inf") else f"{bound:g}s"
+
+
+def summarize(registry: metrics.Registry = metrics.registry) -> list[str]:
+    """One line per series, histograms as their count and rough percentiles"""
+    lines = []
+    for metric in registry.metrics.values():
+        for values, value in metric.values().items():
+            name = metric.name.removeprefix("myr_")
+            if values:
+                name += "{" + ",".join(values) + "}"
+
+            if isinstance(metric, metrics.Histogram):
+                p50, p95 = metric.quantile(0.5, values), metric.quantile(0.95, values)
+                lines.append(
+                    f"{name}: {value:g} (p50 <= {_format_bound(p50)}, p95 <= {_format_bound(p95)})"
+                )
+            else:
+                lines.append(f"{name}: {value:g}")
+    return lines
+
+
+class StatsCog(Extension):
+    def __init__(self, bot: Client):
+        self.bot: Client = bot
+        self.server: Optional[web.AppRunner] = None
+        self.watchdog: Optional[LoopWatchdog] = None
+
+    @listen()
+    async def on_startup(self):
+        # Off unless asked for, and only on localhost unless told otherwise
+        if port := getenv("METRICS_PORT"):
+            self.server = await metrics.serve(getenv("METRICS_HOST", "127.0.0.1"), int(port))
+
+        threshold = float(getenv("LOOP_LAG_THRESHOLD", LAG_THRESHOLD))
+        if threshold > 0:
+            self.watchdog = LoopWatchdog(threshold)
+            self.watchdog.start()
+        if getenv("LOOP_DEBUG"):
+            # every extension is loaded by the time startup fires
+            count = instrument_commands(self.bot, threshold or LAG_THRESHOLD)
+            logger.info(f"Timing the loop usage of {count} commands")
+
+    @listen()
+    async def on_command_completion(self, event: events.CommandCompletion):
+        ctx = event.ctx
+        if not isinstance(ctx, InteractionContext):
+            return
+
+        COMMANDS.inc(labels=(ctx.invoke_target,))
+        COMMAND_SECONDS.observe(interaction_age(ctx), (ctx.invoke_target,))
+
+    @slash_command("stats", description="Show the bot's runtime stats")
+    @check(is_owner())
+    async def stats(self, ctx: InteractionContext):
+        lines = summarize()
+        content = "\n".join(lines) or "Nothing recorded yet"
+        if len(content) > 1990:
+            content = content[:1980].rsplit("\n", 1)[0] + "\n..."
+        await ctx.send(f"```\n{content}\n```", ephemeral=True)
+
+    def shed(self) -> None:
+        if self.watchdog is not None:
+            self.watchdog.stop()
+        if self.server is not None:
+            try:
+                asyncio.get_running_loop().create_task(self.server.cleanup())
+            except RuntimeError:
+                # the loop's already gone, so is the server
+                pass
+        super(StatsCog, self).shed()
+
+
+def setup(bot: Client):
+    StatsCog(bot)
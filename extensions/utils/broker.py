@@ -0,0 +1,207 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Hashable, Optional
+
+from naff.api.voice.audio import BaseAudio
+
+from . import metrics
+
+logger = logging.getLogger("Myr.broker")
+
+# discord wants 20ms frames, 3840 bytes of 48kHz stereo s16le
+FRAME_SIZE = 3840
+# How many frames are kept for late subscribers, 60 seconds worth
+HISTORY_FRAMES = 3000
+# How far the decoder may run ahead of the fastest subscriber
+READ_AHEAD_FRAMES = 150
+
+
+class SharedSource:
+    """One decoder whose frames are read by any number of subscribers
+
+    Frames are kept in a ring buffer addressed by absolute frame index, every
+    subscriber has its own cursor into it. Subscribers that fall further
+    behind than the buffer reaches skip ahead to the oldest frame left.
+    """
+
+    def __init__(
+        self,
+        key: Hashable,
+        audio: BaseAudio,
+        broker: "SourceBroker",
+        history: int = HISTORY_FRAMES,
+        read_ahead: int = READ_AHEAD_FRAMES,
+    ):
+        self.key: Hashable = key
+        self.audio: BaseAudio = audio
+        self.broker: "SourceBroker" = broker
+        self.read_ahead: int = read_ahead
+
+        self.frames: deque[bytes] = deque(maxlen=history)
+        # absolute index of frames[0]
+        self.base: int = 0
+        self.finished: bool = False
+        self.closed: bool = False
+        self.subscribers: list["Subscription"] = []
+
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def head(self) -> int:
+        """Absolute index of the next frame to be decoded"""
+        return self.base + len(self.frames)
+
+    @property
+    def joinable(self) -> bool:
+        """If a new subscriber can still hear the track from the beginning"""
+        return not self.closed and self.base == 0
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._decode, daemon=True)
+                self._thread.start()
+
+    def _decode(self):
+        try:
+            while not self.closed:
+                with self._cond:
+                    while not self.closed and self._far_enough_ahead():
+                        self._cond.wait()
+                if self.closed:
+                    return
+
+                frame = self.audio.read(FRAME_SIZE)
+                if not frame:
+                    if self.audio.audio_complete:
+                        return
+                    # underrun, let the source catch up
+                    time.sleep(0.02)
+                    continue
+
+                with self._cond:
+                    if len(self.frames) == self.frames.maxlen:
+                        self.base += 1
+                    self.frames.append(frame)
+                    self._cond.notify_all()
+        except Exception:
+            logger.exception(f"Shared decoder for {self.key} crashed")
+        finally:
+            with self._cond:
+                self.finished = True
+                self._cond.notify_all()
+
+    def _far_enough_ahead(self) -> bool:
+        if not self.subscribers:
+            return len(self.frames) >= self.read_ahead
+        fastest = max(sub.cursor for sub in self.subscribers)
+        return self.head - fastest >= self.read_ahead
+
+    def subscribe(self) -> "Subscription":
+        with self._cond:
+            subscription = Subscription(self, self.base)
+            self.subscribers.append(subscription)
+            return subscription
+
+    def read(self, subscription: "Subscription") -> bytes:
+        with self._cond:
+            if subscription.cursor < self.base:
+                # fell off the back of the buffer
+                subscription.cursor = self.base
+            if subscription.cursor >= self.head:
+                return b""
+
+            frame = self.frames[subscription.cursor - self.base]
+            subscription.cursor += 1
+            self._cond.notify_all()
+            return frame
+
+    def complete_for(self, subscription: "Subscription") -> bool:
+        with self._cond:
+            return self.finished and subscription.cursor >= self.head
+
+    def unsubscribe(self, subscription: "Subscription"):
+        with self._cond:
+            if subscription in self.subscribers:
+                self.subscribers.remove(subscription)
+            if self.subscribers or self.closed:
+                return
+            self.closed = True
+            self._cond.notify_all()
+
+        # last one out tears the decoder down
+        self.audio.cleanup()
+        self.broker.discard(self)
+        logger.debug(f"Closed shared source for {self.key}")
+
+
+class Subscription(BaseAudio):
+    """A single listener's view of a SharedSource"""
+
+    locked_stream = False
+
+    def __init__(self, source: SharedSource, cursor: int):
+        self.source: SharedSource = source
+        self.cursor: int = cursor
+        self.needs_encode: bool = getattr(source.audio, "needs_encode", True)
+        self._closed: bool = False
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__}: {self.source.key} @ {self.cursor}>"
+
+    @property
+    def audio_complete(self) -> bool:
+        return self.source.complete_for(self)
+
+    def pre_buffer(self) -> None:
+        self.source.start()
+
+    def read(self, frame_size: int) -> bytes:
+        self.source.start()
+        return self.source.read(self)
+
+    def cleanup(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self.source.unsubscribe(self)
+
+
+class SourceBroker:
+    """Hands out subscriptions so guilds playing the same track share a decoder"""
+
+    def __init__(self):
+        self.sources: dict[Hashable, SharedSource] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, key: Hashable, factory: Callable[[], BaseAudio]) -> Subscription:
+        with self._lock:
+            source = self.sources.get(key)
+            if source is None or not source.joinable:
+                # anyone still on the old source keeps it alive by themselves
+                source = self.sources[key] = SharedSource(key, factory(), self)
+            return source.subscribe()
+
+    def discard(self, source: SharedSource):
+        with self._lock:
+            if self.sources.get(source.key) is source:
+                del self.sources[source.key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sources": len(self.sources),
+                "subscribers": sum(len(s.subscribers) for s in self.sources.values()),
+            }
+
+
+broker = SourceBroker()
+
+metrics.gauge("myr_shared_sources", "Decoders shared between guilds", lambda: broker.stats()["sources"])
+metrics.gauge(
+    "myr_shared_subscribers",
+    "Guilds listening to a shared decoder",
+    lambda: broker.stats()["subscribers"],
+)
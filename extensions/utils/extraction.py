@@ -0,0 +1,292 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from enum import IntEnum
+from os import getenv
+from typing import Optional
+
+from yt_dlp import YoutubeDL
+
+from . import metrics
+
+logger = logging.getLogger("Myr.extraction")
+
+EXTRACTION_SECONDS = metrics.histogram(
+    "myr_extraction_seconds", "Time spent extracting, including the wait for a worker", ("backend",)
+)
+EXTRACTION_ERRORS = metrics.counter(
+    "myr_extraction_errors_total", "Extractions that raised", ("backend",)
+)
+EXTRACTION_WAIT = metrics.histogram(
+    "myr_extraction_wait_seconds", "Time extractions spent queued for a worker", ("priority",)
+)
+
+# How many extractions one guild can have running at once by default
+PER_GUILD_CONCURRENCY = 2
+
+
+class Priority(IntEnum):
+    """Which extractions go first, a lower class only runs when no higher one is waiting"""
+
+    # someone is waiting on it right now, /play, searches and songs that are up next
+    INTERACTIVE = 0
+    # songs coming up soon
+    PREFETCH = 1
+    # filling in playlists
+    BULK = 2
+
+# Each worker (thread or process) keeps its own YoutubeDL per option set,
+# YoutubeDL isn't safe to share between threads
+_local = threading.local()
+
+
+def _options_key(options: dict) -> str:
+    return repr(sorted(options.items()))
+
+
+def _get_ytdl(options: dict) -> YoutubeDL:
+    instances: dict[str, YoutubeDL] = getattr(_local, "instances", None)
+    if instances is None:
+        instances = _local.instances = {}
+
+    key = _options_key(options)
+    if (ytdl := instances.get(key)) is None:
+        ytdl = instances[key] = YoutubeDL(options)
+    return ytdl
+
+
+def _warm_worker(options: dict):
+    # Building a YoutubeDL loads all the extractors, do it before the first request
+    _get_ytdl(options)
+
+
+def _extract(link: str, options: dict, download: bool) -> dict:
+    return _get_ytdl(options).extract_info(link, download=download)
+
+
+def _extract_sanitized(link: str, options: dict, download: bool) -> dict:
+    # Info dicts and errors have to be pickled to get out of the worker process
+    ytdl = _get_ytdl(options)
+    try:
+        return ytdl.sanitize_info(ytdl.extract_info(link, download=download))
+    except Exception as e:
+        raise WorkerError(f"{e.__class__.__name__}: {e}") from None
+
+
+class WorkerError(Exception):
+    """An extraction error that was raised in a worker process"""
+
+    def __init__(self, msg: str):
+        super().__init__(msg)
+        self.msg = msg
+
+
+class ExtractionScheduler:
+    """Hands out extraction slots by priority, and fairly between guilds
+
+    Each priority class keeps a queue of waiters per guild, and the guilds
+    take turns, one extraction each (deficit round robin where everything
+    costs the same). So a guild filling a 5000 song playlist gets the same
+    share as one that queued a single song. No more than `max_concurrency`
+    extractions run at once, and no more than `per_guild` for any one guild.
+    Extractions that don't belong to a guild share a turn and aren't capped.
+    """
+
+    def __init__(self, max_concurrency: int, per_guild: int = PER_GUILD_CONCURRENCY):
+        self.max_concurrency: int = max_concurrency
+        self.per_guild: int = per_guild
+
+        self._waiting: list[OrderedDict[Optional[int], deque[asyncio.Future]]] = [
+            OrderedDict() for _ in Priority
+        ]
+        self._guild_running: dict[int, int] = {}
+
+        self.pending: int = 0
+        self.running: int = 0
+
+    def _has_room(self, guild_id: Optional[int]) -> bool:
+        return guild_id is None or self._guild_running.get(guild_id, 0) < self.per_guild
+
+    def _take(self, guild_id: Optional[int]):
+        self.running += 1
+        if guild_id is not None:
+            self._guild_running[guild_id] = self._guild_running.get(guild_id, 0) + 1
+
+    def release(self, guild_id: Optional[int]):
+        self.running -= 1
+        if guild_id is not None:
+            if (running := self._guild_running[guild_id] - 1) > 0:
+                self._guild_running[guild_id] = running
+            else:
+                del self._guild_running[guild_id]
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.running < self.max_concurrency and self._grant_next():
+            pass
+
+    def _grant_next(self) -> bool:
+        for waiting in self._waiting:
+            # guilds in the order of their turns, ones at their cap sit this round out
+            for guild_id in waiting:
+                if not self._has_room(guild_id):
+                    continue
+
+                waiters = waiting[guild_id]
+                future = waiters.popleft()
+                if waiters:
+                    waiting.move_to_end(guild_id)
+                else:
+                    del waiting[guild_id]
+
+                self._take(guild_id)
+                future.set_result(None)
+                return True
+        return False
+
+    async def acquire(self, guild_id: Optional[int], priority: Priority):
+        """Wait for a slot, give it back with `release` once done"""
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[priority].setdefault(guild_id, deque()).append(future)
+        self._dispatch()
+
+        self.pending += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # got the slot just as it was cancelled, pass it on
+                self.release(guild_id)
+            else:
+                waiters = self._waiting[priority].get(guild_id)
+                if waiters is not None:
+                    waiters.remove(future)
+                    if not waiters:
+                        del self._waiting[priority][guild_id]
+            raise
+        finally:
+            self.pending -= 1
+            EXTRACTION_WAIT.observe(time.perf_counter() - start, (priority.name.lower(),))
+
+
+class ExtractionService:
+    """Runs yt-dlp extraction on a dedicated pool shared by the whole process
+
+    The "thread" backend keeps a YoutubeDL per worker thread, the "process"
+    backend moves the parsing out of the GIL entirely and pre-warms a
+    YoutubeDL in every worker. Either way no more than `max_concurrency`
+    extractions run at once, the rest wait their turn on the event loop,
+    in the order the scheduler picks.
+    """
+
+    def __init__(
+        self,
+        backend: str = "thread",
+        workers: int = 4,
+        max_concurrency: Optional[int] = None,
+        warm_options: Optional[dict] = None,
+        per_guild: int = PER_GUILD_CONCURRENCY,
+    ):
+        if backend not in ("thread", "process"):
+            raise ValueError(f"Unknown extraction backend {backend!r}")
+
+        self.backend: str = backend
+        self.workers: int = workers
+        self.max_concurrency: int = max_concurrency or workers
+
+        self._executor: Executor
+        if backend == "process":
+            self._executor = ProcessPoolExecutor(
+                workers,
+                initializer=_warm_worker if warm_options else None,
+                initargs=(warm_options,) if warm_options else (),
+            )
+            self._worker = _extract_sanitized
+        else:
+            self._executor = ThreadPoolExecutor(
+                workers,
+                thread_name_prefix="extraction",
+                initializer=_warm_worker if warm_options else None,
+                initargs=(warm_options,) if warm_options else (),
+            )
+            self._worker = _extract
+
+        self.scheduler = ExtractionScheduler(self.max_concurrency, per_guild)
+
+        logger.info(f"Extraction service started with {workers} {backend} workers")
+
+    @property
+    def pending(self) -> int:
+        return self.scheduler.pending
+
+    @property
+    def running(self) -> int:
+        return self.scheduler.running
+
+    async def extract(
+        self,
+        link: str,
+        options: dict,
+        download: bool = False,
+        guild_id: Optional[int] = None,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> dict:
+        start = time.perf_counter()
+        await self.scheduler.acquire(guild_id, priority)
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, self._worker, link, options, download
+            )
+        except Exception:
+            EXTRACTION_ERRORS.inc(labels=(self.backend,))
+            raise
+        finally:
+            self.scheduler.release(guild_id)
+            EXTRACTION_SECONDS.observe(time.perf_counter() - start, (self.backend,))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_service: Optional[ExtractionService] = None
+
+
+def get_extraction_service(warm_options: Optional[dict] = None) -> ExtractionService:
+    """Get the process-wide extraction service, creating it on first use
+
+    The backend and pool size come from EXTRACTION_BACKEND and EXTRACTION_WORKERS,
+    the cap for a single guild from EXTRACTION_PER_GUILD.
+    """
+    global _service
+    if _service is None:
+        _service = ExtractionService(
+            backend=getenv("EXTRACTION_BACKEND", "thread"),
+            workers=int(getenv("EXTRACTION_WORKERS", 4)),
+            warm_options=warm_options,
+            per_guild=int(getenv("EXTRACTION_PER_GUILD", PER_GUILD_CONCURRENCY)),
+        )
+    return _service
+
+
+metrics.gauge(
+    "myr_extraction_pending",
+    "Extractions waiting for a free worker",
+    lambda: _service.pending if _service else 0,
+)
+metrics.gauge(
+    "myr_extraction_running",
+    "Extractions running on a worker",
+    lambda: _service.running if _service else 0,
+)
+
+
+def shutdown_extraction_service():
+    global _service
+    if _service is not None:
+        _service.shutdown()
+        _service = None
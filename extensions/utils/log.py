@@ -1,5 +1,11 @@
 import logging
+from os import getenv
 
 logger = logging.getLogger("Myr")
+logger.setLevel(getenv("LOG_LEVEL", "INFO"))
 
-fileHandle = logging.FileHandler()
+fileHandle = logging.FileHandler(getenv("LOG_FILE", "myr.log"), encoding="utf-8")
+fileHandle.setFormatter(
+    logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+)
+logger.addHandler(fileHandle)
@@ -0,0 +1,253 @@
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional, Union
+
+from aiohttp import web
+
+logger = logging.getLogger("Myr.metrics")
+
+# Seconds, covers everything from a cache hit to a slow playlist page
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+LabelValues = tuple[str, ...]
+
+
+def _format_labels(names: tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    type: str = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name: str = name
+        self.help: str = help
+        self.labels: tuple[str, ...] = labels
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        for values, value in self.values().items():
+            yield f"{self.name}{_format_labels(self.labels, values)} {_format_value(value)}"
+
+    def values(self) -> dict[LabelValues, float]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Only goes up, a plain dict add per increment"""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, labels: LabelValues = ()):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def values(self) -> dict[LabelValues, float]:
+        return self._values
+
+
+class Gauge(Metric):
+    """A value read when the metrics are collected, nothing happens on the hot path
+
+    `func` returns either a number, or a dict of label values to numbers.
+    """
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        func: Callable[[], Union[float, dict[LabelValues, float]]],
+        labels: tuple[str, ...] = (),
+    ):
+        super().__init__(name, help, labels)
+        self.func = func
+
+    def values(self) -> dict[LabelValues, float]:
+        try:
+            value = self.func()
+        except Exception:
+            logger.exception(f"Failed to collect {self.name}")
+            return {}
+        return value if isinstance(value, dict) else {(): value}
+
+
+class Histogram(Metric):
+    """Fixed buckets, an observation is a bisect and two adds"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets: tuple[float, ...] = tuple(sorted(buckets))
+        # per label values: counts for each bucket plus +Inf, then the sum
+        self._counts: dict[LabelValues, list[int]] = {}
+        self._sums: dict[LabelValues, float] = {}
+
+    def observe(self, value: float, labels: LabelValues = ()):
+        if (counts := self._counts.get(labels)) is None:
+            counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+        counts[bisect_left(self.buckets, value)] += 1
+        self._sums[labels] = self._sums.get(labels, 0.0) + value
+
+    @contextmanager
+    def time(self, labels: LabelValues = ()):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, labels)
+
+    def count(self, labels: LabelValues = ()) -> int:
+        return sum(self._counts.get(labels, ()))
+
+    def quantile(self, q: float, labels: LabelValues = ()) -> Optional[float]:
+        """Upper bound of the bucket the quantile falls in, inf if it's past the last"""
+        counts = self._counts.get(labels)
+        if not counts:
+            return None
+        target = q * sum(counts)
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        for values, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = _format_labels(self.labels, values, f'le="{bound}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            total = cumulative + counts[-1]
+            le = _format_labels(self.labels, values, 'le="+Inf"')
+            yield f"{self.name}_bucket{le} {total}"
+
+            labels = _format_labels(self.labels, values)
+            yield f"{self.name}_sum{labels} {_format_value(self._sums[values])}"
+            yield f"{self.name}_count{labels} {total}"
+
+    def values(self) -> dict[LabelValues, float]:
+        return {values: sum(counts) for values, counts in self._counts.items()}
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        # reloading an extension defines its metrics again, keep the old ones and their values
+        if (existing := self.metrics.get(metric.name)) is not None:
+            if type(existing) is not type(metric):
+                raise ValueError(f"{metric.name} is already a {existing.type}")
+            if isinstance(existing, Gauge):
+                existing.func = metric.func
+            return existing
+
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Everything in the Prometheus text format"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def counter(name: str, help: str, labels: tuple[str, ...] = ()) -> Counter:
+    return registry.register(Counter(name, help, labels))
+
+
+def gauge(
+    name: str,
+    help: str,
+    func: Callable[[], Union[float, dict[LabelValues, float]]],
+    labels: tuple[str, ...] = (),
+) -> Gauge:
+    return registry.register(Gauge(name, help, func, labels))
+
+
+def histogram(
+    name: str,
+    help: str,
+    labels: tuple[str, ...] = (),
+    buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+) -> Histogram:
+    return registry.register(Histogram(name, help, labels, buckets))
+
+
+def child_processes(name: str) -> int:
+    """How many of this process's children are running `name`, only works on Linux"""
+    total = 0
+    try:
+        tasks = os.listdir("/proc/self/task")
+    except OSError:
+        return 0
+
+    for task in tasks:
+        try:
+            with open(f"/proc/self/task/{task}/children") as file:
+                children = file.read().split()
+        except OSError:
+            continue
+        for pid in children:
+            try:
+                with open(f"/proc/{pid}/comm") as file:
+                    total += file.read().strip() == name
+            except OSError:
+                # exited while we were looking
+                continue
+    return total
+
+
+def rss_bytes() -> int:
+    """This process's resident memory, only works on Linux"""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return 0
+
+
+async def serve(host: str, port: int) -> web.AppRunner:
+    """Serve the registry at /metrics for Prometheus to scrape"""
+
+    async def handle(_request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Optional
+
+from naff import Message
+from naff.api.http.route import Route
+from naff.client.errors import HTTPException
+
+from . import metrics
+
+logger = logging.getLogger("Myr.notifier")
+
+# Notifications that come in within this long of each other go out as one message
+COALESCE_WINDOW = 1.0
+# Lines kept per channel while they wait to go out, the oldest get dropped past this
+MAX_PENDING_LINES = 20
+MAX_MESSAGE_LENGTH = 2000
+
+NOTIFICATIONS = metrics.counter(
+    "myr_notifications_total", "Queue notifications by what happened to them", ("result",)
+)
+metrics.gauge("myr_notifiers", "Channels with a notifier", lambda: len(_notifiers))
+
+
+class ChannelNotifier:
+    """Turns a channel's stream of queue notifications into as few requests as possible
+
+    Lines that come in within COALESCE_WINDOW go out together as one
+    message. Now playing is a status rather than a line, a newer one
+    replaces one that hasn't gone out yet, and when nothing else was sent
+    in between it's edited into the last now playing message instead of
+    sending a new one. While the channel's rate limit bucket is used up,
+    everything keeps merging until it resets, and past MAX_PENDING_LINES
+    the oldest lines are dropped, so a busy guild never builds a backlog.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+
+        self._lines: deque[str] = deque()
+        self._status: Optional[str] = None
+        # the last message sent, while it only holds now playing it gets edited
+        self._status_message: Optional[Message] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def notify(self, line: str):
+        if len(self._lines) >= MAX_PENDING_LINES:
+            self._lines.popleft()
+            NOTIFICATIONS.inc(labels=("dropped",))
+        self._lines.append(line)
+        self._schedule()
+
+    def now_playing(self, status: str):
+        if self._status is not None:
+            NOTIFICATIONS.inc(labels=("superseded",))
+        self._status = status
+        self._schedule()
+
+    def _schedule(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def _bucket_wait(self, method: str, path: str, **params) -> float:
+        """How long the HTTP client's bucket for a route needs to reset, 0 if it has room
+
+        The bucket only changes when a response comes in, so this is how
+        long it needed as of the last response, not a live countdown.
+        """
+        lock = self.channel._client.http.get_ratelimit(Route(method, path, **params))
+        if lock.remaining == 0 or lock.locked:
+            return max(lock.delta, 0.1)
+        return 0.0
+
+    async def _run(self):
+        try:
+            while self._lines or self._status is not None:
+                await asyncio.sleep(COALESCE_WINDOW)
+                # anything that comes in while the bucket resets gets merged in too, it's
+                # only waited out once, naff's own lock holds the send if that wasn't enough
+                if delay := self._bucket_wait(
+                    "POST", "/channels/{channel_id}/messages", channel_id=self.channel.id
+                ):
+                    await asyncio.sleep(delay)
+
+                try:
+                    await self._flush()
+                except HTTPException as e:
+                    logger.warning(f"Couldn't send queue notifications to {self.channel.id}: {e}")
+        finally:
+            self._task = None
+
+    async def _flush(self):
+        lines, status = list(self._lines), self._status
+        self._lines.clear()
+        self._status = None
+        if len(lines) > 1:
+            NOTIFICATIONS.inc(len(lines) - 1, ("merged",))
+
+        if not lines and status is not None and self._status_message is not None:
+            try:
+                await self._status_message.edit(content=status)
+            except HTTPException:
+                # deleted, most likely, send a new one instead
+                self._status_message = None
+            else:
+                NOTIFICATIONS.inc(labels=("edited",))
+                return
+
+        if status is not None:
+            lines.append(status)
+        content = "\n".join(lines)
+        if len(content) > MAX_MESSAGE_LENGTH:
+            # the newest lines matter most
+            content = "...\n" + content[-(MAX_MESSAGE_LENGTH - 4):].partition("\n")[2]
+
+        message = await self.channel.send(content)
+        NOTIFICATIONS.inc(labels=("sent",))
+        self._status_message = message if not lines[:-1] and status is not None else None
+
+
+_notifiers: dict[int, ChannelNotifier] = {}
+
+
+def get_notifier(channel) -> ChannelNotifier:
+    """The channel's notifier, shared by every queue that reports to it"""
+    if (notifier := _notifiers.get(channel.id)) is None:
+        notifier = _notifiers[channel.id] = ChannelNotifier(channel)
+    return notifier
+
+
+def discard_notifier(channel_id: int):
+    """Forget a channel's notifier, whatever it still has queued goes out first"""
+    _notifiers.pop(channel_id, None)
@@ -0,0 +1,152 @@
+import logging
+import queue
+import struct
+import subprocess
+import threading
+from pathlib import Path
+from typing import Optional, Union
+
+from naff.api.voice.audio import BaseAudio
+
+logger = logging.getLogger("Myr.opus")
+
+# capture pattern, version, header type, granule position, serial, sequence, crc, segments
+OGG_PAGE_HEADER = struct.Struct("<4sBBqIIIB")
+OPUS_HEADERS = (b"OpusHead", b"OpusTags")
+# Passthrough plays the packets as they are, so everything else defaults to this to sound the same
+UNITY_GAIN = 1.0
+
+
+def is_opus(entry: dict) -> bool:
+    """If an extracted entry can be sent to discord without re-encoding"""
+    return entry.get("acodec") == "opus"
+
+
+class OpusPassthroughAudio(BaseAudio):
+    """Sends the Opus packets of a WebM/Ogg source to discord as they are
+
+    ffmpeg only remuxes the stream into Ogg (`-c:a copy`), which costs next
+    to nothing compared to decoding and re-encoding it. The Ogg pages are
+    split back into packets here. There's no volume control, anything that
+    needs to touch the samples has to use the regular transcoding audio.
+    """
+
+    needs_encode = False
+    locked_stream = False
+
+    def __init__(self, src: Union[str, Path], before_args: str = "") -> None:
+        self.source = str(src)
+        self.ffmpeg_before_args = before_args
+        self.process: Optional[subprocess.Popen] = None
+
+        self.buffer_packets = 150  # 3 seconds of 20ms frames
+        self.packets: queue.Queue[bytes] = queue.Queue(self.buffer_packets)
+        self.initialised = threading.Event()
+        self._reader: Optional[threading.Thread] = None
+        self._finished = threading.Event()
+        self._closed = threading.Event()
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__}: {self.source}>"
+
+    @property
+    def audio_complete(self) -> bool:
+        return self._finished.is_set() and self.packets.empty()
+
+    def _create_process(self, *, block: bool = True) -> None:
+        cmd = [
+            "ffmpeg",
+            *self.ffmpeg_before_args.split(),
+            "-i",
+            self.source,
+            "-vn",
+            "-c:a",
+            "copy",
+            "-f",
+            "ogg",
+            "-loglevel",
+            "warning",
+            "pipe:1",
+        ]
+        self.process = subprocess.Popen(  # noqa: S603
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL
+        )
+        self._reader = threading.Thread(target=self._read_pages, daemon=True)
+        self._reader.start()
+
+        if block:
+            self.initialised.wait()
+
+    def pre_buffer(self) -> None:
+        """Start the remuxer without waiting for data"""
+        if self.process is None:
+            self._create_process(block=False)
+
+    def _read_exact(self, size: int) -> bytes:
+        data = self.process.stdout.read(size)
+        if len(data) != size:
+            raise EOFError
+        return data
+
+    def _put(self, packet: bytes) -> None:
+        # a full queue blocks, but never past cleanup
+        while not self._closed.is_set():
+            try:
+                self.packets.put(packet, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise EOFError
+
+    def _read_pages(self) -> None:
+        packet = bytearray()
+        try:
+            while True:
+                header = OGG_PAGE_HEADER.unpack(self._read_exact(OGG_PAGE_HEADER.size))
+                if header[0] != b"OggS":
+                    logger.warning(f"Lost Ogg sync while reading {self.source}")
+                    break
+
+                lacing = self._read_exact(header[-1])
+                body = memoryview(self._read_exact(sum(lacing)))
+
+                position = 0
+                for size in lacing:
+                    packet += body[position : position + size]
+                    position += size
+                    # a lacing value under 255 ends the packet, 255 means it continues
+                    if size < 255:
+                        if not packet.startswith(OPUS_HEADERS):
+                            self._put(bytes(packet))
+                            self.initialised.set()
+                        packet.clear()
+        except (EOFError, ValueError):
+            # ValueError when the pipe gets closed by cleanup
+            pass
+        finally:
+            self._finished.set()
+            self.initialised.set()
+
+    def read(self, frame_size: int) -> bytes:
+        """Get the next Opus packet, frame_size is ignored since packets are already framed"""
+        if self.process is None:
+            self._create_process()
+        self.initialised.wait()
+
+        try:
+            return self.packets.get_nowait()
+        except queue.Empty:
+            return b""
+
+    def cleanup(self) -> None:
+        self._closed.set()
+        if self.process:
+            if self.process.poll() is None:
+                self.process.kill()
+                self.process.wait()
+            self.process.stdout.close()
+        # the reader gives up on its next put, or hits the closed pipe
+        if self._reader is not None and self._reader is not threading.current_thread():
+            self._reader.join(timeout=1)
+        while not self.packets.empty():
+            self.packets.get_nowait()
@@ -0,0 +1,226 @@
+import asyncio
+import gc
+import logging
+import subprocess
+import time
+from os import getenv
+from typing import Callable, Optional
+
+from naff import Client
+
+from . import metrics
+from .broker import SharedSource, Subscription
+
+logger = logging.getLogger("Myr.reaper")
+
+CHECK_INTERVAL = 15
+# Seconds before each policy disconnects a guild, 0 turns a policy off.
+# Nothing playing or queued
+EMPTY_TIMEOUT = 5 * 60
+# No commands, even if something's still playing
+IDLE_TIMEOUT = 2 * 60 * 60
+# Nobody but bots in the vc
+ALONE_TIMEOUT = 60
+# How long players get to stop and clean up after a disconnect before their ffmpeg is killed
+STOP_GRACE = 1
+
+REAPED = metrics.counter(
+    "myr_reaped_guilds_total", "Guilds disconnected and released by the reaper, by why", ("reason",)
+)
+RECLAIMED = metrics.counter(
+    "myr_reaped_bytes_total", "Drop in RSS after reaping, as far as it can be measured"
+)
+FFMPEG_REAPED = metrics.counter(
+    "myr_reaped_ffmpeg_total", "ffmpeg processes that went away with reaped guilds"
+)
+FFMPEG_KILLED = metrics.counter(
+    "myr_reaped_ffmpeg_killed_total", "ffmpeg processes of reaped guilds that had to be killed"
+)
+
+# Whether an owner is holding anything for a guild: None if not, otherwise if it's busy
+StateFunc = Callable[[int], Optional[bool]]
+ReleaseFunc = Callable[[int], None]
+
+
+class IdleReaper:
+    """Disconnects guilds nobody is using anymore, and releases what they were holding
+
+    The music cogs register as owners, telling the reaper whether they hold
+    anything for a guild and if it's busy (playing or with songs queued),
+    and how to release it. They also `touch` a guild on every command. Every
+    CHECK_INTERVAL each guild is checked against the policies, the first one
+    that's been true for long enough disconnects it, every owner releases
+    its queue, players and ffmpeg processes, and the freed memory is logged.
+    The reaper is the one that leaves the vc, owners only let go of their
+    state. Whatever ffmpeg is still running for a reaped guild once its
+    player had STOP_GRACE to clean up gets killed.
+    """
+
+    def __init__(
+        self,
+        empty_timeout: float = EMPTY_TIMEOUT,
+        idle_timeout: float = IDLE_TIMEOUT,
+        alone_timeout: float = ALONE_TIMEOUT,
+        interval: float = CHECK_INTERVAL,
+    ):
+        self.empty_timeout: float = empty_timeout
+        self.idle_timeout: float = idle_timeout
+        self.alone_timeout: float = alone_timeout
+        self.interval: float = interval
+
+        self.bot: Optional[Client] = None
+        self.owners: dict[str, tuple[StateFunc, ReleaseFunc]] = {}
+
+        # monotonic times, by guild id
+        self.activity: dict[int, float] = {}
+        self._quiet_since: dict[int, float] = {}
+        self._alone_since: dict[int, float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, name: str, state: StateFunc, release: ReleaseFunc):
+        self.owners[name] = (state, release)
+
+    def unregister(self, name: str):
+        self.owners.pop(name, None)
+
+    def touch(self, guild_id: int):
+        """Something happened in a guild, the idle timeout starts over"""
+        self.activity[guild_id] = time.monotonic()
+
+    def start(self, bot: Client):
+        self.bot = bot
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception:
+                logger.exception("Failed to check for idle guilds")
+
+    def _forget(self, guild_id: int):
+        self.activity.pop(guild_id, None)
+        self._quiet_since.pop(guild_id, None)
+        self._alone_since.pop(guild_id, None)
+
+    def _reason(self, guild_id: int, now: float) -> Optional[str]:
+        """The policy a guild has broken, if any"""
+        states = [state(guild_id) for state, _ in self.owners.values()]
+        holding = any(busy is not None for busy in states)
+        voice = self.bot.get_bot_voice_state(guild_id)
+
+        if voice is None or not voice.connected:
+            if holding:
+                return "disconnected"
+            # nothing left to release
+            self._forget(guild_id)
+            return None
+
+        if self.alone_timeout:
+            if any(not member.bot for member in voice.channel.voice_members):
+                self._alone_since.pop(guild_id, None)
+            elif now - self._alone_since.setdefault(guild_id, now) >= self.alone_timeout:
+                return "alone"
+
+        if self.empty_timeout:
+            if any(states):
+                self._quiet_since.pop(guild_id, None)
+            elif now - self._quiet_since.setdefault(guild_id, now) >= self.empty_timeout:
+                return "empty"
+
+        if self.idle_timeout and now - self.activity.setdefault(guild_id, now) >= self.idle_timeout:
+            return "idle"
+        return None
+
+    async def check(self):
+        now = time.monotonic()
+        guild_ids = set(self.activity) | set(self.bot.cache.bot_voice_state_cache)
+        due = {}
+        for guild_id in guild_ids:
+            if reason := self._reason(guild_id, now):
+                due[guild_id] = reason
+        if due:
+            await self.reap(due)
+
+    async def reap(self, guilds: dict[int, str]):
+        """Disconnect and release guilds, given as guild id to the reason why"""
+        rss, ffmpeg = metrics.rss_bytes(), metrics.child_processes("ffmpeg")
+        processes = []
+
+        for guild_id, reason in guilds.items():
+            voice = self.bot.get_bot_voice_state(guild_id)
+            if voice is not None:
+                processes.extend(_processes(voice.current_audio))
+
+            for name, (_, release) in self.owners.items():
+                try:
+                    release(guild_id)
+                except Exception:
+                    logger.exception(f"{name} failed to release guild {guild_id}")
+
+            if voice is not None:
+                try:
+                    await voice.disconnect()
+                except Exception as e:
+                    logger.warning(f"Couldn't leave the vc in guild {guild_id}: {e}")
+            self._forget(guild_id)
+            REAPED.inc(labels=(reason,))
+
+        # players clean up once they've stopped, give the disconnects a moment
+        await asyncio.sleep(STOP_GRACE)
+        killed = sum(_kill(process, shared) for process, shared in processes)
+        FFMPEG_KILLED.inc(killed)
+
+        gc.collect()
+        freed = max(0, rss - metrics.rss_bytes())
+        gone = max(0, ffmpeg - metrics.child_processes("ffmpeg"))
+        RECLAIMED.inc(freed)
+        FFMPEG_REAPED.inc(gone)
+
+        reaped = ", ".join(f"{guild_id} ({reason})" for guild_id, reason in guilds.items())
+        logger.info(
+            f"Reaped guilds {reaped}: {freed / 1024 / 1024:.1f} MB freed, "
+            f"{gone} ffmpeg processes gone, {killed} of them killed"
+        )
+
+
+def _processes(audio) -> list[tuple[subprocess.Popen, Optional[SharedSource]]]:
+    """The ffmpeg process behind a guild's audio, with the source if other guilds share it"""
+    shared = None
+    if isinstance(audio, Subscription):
+        shared = audio.source
+        audio = shared.audio
+    if (process := getattr(audio, "process", None)) is None:
+        return []
+    return [(process, shared)]
+
+
+def _kill(process: subprocess.Popen, shared: Optional[SharedSource]) -> bool:
+    if process.poll() is not None:
+        return False
+    if shared is not None and not shared.closed:
+        # another guild is still listening to it
+        return False
+    process.kill()
+    process.wait()
+    return True
+
+
+def _timeout(name: str, default: float) -> float:
+    return float(getenv(name, default))
+
+
+reaper = IdleReaper(
+    empty_timeout=_timeout("REAPER_EMPTY_TIMEOUT", EMPTY_TIMEOUT),
+    idle_timeout=_timeout("REAPER_IDLE_TIMEOUT", IDLE_TIMEOUT),
+    alone_timeout=_timeout("REAPER_ALONE_TIMEOUT", ALONE_TIMEOUT),
+)
+
+metrics.gauge("myr_reaper_tracked_guilds", "Guilds the reaper is watching", lambda: len(reaper.activity))
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from itertools import count
+from typing import Optional
+
+from . import metrics
+from .extraction import get_extraction_service
+
+logger = logging.getLogger("Myr.search")
+
+# Flat results are enough for suggestions, nothing past the search page gets fetched
+SEARCH_OPTS = {"quiet": True, "no_warnings": True, "extract_flat": True, "skip_download": True}
+SEARCH_RESULTS = 10
+SEARCH_TTL = 10 * 60
+MAX_QUERIES = 1024
+# A shorter cached query answers a longer one if this many of its results still match
+MIN_PREFIX_MATCHES = 3
+# Shorter queries aren't worth searching for
+MIN_QUERY_LENGTH = 3
+# How long someone has to stop typing before their query is searched
+DEBOUNCE = 0.3
+# Discord's limits for autocomplete choices
+MAX_CHOICES = 25
+MAX_CHOICE_LENGTH = 100
+
+_requests = count()
+
+LOOKUPS = metrics.counter(
+    "myr_search_lookups_total", "Song searches by how they were answered", ("result",)
+)
+
+
+def normalize(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def is_url(query: str) -> bool:
+    return "://" in query or query.startswith(("www.", "youtube.com", "youtu.be"))
+
+
+class SearchResult:
+    __slots__ = ("id", "title", "duration", "uploader", "_text")
+
+    def __init__(self, id: str, title: str, duration: Optional[float], uploader: Optional[str]):
+        self.id: str = id
+        self.title: str = title
+        self.duration: Optional[float] = duration
+        self.uploader: Optional[str] = uploader
+        self._text: str = normalize(f"{title} {uploader or ''}")
+
+    @classmethod
+    def from_entry(cls, entry: dict) -> "SearchResult":
+        return cls(
+            entry["id"],
+            entry.get("title") or entry["id"],
+            entry.get("duration"),
+            entry.get("uploader") or entry.get("channel"),
+        )
+
+    @property
+    def url(self) -> str:
+        return f"https://www.youtube.com/watch?v={self.id}"
+
+    def matches(self, words: list[str]) -> bool:
+        return all(word in self._text for word in words)
+
+    def choice(self) -> dict:
+        """An autocomplete choice, picking it hands /play the video itself"""
+        name = self.title
+        if self.duration:
+            minutes, seconds = divmod(int(self.duration), 60)
+            name = f"{name} ({minutes}:{seconds:02})"
+        if len(name) > MAX_CHOICE_LENGTH:
+            name = name[: MAX_CHOICE_LENGTH - 3] + "..."
+        return {"name": name, "value": self.url}
+
+
+class SearchCache:
+    """ytsearch results shared by everyone, for autocomplete and free text /play
+
+    Results are kept per normalized query for SEARCH_TTL. A query that
+    only extends a cached one ("never gonna g" after "never gonna") is
+    answered by filtering the cached results, as long as enough of them
+    still match. Identical searches that overlap share one extraction.
+    """
+
+    def __init__(self, ttl: float = SEARCH_TTL, max_queries: int = MAX_QUERIES):
+        self.ttl: float = ttl
+        self.max_queries: int = max_queries
+
+        self._results: OrderedDict[str, tuple[float, list[SearchResult]]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._latest: dict[int, int] = {}
+
+    def _get(self, query: str) -> Optional[list[SearchResult]]:
+        entry = self._results.get(query)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._results[query]
+            return None
+        self._results.move_to_end(query)
+        return entry[1]
+
+    def cached(self, query: str) -> Optional[list[SearchResult]]:
+        """Results for a query without searching, None if there aren't any"""
+        query = normalize(query)
+        if (results := self._get(query)) is not None:
+            LOOKUPS.inc(labels=("hit",))
+            return results
+
+        words = query.split()
+        for end in range(len(query) - 1, MIN_QUERY_LENGTH - 1, -1):
+            if (results := self._get(query[:end])) is None:
+                continue
+            matching = [result for result in results if result.matches(words)]
+            if len(matching) >= MIN_PREFIX_MATCHES:
+                LOOKUPS.inc(labels=("prefix_hit",))
+                return matching
+            # the longest cached prefix didn't narrow down well, a shorter one won't either
+            break
+        return None
+
+    async def search(self, query: str) -> list[SearchResult]:
+        if (results := self.cached(query)) is not None:
+            return results
+
+        query = normalize(query)
+        task = self._inflight.get(query)
+        if task is None:
+            LOOKUPS.inc(labels=("miss",))
+            task = self._inflight[query] = asyncio.create_task(self._fetch(query))
+            task.add_done_callback(lambda _: self._inflight.pop(query, None))
+        else:
+            LOOKUPS.inc(labels=("coalesced",))
+        # one caller giving up doesn't cancel the search for everyone else
+        return await asyncio.shield(task)
+
+    async def _fetch(self, query: str) -> list[SearchResult]:
+        data = await get_extraction_service().extract(
+            f"ytsearch{SEARCH_RESULTS}:{query}", SEARCH_OPTS
+        )
+        results = [
+            SearchResult.from_entry(entry)
+            for entry in data.get("entries") or ()
+            if entry and entry.get("id")
+        ]
+
+        self._results[query] = (time.monotonic() + self.ttl, results)
+        if len(self._results) > self.max_queries:
+            self._results.popitem(last=False)
+        return results
+
+    async def debounce(self, user_id: int) -> bool:
+        """Wait out a user's typing, False if they sent something newer meanwhile"""
+        request = self._latest[user_id] = next(_requests)
+        await asyncio.sleep(DEBOUNCE)
+        if self._latest.get(user_id) != request:
+            return False
+        del self._latest[user_id]
+        return True
+
+
+search_cache = SearchCache()
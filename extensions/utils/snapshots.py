@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import time
+from os import getenv
+from typing import Optional, Protocol
+
+import aiosqlite
+import orjson
+
+logger = logging.getLogger("Myr.snapshots")
+
+# Seconds between batched writes
+SNAPSHOT_INTERVAL = 15
+# Snapshots older than this are too stale to bother restoring
+MAX_SNAPSHOT_AGE = 24 * 60 * 60
+
+
+class Snapshottable(Protocol):
+    running: bool
+
+    def snapshot(self) -> Optional[dict]:
+        """The queue's state, or None if there's nothing worth keeping"""
+        ...
+
+
+class SnapshotStore:
+    """Periodically saves the state of every queue so it survives restarts
+
+    Queues mark themselves dirty whenever they change, and only those get
+    written, in one transaction per interval. A playing song is saved with
+    the time it started at, so its position doesn't need rewriting; while
+    anything plays, a heartbeat row records how long the bot was still
+    alive, and the position is worked out from both when loading.
+
+    A snapshot is a dict of::
+
+        kind (which cog it belongs to), guild_id, text_channel_id, voice_channel_id, loop, loopqueue, volume,
+        position (seconds into entries[0]), started_at (when entries[0] started playing from its
+        beginning, None if it isn't playing), entries ([{url, title, duration}])
+    """
+
+    def __init__(self, path: str, interval: float = SNAPSHOT_INTERVAL):
+        self.path: str = path
+        self.interval: float = interval
+        self.db: Optional[aiosqlite.Connection] = None
+
+        self.queues: dict[int, Snapshottable] = {}
+        self._dirty: set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._connect_lock = asyncio.Lock()
+
+    async def connect(self):
+        """Open the database, both music cogs call this so it's safe to repeat"""
+        async with self._connect_lock:
+            if self.db is not None:
+                return
+
+            self.db = await aiosqlite.connect(self.path)
+            await self.db.execute(
+                """CREATE TABLE IF NOT EXISTS queue_snapshots (
+                 guild_id INTEGER PRIMARY KEY,
+                 snapshot BLOB,
+                 updated REAL
+            )"""
+            )
+            await self.db.execute(
+                """CREATE TABLE IF NOT EXISTS snapshot_heartbeat (
+                 id INTEGER PRIMARY KEY CHECK (id = 0),
+                 alive REAL
+            )"""
+            )
+            await self.db.commit()
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.db is not None:
+            await self.flush(final=True)
+            await self.db.close()
+            self.db = None
+
+    def register(self, guild_id: int, queue: Snapshottable):
+        self.queues[guild_id] = queue
+        self._dirty.add(guild_id)
+
+    def unregister(self, guild_id: int):
+        """Stop tracking a guild and drop its snapshot on the next flush"""
+        self.queues.pop(guild_id, None)
+        self._dirty.add(guild_id)
+
+    def mark_dirty(self, guild_id: int):
+        self._dirty.add(guild_id)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to save queue snapshots")
+
+    async def flush(self, final: bool = False):
+        """Write the dirty queues, `final` when shutting down"""
+        if self.db is None:
+            return
+
+        guild_ids, self._dirty = self._dirty, set()
+        writes = []
+        deletes = []
+        now = time.time()
+        for guild_id in guild_ids:
+            queue = self.queues.get(guild_id)
+            snapshot = queue.snapshot() if queue is not None else None
+            if snapshot is None:
+                if final and queue is not None:
+                    # most likely out of the vc already because we're stopping, keep the last one
+                    continue
+                deletes.append((guild_id,))
+            else:
+                writes.append((guild_id, orjson.dumps(snapshot), now))
+
+        playing = any(queue.running for queue in self.queues.values())
+        if not writes and not deletes and not playing:
+            return
+
+        if playing:
+            await self.db.execute(
+                "INSERT OR REPLACE INTO snapshot_heartbeat VALUES (0, ?)", (now,)
+            )
+        await self.db.executemany(
+            "INSERT OR REPLACE INTO queue_snapshots VALUES (?, ?, ?)", writes
+        )
+        await self.db.executemany(
+            "DELETE FROM queue_snapshots WHERE guild_id = ?", deletes
+        )
+        await self.db.commit()
+        logger.debug(f"Saved {len(writes)} queue snapshots, dropped {len(deletes)}")
+
+    async def load(self, kind: str) -> list[dict]:
+        """Get every recent snapshot saved by one kind of queue"""
+        async with self.db.execute(
+            "SELECT snapshot, updated FROM queue_snapshots WHERE updated > ?",
+            (time.time() - MAX_SNAPSHOT_AGE,),
+        ) as cursor:
+            rows = await cursor.fetchall()
+        async with self.db.execute("SELECT alive FROM snapshot_heartbeat") as cursor:
+            heartbeat = await cursor.fetchone()
+        await self.db.execute(
+            "DELETE FROM queue_snapshots WHERE updated <= ?",
+            (time.time() - MAX_SNAPSHOT_AGE,),
+        )
+        await self.db.commit()
+
+        snapshots = []
+        for data, updated in rows:
+            snapshot = orjson.loads(data)
+            if snapshot.get("kind") != kind:
+                continue
+            if (started_at := snapshot.get("started_at")) is not None:
+                # it kept playing until the last heartbeat, or at least until it was saved
+                alive = max(heartbeat[0] if heartbeat else 0, updated)
+                snapshot["position"] = max(0.0, alive - started_at)
+            snapshots.append(snapshot)
+        return snapshots
+
+
+_store: Optional[SnapshotStore] = None
+
+
+def get_snapshot_store() -> Optional[SnapshotStore]:
+    """Get the snapshot store, or None if QUEUE_SNAPSHOT_DB isn't set
+
+    Snapshots can be marked dirty right away, they're written once connected.
+    """
+    global _store
+    if _store is None and (path := getenv("QUEUE_SNAPSHOT_DB")):
+        _store = SnapshotStore(path)
+    return _store
@@ -0,0 +1,186 @@
+import asyncio
+import functools
+import logging
+import sys
+import threading
+import time
+import traceback
+from types import FrameType
+from typing import Any, Callable, Coroutine, Optional
+
+from naff import Client, InteractionCommand
+
+from . import metrics
+
+logger = logging.getLogger("Myr.watchdog")
+
+# How long the loop may go without running the watchdog before it's called stuck
+LAG_THRESHOLD = 0.1
+CHECK_INTERVAL = 0.05
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+LOOP_LAG = metrics.histogram(
+    "myr_loop_lag_seconds", "How late the watchdog's wakeups ran", buckets=LAG_BUCKETS
+)
+LOOP_STALLS = metrics.counter("myr_loop_stalls_total", "Times the loop was stuck past the threshold")
+COMMAND_BLOCKING = metrics.histogram(
+    "myr_command_blocking_seconds",
+    "Time a command spent running on the loop without yielding, only with LOOP_DEBUG",
+    ("command",),
+    buckets=LAG_BUCKETS,
+)
+
+
+def _find_context(frame: Optional[FrameType]) -> Optional[Any]:
+    """The innermost InteractionContext in a stack, looked up by duck typing"""
+    while frame is not None:
+        ctx = frame.f_locals.get("ctx")
+        if ctx is not None and hasattr(ctx, "invoke_target"):
+            return ctx
+        frame = frame.f_back
+    return None
+
+
+def _describe(ctx: Optional[Any], task: Optional[asyncio.Task]) -> str:
+    if ctx is not None:
+        return f"/{ctx.invoke_target} in guild {getattr(ctx, 'guild_id', None)}"
+    if task is not None:
+        return f"task {task.get_name()} ({task.get_coro()!r})"
+    return "a plain callback"
+
+
+class LoopWatchdog:
+    """Measures event loop lag, and catches whatever is blocking it in the act
+
+    A task on the loop bumps a heartbeat every CHECK_INTERVAL and records how
+    late it woke up. A thread watches that heartbeat. Once it's older than
+    the threshold, the loop is stuck inside some callback right now, so the
+    thread grabs the loop thread's stack and logs it, together with the
+    command and guild when there's an InteractionContext on the stack. Each
+    stall is reported once, however long it lasts.
+    """
+
+    def __init__(self, threshold: float = LAG_THRESHOLD, interval: float = CHECK_INTERVAL):
+        self.threshold: float = threshold
+        self.interval: float = interval
+
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._heartbeat: float = 0
+        self._task: Optional[asyncio.Task] = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.perf_counter()
+        self._stopped.clear()
+
+        self._task = asyncio.create_task(self._beat())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        logger.info(f"Watching the event loop, stalls over {self.threshold}s get reported")
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _beat(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            self._heartbeat = now = time.perf_counter()
+            LOOP_LAG.observe(max(0.0, now - expected))
+
+    def _watch(self):
+        reported = False
+        while not self._stopped.wait(self.interval):
+            stalled = time.perf_counter() - self._heartbeat
+            if stalled <= self.threshold + self.interval:
+                reported = False
+            elif not reported:
+                reported = True
+                LOOP_STALLS.inc()
+                self._report(stalled)
+
+    def _report(self, stalled: float):
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+
+        task = asyncio.current_task(self.loop)
+        where = _describe(_find_context(frame), task)
+        stack = "".join(traceback.format_stack(frame))
+        logger.warning(f"Event loop blocked for {stalled:.3f}s and counting by {where}:\n{stack}")
+
+
+class _StepTimer:
+    """Drives a coroutine a step at a time, timing how long each step holds the loop"""
+
+    def __init__(self, coro: Coroutine, name: str, ctx: Optional[Any], threshold: float):
+        self.coro: Coroutine = coro
+        self.name: str = name
+        self.ctx: Optional[Any] = ctx
+        self.threshold: float = threshold
+
+    def __await__(self):
+        total = longest = 0.0
+        send, value = self.coro.send, None
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    future = send(value)
+                except StopIteration as e:
+                    return e.value
+                finally:
+                    step = time.perf_counter() - start
+                    total += step
+                    longest = max(longest, step)
+
+                try:
+                    value = yield future
+                    send = self.coro.send
+                except GeneratorExit:
+                    self.coro.close()
+                    raise
+                except BaseException as e:
+                    value = e
+                    send = self.coro.throw
+        finally:
+            COMMAND_BLOCKING.observe(total, (self.name,))
+            if longest > self.threshold:
+                logger.warning(
+                    f"{_describe(self.ctx, None)} held the loop for {longest:.3f}s in one go "
+                    f"({total:.3f}s in total)"
+                )
+
+
+def _timed(callback: Callable, name: str, threshold: float) -> Callable:
+    # wraps keeps the signature, naff reads it to work out the command's arguments
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        ctx = next((arg for arg in args if hasattr(arg, "invoke_target")), None)
+        return await _StepTimer(callback(*args, **kwargs), name, ctx, threshold)
+
+    wrapper.timed = True
+    return wrapper
+
+
+def instrument_commands(bot: Client, threshold: float = LAG_THRESHOLD) -> int:
+    """Time every step of every loaded slash command, for finding what blocks
+
+    Costs a couple of perf_counter calls per await in each command, so it's
+    meant for debugging rather than leaving on.
+    """
+    instrumented = 0
+    for extension in bot.ext.values():
+        for command in extension._commands:
+            if not isinstance(command, InteractionCommand):
+                continue
+            if getattr(command.callback, "timed", False):
+                continue
+            command.callback = _timed(command.callback, command.resolved_name, threshold)
+            instrumented += 1
+    return instrumented
@@ -5,6 +5,9 @@ from dotenv import load_dotenv
 from loguru import logger
 from naff import Client, listen
 
+import extensions.utils.log  # noqa: F401, sets up the Myr log file
+from extensions.utils.snapshots import get_snapshot_store
+
 bot = Client(sync_interactions=True)
 
 
@@ -15,6 +18,8 @@ async def on_ready():
 
 bot.load_extension("extensions.new_music.NewMusic")
 bot.load_extension("extensions.misc.SpeechBubble")
+bot.load_extension("extensions.misc.Petpet")
+bot.load_extension("extensions.stats.StatsCog")
 # bot.load_extension("reminders.RemindersCog")
 # do a reminder thing sometime?
 # and maybe a welcome message db
@@ -24,10 +29,14 @@ bot.start(getenv("TOKEN"))
 
 # cleaning up
 
-# noinspection PyUnresolvedReferences
-# db = bot.get_scale("RemindersCog").db
-# loop = asyncio.get_event_loop()
-# loop.run_until_complete(db.close())
-
 for scale in bot.ext.values():
     scale.shed()
+
+# the last changes to the queues would be lost otherwise
+if store := get_snapshot_store():
+    asyncio.run(store.close())
+
+# same for reminders that haven't been written yet
+# noinspection PyUnresolvedReferences
+if (reminders := bot.get_ext("RemindersCog")) and reminders.store is not ...:
+    asyncio.run(reminders.store.close())